@@ -0,0 +1 @@
+"""TextEmbed benchmarks"""
@@ -0,0 +1,163 @@
+"""Benchmark of the import time of the CLI and the application.
+
+Imports modules of the package in fresh interpreters with
+`python -X importtime` and parses the report. Every module reports its
+median cumulative import time, the heavy libraries it imported and the
+direct imports taking the most time. The command exits with status 1 when
+a module imports a library it must leave to the engines, such as torch for
+the CLI, or when the CLI takes longer than `--max-ms` to import, so that a
+module level import of the model libraries does not slip back in.
+
+Example:
+    python -m benchmarks.importtime --rounds 5 --max-ms 500
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+import typer
+
+app = typer.Typer(add_completion=False)
+
+# Libraries loaded once the engines start, not with the CLI
+MODEL_LIBRARIES = ("torch", "sentence_transformers", "transformers", "PIL")
+
+# Libraries a module must not import, by module
+FORBIDDEN_IMPORTS: Dict[str, Tuple[str, ...]] = {
+    "textembed": MODEL_LIBRARIES + ("fastapi",),
+    "textembed.server": MODEL_LIBRARIES
+    + ("fastapi", "uvicorn", "prometheus_client", "numpy"),
+    "textembed.application.application": MODEL_LIBRARIES,
+    "textembed.binary.client": MODEL_LIBRARIES + ("fastapi",),
+}
+
+# Module whose import time is held to `--max-ms`
+CLI_MODULE = "textembed.server"
+
+
+@dataclass
+class ImportEntry:
+    """A line of the `-X importtime` report.
+
+    Attributes:
+        name (str): Name of the imported module.
+        depth (int): Nesting level of the import, 0 for the top-level ones.
+        self_us (int): Time of the module itself, in microseconds.
+        cumulative_us (int): Time of the module and of its imports, in microseconds.
+    """
+
+    name: str
+    depth: int
+    self_us: int
+    cumulative_us: int
+
+
+def parse_report(stderr: str) -> List[ImportEntry]:
+    """Parse the `-X importtime` report of an interpreter.
+
+    Args:
+        stderr (str): The standard error of the interpreter.
+
+    Returns:
+        List[ImportEntry]: The imports, each one after its own imports.
+    """
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        entries.append(
+            ImportEntry(name.strip(), depth, int(self_us), int(cumulative_us))
+        )
+    return entries
+
+
+def import_tree(module: str) -> List[ImportEntry]:
+    """Import a module in a fresh interpreter and get its imports.
+
+    Args:
+        module (str): The module.
+
+    Raises:
+        RuntimeError: If the import fails.
+
+    Returns:
+        List[ImportEntry]: The module, its packages and the modules they imported.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        env=os.environ.copy(),
+        check=False,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr}")
+    entries = parse_report(result.stderr)
+    # The packages of the module are imported first, at the top level too
+    parts = module.split(".")
+    packages = {".".join(parts[: i + 1]) for i in range(len(parts))}
+    tree: List[ImportEntry] = []
+    for end, entry in enumerate(entries):
+        if entry.depth or entry.name not in packages:
+            continue
+        start = end
+        while start > 0 and entries[start - 1].depth > 0:
+            start -= 1
+        tree.extend(entries[start : end + 1])
+    return tree
+
+
+@app.command()
+def main(
+    modules: str = typer.Option(
+        ",".join(FORBIDDEN_IMPORTS), help="Comma-separated modules to import."
+    ),
+    rounds: int = typer.Option(5, help="Measured imports per module."),
+    max_ms: float = typer.Option(
+        500.0, help=f"Largest median import time of {CLI_MODULE} accepted, in ms."
+    ),
+    top: int = typer.Option(5, help="Number of slowest direct imports reported."),
+):
+    """Measure the import time of modules and check the libraries they import."""
+    failed: List[str] = []
+    for module in [value.strip() for value in modules.split(",") if value.strip()]:
+        # The first import compiles the bytecode of the modules
+        import_tree(module)
+        trees = [import_tree(module) for _ in range(rounds)]
+        median_ms = (
+            statistics.median(
+                sum(entry.cumulative_us for entry in tree if not entry.depth)
+                for tree in trees
+            )
+            / 1e3
+        )
+
+        imported = {entry.name.split(".")[0] for entry in trees[-1]}
+        heavy = sorted(imported & set(FORBIDDEN_IMPORTS.get(module, ())))
+        typer.echo(f"{module}: {median_ms:.1f} ms")
+        if heavy:
+            failed.append(f"{module} imports {', '.join(heavy)}")
+        if module == CLI_MODULE and median_ms > max_ms:
+            failed.append(f"{module} takes {median_ms:.1f} ms, more than {max_ms} ms")
+
+        direct = sorted(
+            (entry for entry in trees[-1] if entry.depth == 1),
+            key=lambda entry: entry.cumulative_us,
+            reverse=True,
+        )
+        for entry in direct[:top]:
+            typer.echo(f"  {entry.cumulative_us / 1e3:>9.1f} ms  {entry.name}")
+
+    if failed:
+        typer.echo("Import guard failed: " + "; ".join(failed) + ".")
+        raise typer.Exit(code=1)
+
+
+if __name__ == "__main__":
+    app()
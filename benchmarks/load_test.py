@@ -0,0 +1,352 @@
+"""End-to-end load test of the TextEmbed server.
+
+Starts the application in-process on a local port, drives `/v1/embedding` with
+an open-loop Poisson arrival process and reports throughput, latency
+percentiles, batch fill ratio, CPU use and peak resident memory as JSON.
+
+Example:
+    python -m benchmarks.load_test run --rate 200 --duration 20 --output base.json
+    python -m benchmarks.load_test compare base.json head.json
+"""
+
+import asyncio
+import json
+import random
+import socket
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import httpx
+import numpy as np
+import typer
+import uvicorn
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - not available on Windows
+    resource = None  # type: ignore
+
+from benchmarks.tiny_model import DEFAULT_MODEL_DIR, WORDS, build_tiny_model
+from benchmarks.utils import machine_info
+from textembed.application.application import create_application
+from textembed.engine.args import AsyncEngineArgs
+
+app = typer.Typer(add_completion=False)
+
+# Keys of the report compared between runs, with whether higher is better
+COMPARED_KEYS = {
+    "throughput_rps": True,
+    "throughput_inputs_per_s": True,
+    "latency_p50_ms": False,
+    "latency_p95_ms": False,
+    "latency_p99_ms": False,
+    "batch_fill_ratio": True,
+    "cpu_percent": False,
+    "peak_rss_mb": False,
+}
+
+
+@dataclass
+class BatchStats:
+    """Number of texts of the batches processed by an engine during the load test."""
+
+    sizes: List[int] = field(default_factory=list)
+
+    def wrap(self, method):
+        """Wrap a batch processing method of an embedder to record batch sizes."""
+
+        def wrapper(sentences, *args, **kwargs):
+            self.sizes.append(len(sentences))
+            return method(sentences, *args, **kwargs)
+
+        return wrapper
+
+
+def free_port() -> int:
+    """Find a free local TCP port."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def sample_length(rng: random.Random, dist: str, min_len: int, max_len: int) -> int:
+    """Sample a value between `min_len` and `max_len` from a distribution.
+
+    Args:
+        rng (random.Random): Random generator.
+        dist (str): One of `fixed`, `uniform` or `lognormal`.
+        min_len (int): Minimum value, the value of the `fixed` distribution.
+        max_len (int): Maximum value.
+
+    Returns:
+        int: The sampled value.
+    """
+    if dist == "fixed" or min_len >= max_len:
+        return min_len
+    if dist == "uniform":
+        return rng.randint(min_len, max_len)
+    if dist == "lognormal":
+        # Median at the geometric mean of the bounds, with a long right tail
+        median = (min_len * max_len) ** 0.5
+        value = rng.lognormvariate(np.log(median), 0.6)
+        return int(min(max(value, min_len), max_len))
+    raise typer.BadParameter(f"Unknown distribution `{dist}`.")
+
+
+class Server(uvicorn.Server):
+    """Uvicorn server running in a background thread."""
+
+    def install_signal_handlers(self):
+        pass
+
+    def __enter__(self) -> "Server":
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        while not self.started:
+            if not self.thread.is_alive():
+                raise RuntimeError("The server failed to start.")
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.should_exit = True
+        self.thread.join()
+
+
+async def wait_ready(client: httpx.AsyncClient, timeout: float = 300.0):
+    """Wait until every model of the server is loaded."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        response = await client.get("/ready")
+        if response.status_code == 200:
+            return
+        await asyncio.sleep(0.1)
+    raise TimeoutError("The server did not become ready in time.")
+
+
+async def drive(
+    client: httpx.AsyncClient,
+    model: str,
+    rate: float,
+    duration: float,
+    inputs_dist: str,
+    min_inputs: int,
+    max_inputs: int,
+    length_dist: str,
+    min_words: int,
+    max_words: int,
+    seed: int,
+) -> Dict:
+    """Send requests with Poisson arrivals and record their latencies.
+
+    Requests are sent at their scheduled time whether or not earlier requests
+    completed, so a saturated server shows up as growing latency instead of a
+    lower sending rate.
+
+    Returns:
+        Dict: Raw results of the load test.
+    """
+    rng = random.Random(seed)
+    latencies: List[float] = []
+    inputs_sent: List[int] = []
+    errors: Dict[str, int] = {}
+
+    async def send(payload: dict):
+        start = time.perf_counter()
+        try:
+            response = await client.post("/v1/embedding", json=payload)
+        except httpx.HTTPError as e:
+            errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+            return
+        if response.status_code != 200:
+            errors[str(response.status_code)] = (
+                errors.get(str(response.status_code), 0) + 1
+            )
+            return
+        latencies.append(time.perf_counter() - start)
+        inputs_sent.append(len(payload["input"]))
+
+    tasks = []
+    start = time.perf_counter()
+    next_arrival = start
+    while True:
+        next_arrival += rng.expovariate(rate)
+        if next_arrival - start > duration:
+            break
+        num_inputs = sample_length(rng, inputs_dist, min_inputs, max_inputs)
+        payload = {
+            "model": model,
+            "input": [
+                " ".join(
+                    rng.choices(
+                        WORDS, k=sample_length(rng, length_dist, min_words, max_words)
+                    )
+                )
+                for _ in range(num_inputs)
+            ],
+        }
+        await asyncio.sleep(max(next_arrival - time.perf_counter(), 0))
+        tasks.append(asyncio.create_task(send(payload)))
+    await asyncio.gather(*tasks)
+    return {
+        "elapsed": time.perf_counter() - start,
+        "requests": len(tasks),
+        "latencies": latencies,
+        "inputs": inputs_sent,
+        "errors": errors,
+    }
+
+
+@app.command()
+def run(
+    model: str = typer.Option(
+        None, help="Model to serve. A tiny random model is built when not given."
+    ),
+    rate: float = typer.Option(100.0, help="Mean request arrival rate per second."),
+    duration: float = typer.Option(10.0, help="Duration of the load in seconds."),
+    warmup: float = typer.Option(2.0, help="Duration of the unmeasured warm-up."),
+    inputs_dist: str = typer.Option(
+        "uniform", help="Distribution of inputs per request: fixed, uniform, lognormal."
+    ),
+    min_inputs: int = typer.Option(1, help="Minimum number of inputs per request."),
+    max_inputs: int = typer.Option(8, help="Maximum number of inputs per request."),
+    length_dist: str = typer.Option(
+        "lognormal", help="Distribution of words per input: fixed, uniform, lognormal."
+    ),
+    min_words: int = typer.Option(4, help="Minimum number of words per input."),
+    max_words: int = typer.Option(128, help="Maximum number of words per input."),
+    batch_size: int = typer.Option(32, help="Server batch size, in requests."),
+    embedding_dtype: str = typer.Option("float32", help="Server embedding dtype."),
+    seed: int = typer.Option(0, help="Seed of the load generator."),
+    output: Optional[str] = typer.Option(None, help="Write the JSON report here."),
+):
+    """Run a load test against an in-process server and print a JSON report."""
+    model = model or build_tiny_model(DEFAULT_MODEL_DIR)
+    engine_args = AsyncEngineArgs(
+        model=model,
+        served_model_name="benchmark",
+        batch_size=batch_size,
+        embedding_dtype=embedding_dtype,
+    )
+    application = create_application(engine_args_list=[engine_args], doc_extra={})
+    port = free_port()
+    config = uvicorn.Config(application, host="127.0.0.1", port=port, log_level="error")
+    stats = BatchStats()
+
+    async def main() -> Dict:
+        limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+        async with httpx.AsyncClient(
+            base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=None
+        ) as client:
+            await wait_ready(client)
+            load = dict(
+                client=client,
+                model="benchmark",
+                rate=rate,
+                inputs_dist=inputs_dist,
+                min_inputs=min_inputs,
+                max_inputs=max_inputs,
+                length_dist=length_dist,
+                min_words=min_words,
+                max_words=max_words,
+            )
+            if warmup > 0:
+                await drive(duration=warmup, seed=seed + 1, **load)
+
+            embedder = application.state.async_engine_array["benchmark"].model
+            embedder.process_batch = stats.wrap(embedder.process_batch)
+            embedder.process_shared_batch = stats.wrap(embedder.process_shared_batch)
+            cpu_start = time.process_time()
+            results = await drive(duration=duration, seed=seed, **load)
+            results["cpu_time"] = time.process_time() - cpu_start
+            return results
+
+    with Server(config):
+        results = asyncio.run(main())
+
+    latencies_ms = np.array(results["latencies"]) * 1000
+    completed = len(latencies_ms)
+    percentiles = np.percentile(latencies_ms, [50, 95, 99]) if completed else [None] * 3
+    report = {
+        **machine_info(),
+        "config": {
+            "model": model,
+            "rate": rate,
+            "duration": duration,
+            "inputs_dist": inputs_dist,
+            "min_inputs": min_inputs,
+            "max_inputs": max_inputs,
+            "length_dist": length_dist,
+            "min_words": min_words,
+            "max_words": max_words,
+            "batch_size": batch_size,
+            "embedding_dtype": embedding_dtype,
+            "seed": seed,
+        },
+        "results": {
+            "requests": results["requests"],
+            "completed": completed,
+            "errors": results["errors"],
+            "throughput_rps": completed / results["elapsed"],
+            "throughput_inputs_per_s": sum(results["inputs"]) / results["elapsed"],
+            "latency_mean_ms": float(latencies_ms.mean()) if completed else None,
+            "latency_p50_ms": percentiles[0] and float(percentiles[0]),
+            "latency_p95_ms": percentiles[1] and float(percentiles[1]),
+            "latency_p99_ms": percentiles[2] and float(percentiles[2]),
+            "latency_max_ms": float(latencies_ms.max()) if completed else None,
+            "batches": len(stats.sizes),
+            "mean_batch_texts": float(np.mean(stats.sizes)) if stats.sizes else None,
+            # The server batch size counts requests, every batch holds whole requests
+            "mean_batch_requests": (
+                completed / len(stats.sizes) if stats.sizes else None
+            ),
+            "batch_fill_ratio": (
+                completed / len(stats.sizes) / batch_size if stats.sizes else None
+            ),
+            # Covers the load generator too, which shares the process
+            "cpu_percent": 100 * results["cpu_time"] / results["elapsed"],
+            # Peak of the whole process, in KiB on Linux
+            "peak_rss_mb": (
+                resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+                if resource is not None
+                else None
+            ),
+        },
+    }
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    typer.echo(text)
+
+
+@app.command()
+def compare(
+    baseline: str = typer.Argument(..., help="JSON report of the baseline run."),
+    candidate: str = typer.Argument(..., help="JSON report of the candidate run."),
+):
+    """Print the relative change of the main metrics between two reports."""
+    with open(baseline, encoding="utf-8") as f:
+        base = json.load(f)
+    with open(candidate, encoding="utf-8") as f:
+        head = json.load(f)
+    if base["config"] != head["config"]:
+        typer.echo("Warning: the reports were produced with different settings.")
+
+    typer.echo(
+        f"{'metric':<26}{base['commit']!s:>12}{head['commit']!s:>12}{'change':>10}"
+    )
+    for key, higher_is_better in COMPARED_KEYS.items():
+        before, after = base["results"].get(key), head["results"].get(key)
+        if before is None or after is None:
+            continue
+        change = (after - before) / before * 100 if before else 0.0
+        better = (change > 0) == higher_is_better
+        mark = "" if abs(change) < 1 else (" +" if better else " -")
+        typer.echo(f"{key:<26}{before:>12.2f}{after:>12.2f}{change:>9.1f}%{mark}")
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,238 @@
+"""Microbenchmarks of the embedder stages.
+
+Times every stage of `SentenceTransformerEmbedder` (preprocess,
+transfer_to_device, generate_embeddings, postprocess and the whole
+process_batch) across batch sizes, sequence lengths and embedding dtypes, in
+the spirit of pytest-benchmark: every case is calibrated to run for a minimum
+time and reported with min/mean/median/stddev statistics.
+
+Results can be saved as a named baseline and later runs compared against it;
+the command exits with status 1 when a case is slower than its baseline
+median by more than the threshold.
+
+Example:
+    python -m benchmarks.microbench --save base
+    python -m benchmarks.microbench --compare base --threshold 10
+"""
+
+import asyncio
+import json
+import os
+import statistics
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import torch
+import typer
+
+from benchmarks.tiny_model import DEFAULT_MODEL_DIR, WORDS, build_tiny_model
+from benchmarks.utils import machine_info
+from textembed.engine.args import AsyncEngineArgs
+from textembed.executor.embedder.sentence_transformer import SentenceTransformerEmbedder
+from textembed.executor.primitives import EmbeddingDtype
+
+STAGES = [
+    "preprocess",
+    "transfer_to_device",
+    "generate_embeddings",
+    "postprocess",
+    "process_batch",
+]
+
+app = typer.Typer(add_completion=False)
+
+
+def parse_ints(value: str) -> List[int]:
+    """Parse a comma-separated list of integers."""
+    return [int(item) for item in value.split(",") if item]
+
+
+def parse_names(value: str, choices: List[str], kind: str) -> List[str]:
+    """Parse a comma-separated list of names restricted to `choices`."""
+    names = [item for item in value.split(",") if item]
+    for name in names:
+        if name not in choices:
+            raise typer.BadParameter(f"Unknown {kind} `{name}`, choose from {choices}.")
+    return names
+
+
+async def measure(
+    func: Callable[[], Awaitable], min_time: float, min_rounds: int, warmup: int
+) -> Dict:
+    """Time an async callable, pytest-benchmark style.
+
+    Args:
+        func (Callable[[], Awaitable]): The callable to time.
+        min_time (float): Minimum total measured time in seconds.
+        min_rounds (int): Minimum number of measured rounds.
+        warmup (int): Number of unmeasured rounds run first.
+
+    Returns:
+        Dict: Timing statistics in seconds and the number of rounds.
+    """
+    for _ in range(warmup):
+        await func()
+    timings: List[float] = []
+    while len(timings) < min_rounds or sum(timings) < min_time:
+        start = time.perf_counter()
+        await func()
+        timings.append(time.perf_counter() - start)
+    return {
+        "min": min(timings),
+        "max": max(timings),
+        "mean": statistics.fmean(timings),
+        "median": statistics.median(timings),
+        "stddev": statistics.stdev(timings) if len(timings) > 1 else 0.0,
+        "rounds": len(timings),
+    }
+
+
+async def bench_case(
+    embedder: SentenceTransformerEmbedder,
+    batch_size: int,
+    seq_len: int,
+    dtype: str,
+    stages: List[str],
+    **timing,
+) -> Dict[str, Dict]:
+    """Time the selected stages for one batch size, sequence length and dtype.
+
+    Every stage gets the outputs of the previous stages as inputs, so it is
+    timed in isolation.
+
+    Returns:
+        Dict[str, Dict]: Timing statistics by stage.
+    """
+    embedder.embedding_dtype = dtype
+    # Every word is a single token, plus the [CLS] and [SEP] tokens
+    sentences = [" ".join(WORDS[i % len(WORDS)] for i in range(seq_len - 2))]
+    sentences *= batch_size
+    features, _ = await embedder.preprocess(sentences)
+    features = await embedder.transfer_to_device(features)
+    out_features = await embedder.generate_embeddings(features)
+
+    calls = {
+        "preprocess": lambda: embedder.preprocess(sentences),
+        "transfer_to_device": lambda: embedder.transfer_to_device(features),
+        "generate_embeddings": lambda: embedder.generate_embeddings(features),
+        "postprocess": lambda: embedder.postprocess(out_features),
+        "process_batch": lambda: embedder.process_batch(sentences),
+    }
+    return {stage: await measure(calls[stage], **timing) for stage in stages}
+
+
+def compare_results(
+    baseline: Dict[str, Dict], results: Dict[str, Dict], threshold: float
+) -> List[str]:
+    """Print the change of every case against a baseline.
+
+    Args:
+        baseline (Dict[str, Dict]): Timing statistics of the baseline, by case.
+        results (Dict[str, Dict]): Timing statistics of this run, by case.
+        threshold (float): Slowdown of the median, in percent, reported as a regression.
+
+    Returns:
+        List[str]: The regressed cases.
+    """
+    regressions = []
+    typer.echo(f"\n{'case':<64}{'base (us)':>12}{'now (us)':>12}{'change':>10}")
+    for name, stats in results.items():
+        if name not in baseline:
+            continue
+        before, after = baseline[name]["median"], stats["median"]
+        change = (after - before) / before * 100
+        regressed = change > threshold
+        if regressed:
+            regressions.append(name)
+        typer.echo(
+            f"{name:<64}{before * 1e6:>12.1f}{after * 1e6:>12.1f}{change:>9.1f}%"
+            + (" REGRESSION" if regressed else "")
+        )
+    return regressions
+
+
+@app.command()
+def main(
+    model: Optional[str] = typer.Option(
+        None, help="Model to benchmark. A tiny random model is built when not given."
+    ),
+    batch_sizes: str = typer.Option("1,8,32", help="Comma-separated batch sizes."),
+    seq_lens: str = typer.Option("16,128", help="Comma-separated sequence lengths."),
+    dtypes: str = typer.Option(
+        ",".join(dtype.value for dtype in EmbeddingDtype),
+        help="Comma-separated embedding dtypes.",
+    ),
+    stages: str = typer.Option(",".join(STAGES), help="Comma-separated stages."),
+    min_time: float = typer.Option(0.2, help="Minimum measured seconds per case."),
+    min_rounds: int = typer.Option(5, help="Minimum measured rounds per case."),
+    warmup: int = typer.Option(2, help="Unmeasured rounds per case."),
+    threads: Optional[int] = typer.Option(None, help="Number of torch threads."),
+    storage: str = typer.Option(
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), ".baselines"),
+        help="Directory of the saved baselines.",
+    ),
+    save: Optional[str] = typer.Option(None, help="Save the results as this baseline."),
+    compare: Optional[str] = typer.Option(None, help="Compare with this baseline."),
+    threshold: float = typer.Option(
+        10.0, help="Median slowdown, in percent, failing the comparison."
+    ),
+):
+    """Time every embedder stage and optionally save or compare a baseline."""
+    if threads is not None:
+        torch.set_num_threads(threads)
+    selected_stages = parse_names(stages, STAGES, "stage")
+    selected_dtypes = parse_names(
+        dtypes, [dtype.value for dtype in EmbeddingDtype], "dtype"
+    )
+    baseline = None
+    if compare is not None:
+        with open(os.path.join(storage, f"{compare}.json"), encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+
+    embedder = SentenceTransformerEmbedder(
+        AsyncEngineArgs(
+            model=model or build_tiny_model(DEFAULT_MODEL_DIR), served_model_name=None
+        )
+    )
+    timing = dict(min_time=min_time, min_rounds=min_rounds, warmup=warmup)
+
+    results: Dict[str, Dict] = {}
+    for batch_size in parse_ints(batch_sizes):
+        for seq_len in parse_ints(seq_lens):
+            seq_len = min(seq_len, embedder.max_seq_length)
+            for dtype in selected_dtypes:
+                case = asyncio.run(
+                    bench_case(
+                        embedder, batch_size, seq_len, dtype, selected_stages, **timing
+                    )
+                )
+                for stage, stats in case.items():
+                    name = f"{stage}[batch={batch_size},seq={seq_len},dtype={dtype}]"
+                    results[name] = stats
+                    typer.echo(
+                        f"{name:<64}{stats['median'] * 1e6:>12.1f} us"
+                        f" ({stats['rounds']} rounds)"
+                    )
+
+    if save is not None:
+        os.makedirs(storage, exist_ok=True)
+        path = os.path.join(storage, f"{save}.json")
+        report = {
+            **machine_info(),
+            "model": embedder.engine_args.model,
+            "torch_threads": torch.get_num_threads(),
+            "results": results,
+        }
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        typer.echo(f"Saved baseline to {path}")
+
+    if baseline is not None:
+        regressions = compare_results(baseline, results, threshold)
+        if regressions:
+            typer.echo(f"{len(regressions)} cases regressed by more than {threshold}%.")
+            raise typer.Exit(code=1)
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,166 @@
+"""Benchmark of sequence packing against padded execution.
+
+Embeds batches of texts whose lengths follow a log-normal distribution, from
+uniform to heavily skewed, with a padded and a packed
+`SentenceTransformerEmbedder` of the same model. Every case reports the
+share of padding tokens of the padded batches, the rows of the packed ones,
+the median forward pass time of both paths and the largest difference
+between their embeddings. The command exits with status 1 when the
+embeddings of the packed path differ by more than the tolerance.
+
+Example:
+    python -m benchmarks.packing --sigmas 0.25,1.0,1.5 --batch-size 32
+"""
+
+import asyncio
+import random
+from typing import Dict, List, Optional
+
+import torch
+import typer
+
+from benchmarks.microbench import measure
+from benchmarks.tiny_model import DEFAULT_MODEL_DIR, WORDS, build_tiny_model
+from textembed.engine.args import AsyncEngineArgs
+from textembed.executor.embedder.sentence_transformer import SentenceTransformerEmbedder
+from textembed.executor.packing import pack_sequences
+
+app = typer.Typer(add_completion=False)
+
+
+def skewed_texts(
+    rng: random.Random, count: int, median_words: int, sigma: float, max_words: int
+) -> List[str]:
+    """Generate texts with log-normally distributed numbers of words.
+
+    Args:
+        rng (random.Random): The random number generator.
+        count (int): Number of texts.
+        median_words (int): Median number of words.
+        sigma (float): Standard deviation of the log of the number of words.
+        max_words (int): Maximum number of words.
+
+    Returns:
+        List[str]: The texts.
+    """
+    texts = []
+    for _ in range(count):
+        words = round(rng.lognormvariate(0, sigma) * median_words)
+        words = min(max(words, 1), max_words)
+        texts.append(" ".join(rng.choice(WORDS) for _ in range(words)))
+    return texts
+
+
+async def bench_case(
+    padded: SentenceTransformerEmbedder,
+    packed: SentenceTransformerEmbedder,
+    batches: List[List[str]],
+    **timing,
+) -> Dict:
+    """Time and compare the padded and packed forward passes of batches.
+
+    Returns:
+        Dict: Padding share, packed rows, median times and largest difference.
+    """
+    features = []
+    for texts in batches:
+        batch_features, _ = await padded.preprocess(texts)
+        features.append(await padded.transfer_to_device(batch_features))
+
+    tokens = slots = rows = 0
+    max_diff = 0.0
+    for batch_features in features:
+        attention_mask = batch_features["attention_mask"]
+        lengths = attention_mask.sum(dim=1).tolist()
+        tokens += sum(lengths)
+        slots += attention_mask.numel()
+        rows += max(row for row, _ in pack_sequences(lengths, attention_mask.shape[1]))
+        rows += 1
+        expected = await padded.generate_embeddings(dict(batch_features))
+        actual = await packed.generate_embeddings(dict(batch_features))
+        diff = (expected["sentence_embedding"] - actual["sentence_embedding"]).abs()
+        max_diff = max(max_diff, diff.max().item())
+
+    async def run(embedder: SentenceTransformerEmbedder):
+        for batch_features in features:
+            await embedder.generate_embeddings(dict(batch_features))
+
+    padded_stats = await measure(lambda: run(padded), **timing)
+    packed_stats = await measure(lambda: run(packed), **timing)
+    return {
+        "padding": 1 - tokens / slots,
+        "padded_rows": sum(len(texts) for texts in batches),
+        "packed_rows": rows,
+        "padded": padded_stats["median"],
+        "packed": packed_stats["median"],
+        "max_diff": max_diff,
+    }
+
+
+@app.command()
+def main(
+    model: Optional[str] = typer.Option(
+        None, help="Model to benchmark. A tiny random model is built when not given."
+    ),
+    batch_size: int = typer.Option(32, help="Number of texts per batch."),
+    batches: int = typer.Option(4, help="Number of batches per case."),
+    median_words: int = typer.Option(16, help="Median number of words per text."),
+    sigmas: str = typer.Option(
+        "0.25,0.75,1.25", help="Comma-separated log-normal sigmas of the text lengths."
+    ),
+    tolerance: float = typer.Option(
+        1e-4, help="Largest embedding difference accepted from the packed path."
+    ),
+    seed: int = typer.Option(0, help="Seed of the generated texts."),
+    min_time: float = typer.Option(0.5, help="Minimum measured seconds per case."),
+    min_rounds: int = typer.Option(3, help="Minimum measured rounds per case."),
+    warmup: int = typer.Option(1, help="Unmeasured rounds per case."),
+    threads: Optional[int] = typer.Option(None, help="Number of torch threads."),
+):
+    """Compare the packed and padded forward passes on skewed text lengths."""
+    if threads is not None:
+        torch.set_num_threads(threads)
+    model = model or build_tiny_model(DEFAULT_MODEL_DIR)
+    padded = SentenceTransformerEmbedder(
+        AsyncEngineArgs(model=model, served_model_name=None)
+    )
+    packed = SentenceTransformerEmbedder(
+        AsyncEngineArgs(model=model, served_model_name=None, sequence_packing=True)
+    )
+    if packed.packed_backbone is None:
+        typer.echo(f"Sequence packing is not supported by {model}.")
+        raise typer.Exit(code=1)
+    # Leave room for the special tokens, words may be split into several tokens
+    max_words = max(padded.max_seq_length // 2, 1)
+    timing = dict(min_time=min_time, min_rounds=min_rounds, warmup=warmup)
+
+    typer.echo(
+        f"{'sigma':>6}{'padding':>10}{'rows':>12}{'padded (ms)':>14}"
+        f"{'packed (ms)':>14}{'speedup':>10}{'max diff':>12}"
+    )
+    failed = []
+    for sigma in [float(value) for value in sigmas.split(",") if value]:
+        rng = random.Random(seed)
+        case_batches = [
+            skewed_texts(rng, batch_size, median_words, sigma, max_words)
+            for _ in range(batches)
+        ]
+        case = asyncio.run(bench_case(padded, packed, case_batches, **timing))
+        if case["max_diff"] > tolerance:
+            failed.append(sigma)
+        typer.echo(
+            f"{sigma:>6.2f}{case['padding']:>9.0%}"
+            f"{case['padded_rows']:>6}->{case['packed_rows']:<4}"
+            f"{case['padded'] * 1e3:>14.1f}{case['packed'] * 1e3:>14.1f}"
+            f"{case['padded'] / case['packed']:>9.2f}x{case['max_diff']:>12.1e}"
+        )
+
+    if failed:
+        typer.echo(
+            f"The packed embeddings differ by more than {tolerance} for sigmas {failed}."
+        )
+        raise typer.Exit(code=1)
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,118 @@
+"""Benchmark of the embedding request parsing.
+
+Parses request bodies of increasing numbers of text and token id inputs
+with the pydantic path FastAPI takes for a request model, a stdlib JSON
+decoding followed by the `EmbeddingRequest` validation, and with the fast
+path of the embedding endpoint, `parse_embedding_request`. Every case
+reports the body size, the median parse time of both paths and the
+speedup. The command exits with status 1 when the fast path is slower than
+`--min-speedup` times the pydantic path in any case.
+
+Example:
+    python -m benchmarks.parsing --inputs 100,1000,10000 --words 64
+"""
+
+import asyncio
+import json
+import random
+from typing import Dict, List
+
+import orjson
+import typer
+
+from benchmarks.microbench import measure
+from benchmarks.tiny_model import WORDS
+from textembed.api.limits import RequestLimits
+from textembed.api.parsing import parse_embedding_request
+from textembed.api.schemas import EmbeddingRequest
+
+app = typer.Typer(add_completion=False)
+
+
+def request_body(rng: random.Random, inputs: int, words: int, kind: str) -> bytes:
+    """Build the body of an embedding request.
+
+    Args:
+        rng (random.Random): The random number generator.
+        inputs (int): Number of inputs.
+        words (int): Number of words, or token ids, per input.
+        kind (str): Kind of inputs, `text` or `tokens`.
+
+    Returns:
+        bytes: The JSON body.
+    """
+    if kind == "text":
+        data = [
+            " ".join(rng.choice(WORDS) for _ in range(words)) for _ in range(inputs)
+        ]
+    else:
+        data = [[rng.randrange(30000) for _ in range(words)] for _ in range(inputs)]
+    return orjson.dumps({"input": data, "model": "model"})
+
+
+async def bench_case(body: bytes, limits: RequestLimits, **timing) -> Dict:
+    """Time the pydantic and fast parsing of a request body.
+
+    Returns:
+        Dict: Median parse times of both paths.
+    """
+
+    async def pydantic_path():
+        EmbeddingRequest.model_validate(json.loads(body))
+
+    async def fast_path():
+        parse_embedding_request(body, limits)
+
+    pydantic_stats = await measure(pydantic_path, **timing)
+    fast_stats = await measure(fast_path, **timing)
+    return {"pydantic": pydantic_stats["median"], "fast": fast_stats["median"]}
+
+
+@app.command()
+def main(
+    inputs: str = typer.Option(
+        "100,1000,10000", help="Comma-separated numbers of inputs per request."
+    ),
+    words: int = typer.Option(64, help="Number of words, or token ids, per input."),
+    kinds: str = typer.Option(
+        "text,tokens", help="Comma-separated kinds of inputs, `text` or `tokens`."
+    ),
+    min_speedup: float = typer.Option(
+        1.0, help="Smallest speedup of the fast path accepted in every case."
+    ),
+    seed: int = typer.Option(0, help="Seed of the generated inputs."),
+    min_time: float = typer.Option(0.5, help="Minimum measured seconds per case."),
+    min_rounds: int = typer.Option(3, help="Minimum measured rounds per case."),
+    warmup: int = typer.Option(1, help="Unmeasured rounds per case."),
+):
+    """Compare the fast and pydantic parsing of embedding requests."""
+    timing = dict(min_time=min_time, min_rounds=min_rounds, warmup=warmup)
+    limits = RequestLimits(max_inputs=None, max_bytes=None, max_input_chars=None)
+
+    typer.echo(
+        f"{'kind':>8}{'inputs':>8}{'size (MB)':>11}{'pydantic (ms)':>15}"
+        f"{'fast (ms)':>11}{'speedup':>10}"
+    )
+    failed: List[str] = []
+    for kind in [value for value in kinds.split(",") if value]:
+        for count in [int(value) for value in inputs.split(",") if value]:
+            body = request_body(random.Random(seed), count, words, kind)
+            case = asyncio.run(bench_case(body, limits, **timing))
+            speedup = case["pydantic"] / case["fast"]
+            if speedup < min_speedup:
+                failed.append(f"{kind}/{count}")
+            typer.echo(
+                f"{kind:>8}{count:>8}{len(body) / 1e6:>11.2f}"
+                f"{case['pydantic'] * 1e3:>15.2f}{case['fast'] * 1e3:>11.2f}"
+                f"{speedup:>9.2f}x"
+            )
+
+    if failed:
+        typer.echo(
+            f"The fast path is less than {min_speedup}x faster for cases {failed}."
+        )
+        raise typer.Exit(code=1)
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,77 @@
+"""Tiny offline sentence-transformer model used by the benchmarks."""
+
+import os
+import string
+from typing import List
+
+# Words used both as the model vocabulary and to generate benchmark texts
+WORDS: List[str] = (
+    "the a of to and in is it that for on with as was by at from this be are "
+    "model text server embedding vector batch request query document search "
+    "fast slow large small token sentence word queue worker latency throughput"
+).split()
+
+DEFAULT_MODEL_DIR = os.path.join(
+    os.path.expanduser("~"), ".cache", "textembed", "benchmark-tiny-model"
+)
+
+
+def build_tiny_model(
+    path: str = DEFAULT_MODEL_DIR,
+    hidden_size: int = 64,
+    num_hidden_layers: int = 2,
+    max_seq_length: int = 256,
+) -> str:
+    """Build a small randomly initialized BERT sentence-transformer on disk.
+
+    The model is deterministic and needs no network access, so benchmark
+    results only depend on the code under test. An existing model at `path`
+    is reused.
+
+    Args:
+        path (str): Directory of the model.
+        hidden_size (int): Hidden size of the encoder.
+        num_hidden_layers (int): Number of encoder layers.
+        max_seq_length (int): Maximum sequence length of the model.
+
+    Returns:
+        str: The model directory.
+    """
+    if os.path.exists(os.path.join(path, "modules.json")):
+        return path
+
+    import torch
+    from sentence_transformers import SentenceTransformer, models
+    from transformers import BertConfig, BertModel, BertTokenizerFast
+
+    torch.manual_seed(0)
+    backbone_dir = os.path.join(path, "backbone")
+    os.makedirs(backbone_dir, exist_ok=True)
+    vocab = list(
+        dict.fromkeys(
+            ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"]
+            + WORDS
+            + list(string.ascii_lowercase + string.digits + string.punctuation)
+            + [f"##{char}" for char in string.ascii_lowercase + string.digits]
+        )
+    )
+    vocab_file = os.path.join(backbone_dir, "vocab.txt")
+    with open(vocab_file, "w", encoding="utf-8") as f:
+        f.write("\n".join(vocab))
+
+    tokenizer = BertTokenizerFast(vocab_file)
+    config = BertConfig(
+        vocab_size=len(vocab),
+        hidden_size=hidden_size,
+        num_hidden_layers=num_hidden_layers,
+        num_attention_heads=max(hidden_size // 32, 1),
+        intermediate_size=hidden_size * 4,
+        max_position_embeddings=max_seq_length,
+    )
+    BertModel(config).save_pretrained(backbone_dir)
+    tokenizer.save_pretrained(backbone_dir)
+
+    transformer = models.Transformer(backbone_dir, max_seq_length=max_seq_length)
+    pooling = models.Pooling(transformer.get_word_embedding_dimension())
+    SentenceTransformer(modules=[transformer, pooling, models.Normalize()]).save(path)
+    return path
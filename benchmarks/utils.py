@@ -0,0 +1,29 @@
+"""Helpers shared by the benchmarks."""
+
+import os
+import platform
+import subprocess
+from typing import Dict, Optional
+
+
+def git_commit() -> Optional[str]:
+    """Commit of the working tree, to compare reports across commits."""
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL,
+            text=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def machine_info() -> Dict:
+    """Description of the machine and interpreter running a benchmark."""
+    return {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+    }
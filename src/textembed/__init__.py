@@ -1,6 +1,24 @@
 __version__ = "0.0.8"
 
-from textembed.engine.args import AsyncEngineArgs
-from textembed.engine.async_engine import AsyncEngine
+import importlib
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from textembed.engine.args import AsyncEngineArgs
+    from textembed.engine.async_engine import AsyncEngine
 
 __all__ = ["AsyncEngine", "AsyncEngineArgs"]
+
+# Modules of the exports, imported on first access so that the CLI and the
+# configuration checks start without the model libraries
+_EXPORTS = {
+    "AsyncEngine": "textembed.engine.async_engine",
+    "AsyncEngineArgs": "textembed.engine.args",
+}
+
+
+def __getattr__(name: str):
+    """Import an export of the package on first access."""
+    if name in _EXPORTS:
+        return getattr(importlib.import_module(_EXPORTS[name]), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,114 @@
+"""Debugging apis"""
+
+import asyncio
+import io
+import zipfile
+
+import orjson
+from fastapi import APIRouter, Depends, Query, Response
+
+from textembed.api.dependencies import valid_admin_token_dependency
+from textembed.api.errors import ProfilerBusyException
+from textembed.log import UvicornLogLevels, get_log_level, logger, set_log_level
+from textembed.profiling import FORWARD_TRACER, SamplingProfiler
+
+debug_router = APIRouter(prefix="/debug", tags=["Debug"])
+
+_PROFILE_LOCK = asyncio.Lock()
+
+
+def _zip_files(files: dict) -> bytes:
+    """Bundle the given file contents, by file name, in a zip archive."""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, content in files.items():
+            archive.writestr(name, content)
+    return buffer.getvalue()
+
+
+@debug_router.get(
+    "/profile",
+    dependencies=[Depends(valid_admin_token_dependency)],  # type: ignore
+)
+async def profile(
+    seconds: float = Query(10.0, gt=0, le=300),
+    forward_passes: int = Query(0, ge=0, le=1000),
+    interval_ms: float = Query(5.0, ge=1, le=1000),
+) -> Response:
+    """Capture a sampling profile of the server, and optionally a model trace.
+
+    The Python stacks of the event loop and of every other thread are sampled
+    for `seconds`. With `forward_passes`, the next forward passes of the
+    models within that time are also traced with `torch.profiler`.
+
+    Args:
+        seconds (float): Duration of the capture.
+        forward_passes (int): Number of forward passes to trace.
+        interval_ms (float): Milliseconds between two stack samples.
+
+    Returns:
+        Response: The speedscope profile, or a zip archive also holding the
+                  Chrome trace of the forward passes.
+    """
+    if _PROFILE_LOCK.locked():
+        raise ProfilerBusyException()
+    async with _PROFILE_LOCK:
+        logger.info("Profiling the server for %.1f seconds.", seconds)
+        profiler = SamplingProfiler(interval=interval_ms / 1000)
+        profiler.start()
+        FORWARD_TRACER.arm(forward_passes)
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            trace = FORWARD_TRACER.collect()
+            samples = await asyncio.to_thread(profiler.stop)
+
+    speedscope = orjson.dumps(samples)
+    if not forward_passes:
+        return Response(
+            content=speedscope,
+            media_type="application/json",
+            headers={
+                "Content-Disposition": 'attachment; filename="profile.speedscope.json"'
+            },
+        )
+    files = {"profile.speedscope.json": speedscope}
+    if trace is not None:
+        files["forward.trace.json"] = orjson.dumps(trace)
+    return Response(
+        content=await asyncio.to_thread(_zip_files, files),
+        media_type="application/zip",
+        headers={"Content-Disposition": 'attachment; filename="profile.zip"'},
+    )
+
+
+@debug_router.get(
+    "/log_level",
+    dependencies=[Depends(valid_admin_token_dependency)],  # type: ignore
+)
+async def read_log_level() -> dict:
+    """Get the level of the server logs.
+
+    Returns:
+        dict: The log level.
+    """
+    return {"level": get_log_level()}
+
+
+@debug_router.put(
+    "/log_level",
+    dependencies=[Depends(valid_admin_token_dependency)],  # type: ignore
+)
+async def update_log_level(level: UvicornLogLevels = Query(...)) -> dict:
+    """Change the level of the server logs, without restarting it.
+
+    Args:
+        level (UvicornLogLevels): The new log level.
+
+    Returns:
+        dict: The previous and new log levels.
+    """
+    previous = get_log_level()
+    set_log_level(level.value)
+    logger.warning("Log level changed from %s to %s.", previous, level.value)
+    return {"previous": previous, "level": level.value}
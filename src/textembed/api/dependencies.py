@@ -26,3 +26,32 @@ def valid_token_dependency(
                 detail="Unauthorized",
                 headers={"WWW-Authenticate": "Bearer"},
             )
+
+
+def valid_admin_token_dependency(
+    request: Request,
+    credential: HTTPAuthorizationCredentials = Depends(HTTPBearer(auto_error=False)),
+):
+    """Validate the admin token of the debugging endpoints.
+
+    The debugging endpoints are disabled unless an admin key is configured.
+
+    Args:
+        request (Request): The incoming request.
+        credential (HTTPAuthorizationCredentials, optional): The extracted credentials. Defaults to Depends(HTTPBearer(auto_error=False)).
+
+    Raises:
+        HTTPException: Raised if no admin key is configured or the token is missing or invalid.
+    """
+    admin_key = request.app.state.admin_key
+    if not admin_key:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Debugging endpoints are disabled, no admin key is configured.",
+        )
+    if not credential or credential.credentials != admin_key:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Unauthorized",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
@@ -3,28 +3,48 @@
 import asyncio
 import base64
 import time
-from io import BytesIO
-from typing import List
+from typing import List, Optional, Tuple, Union
 from uuid import uuid4
 
+import numpy as np
 from fastapi import APIRouter, Depends, Request, status
 from fastapi.responses import ORJSONResponse
-from PIL import Image
 
 from textembed.api.dependencies import valid_token_dependency
-from textembed.api.errors import ModelNotFoundException
+from textembed.api.errors import (
+    EmbeddingException,
+    ImageTooLargeException,
+    InvalidImageException,
+    InvalidRequestException,
+    InvalidTokenIdsException,
+    ModelNotFoundException,
+    ModelUnavailableException,
+    PromptNotFoundException,
+)
+from textembed.api.limits import RequestLimits
+from textembed.api.parsing import parse_embedding_request, read_body, read_multipart
 from textembed.api.schemas import (
     EmbeddingData,
     EmbeddingRequest,
     EmbeddingResponse,
     ModelDetails,
     ModelList,
+    RaggedEmbeddingResponse,
     Usage,
 )
 from textembed.engine.args import AsyncEngineArgs
-from textembed.engine.async_engine import AsyncEngine
+from textembed.engine.async_engine import AsyncEngine, ModelUnavailableError
 from textembed.engine.async_engine_array import AsyncEngineArray
-from textembed.log import logger
+from textembed.executor.images import ImageTooLargeError
+from textembed.executor.outputs import RaggedEmbeddings
+from textembed.executor.primitives import OutputMode
+from textembed.executor.tokens import (
+    InvalidTokenIdsError,
+    PromptedText,
+    PromptNotFoundError,
+)
+from textembed.log import log_request
+from textembed.tracing import Trace
 
 embed_router = APIRouter(prefix="/v1", tags=["Embedding"])
 
@@ -58,6 +78,43 @@ async def get_models(request: Request) -> ModelList:
     )
 
 
+def resolve_engine(async_engine_array: AsyncEngineArray, model: str) -> AsyncEngine:
+    """Resolve a model by served model name, then by model id.
+
+    Args:
+        async_engine_array (AsyncEngineArray): The engines of the served models.
+        model (str): The requested model name.
+
+    Raises:
+        ModelNotFoundException: If the specified model is not found in the available engines.
+        ModelUnavailableException: If the model failed to load and is not retried yet.
+
+    Returns:
+        AsyncEngine: The engine corresponding to the requested model.
+    """
+    async_engine_args_list: List[AsyncEngineArgs] = async_engine_array.engine_args
+    served_model_names = [
+        engine_args.served_model_name for engine_args in async_engine_args_list
+    ]
+    model_ids = [engine_args.model for engine_args in async_engine_args_list]
+    if model in served_model_names:
+        served_model_name = model
+    elif model in model_ids:
+        served_model_name = served_model_names[model_ids.index(model)]
+    else:
+        raise ModelNotFoundException(
+            message=f"The requested model `{model}` was not found. "
+            f"Please ensure that you have specified the correct model name. "
+            f"Currently served models `{served_model_names}`."
+        )
+    engine: AsyncEngine = async_engine_array[served_model_name]  # type: ignore
+    try:
+        engine.check_available()
+    except ModelUnavailableError as e:
+        raise ModelUnavailableException(message=str(e)) from e
+    return engine
+
+
 async def get_engine(request: Request, embed_request: EmbeddingRequest):
     """Retrieve the appropriate engine for the requested model.
     Args:
@@ -71,27 +128,100 @@ async def get_engine(request: Request, embed_request: EmbeddingRequest):
     Returns:
         AsyncEngine: The engine corresponding to the requested model.
     """
-    # Directly retrieve the AsyncEngineArgs from AsyncEngineArray
-    async_engine_array: AsyncEngineArray = request.app.state.async_engine_array
-    async_engine_args_list: List[AsyncEngineArgs] = async_engine_array.engine_args
+    return resolve_engine(request.app.state.async_engine_array, embed_request.model)
 
-    # Check if the requested model is in the engine arguments
-    if embed_request.model not in [
-        engine_args.model for engine_args in async_engine_args_list
-    ]:
-        raise ModelNotFoundException(
-            message=f"The requested model `{embed_request.model}` was not found. "
-            f"Please ensure that you have specified the correct model name. "
-            f"Currently served models `{[engine_args.model for engine_args in async_engine_args_list]}`."
-        )
 
-    # Get engine for the requested model
-    engine: AsyncEngine = async_engine_array[embed_request.model]  # type: ignore
+def get_trace(request: Request) -> Optional[Trace]:
+    """Get the trace of the request, if requests are traced.
 
-    return engine
+    The time spent before the handler runs, reading and validating the
+    request, is recorded as the validation span.
 
+    Args:
+        request (Request): The user request.
 
-async def prepare_response(results: list, embed_request: EmbeddingRequest):
+    Returns:
+        Optional[Trace]: The trace of the request.
+    """
+    trace: Optional[Trace] = getattr(request.state, "trace", None)
+    if trace is not None:
+        trace.add_span("validation", trace.root.start, time.perf_counter())
+    return trace
+
+
+async def resolve_inputs(
+    engine: AsyncEngine, inputs: list, prompt_name: Optional[str] = None
+) -> Tuple[list, int]:
+    """Validate token id inputs and apply the selected prompt, leaving plain sentences as they are.
+
+    Token ids are converted to tensors here, so the batches skip their
+    tokenization. The token ids of the prompt are computed once per model
+    and spliced into every input once it is tokenized.
+
+    Args:
+        engine (AsyncEngine): The engine used to generate the embeddings.
+        inputs (list): The sentences, or the token ids of every input.
+        prompt_name (Optional[str]): Name of the prompt prefixed to every input.
+
+    Raises:
+        InvalidTokenIdsException: If the model does not accept token ids or an input is invalid.
+        PromptNotFoundException: If the prompt is not configured for the model.
+
+    Returns:
+        Tuple[list, int]: The inputs to queue on the engine and the number of tokens
+            of the prompt prefixed to every input.
+    """
+    if not inputs or (prompt_name is None and isinstance(inputs[0], str)):
+        return inputs, 0
+    await engine.load()
+    model = engine.model
+    prompt_ids = None
+    if prompt_name is not None:
+        try:
+            prompt_ids = model.prompt_token_ids(prompt_name)  # type: ignore
+        except PromptNotFoundError as e:
+            raise PromptNotFoundException(
+                message=f"The prompt `{prompt_name}` is not configured for the model "
+                f"`{engine.engine_args.served_model_name}`. "
+                f"Available prompts `{sorted(model.prompts)}`."  # type: ignore
+            ) from e
+    prefix_tokens = 0 if prompt_ids is None else len(prompt_ids)
+    if isinstance(inputs[0], str):
+        return [PromptedText(text, prompt_ids) for text in inputs], prefix_tokens
+    try:
+        return model.token_ids(inputs, prompt_ids), prefix_tokens  # type: ignore
+    except InvalidTokenIdsError as e:
+        raise InvalidTokenIdsException(message=str(e)) from e
+
+
+async def embed_inputs(
+    engine: AsyncEngine,
+    inputs: list,
+    output_mode: str = OutputMode.DENSE.value,
+    trace: Optional[Trace] = None,
+) -> tuple:
+    """Queue inputs on the engine and wait for their embeddings.
+
+    Args:
+        engine (AsyncEngine): The engine used to generate the embeddings.
+        inputs (list): The sentences or images to be embedded.
+        output_mode (str): Output mode of the embeddings.
+        trace (Optional[Trace]): Trace of the request, if it is traced.
+
+    Returns:
+        tuple: The embeddings and their usage information.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    await engine.aembed(
+        sentences=inputs, future=future, output_mode=output_mode, trace=trace
+    )
+    return await future
+
+
+async def prepare_response(
+    results: list, embed_request: EmbeddingRequest, prefix_tokens: int = 0
+):
     """
     Prepare the response for the embedding request.
 
@@ -99,15 +229,24 @@ async def prepare_response(results: list, embed_request: EmbeddingRequest):
         results (list): A list containing the embeddings and their usage information.
             - results[0] (list): A list of embeddings.
             - results[1] (list): A list of usage data corresponding to each embedding.
-        embed_request (EmbeddingRequest): The request object containing details about the embedding, 
+        embed_request (EmbeddingRequest): The request object containing details about the embedding,
                                           including the model name.
+        prefix_tokens (int): Number of tokens of the prompt prefixed to every input.
 
     Returns:
-        EmbeddingResponse: The structured response containing the embeddings, usage data, 
+        EmbeddingResponse: The structured response containing the embeddings, usage data,
                            and other metadata.
     """
     embeddings = results[0]
     usage = results[1]
+    if embed_request.encoding_format == "base64":
+        # Raw little-endian bytes, far smaller than numbers in JSON and compressible
+        embeddings = [
+            base64.b64encode(
+                np.ascontiguousarray(row, dtype=row.dtype.newbyteorder("<"))
+            ).decode("ascii")
+            for row in embeddings
+        ]
     embedding_data = [
         EmbeddingData(
             object="embedding",
@@ -116,6 +255,7 @@ async def prepare_response(results: list, embed_request: EmbeddingRequest):
             usage=Usage(
                 prompt_tokens=usage[count],
                 total_tokens=usage[count],
+                prefix_tokens=prefix_tokens,
             ),
         )
         for count, emb in enumerate(embeddings)
@@ -132,47 +272,183 @@ async def prepare_response(results: list, embed_request: EmbeddingRequest):
     return response
 
 
+def prepare_ragged_response(
+    results: list, embed_request: EmbeddingRequest, prefix_tokens: int = 0
+) -> ORJSONResponse:
+    """
+    Prepare the response for a multi-vector or sparse embedding request.
+
+    The numpy arrays are serialized directly by orjson, without building a Python
+    object per element.
+
+    Args:
+        results (list): A list containing the embeddings and their usage information.
+            - results[0] (RaggedEmbeddings): The embeddings of every input.
+            - results[1] (list): A list of usage data corresponding to each input.
+        embed_request (EmbeddingRequest): The request object containing details about the embedding,
+                                          including the model name.
+        prefix_tokens (int): Number of tokens of the prompt prefixed to every input.
+
+    Returns:
+        ORJSONResponse: The serialized `RaggedEmbeddingResponse`.
+    """
+    embeddings: RaggedEmbeddings = results[0]
+    total_tokens = sum(results[1])
+    return ORJSONResponse(
+        content={
+            "object": embed_request.output_mode,
+            "data": embeddings.to_dict(),
+            "usage": {
+                "prompt_tokens": total_tokens,
+                "total_tokens": total_tokens,
+                "prefix_tokens": prefix_tokens * len(results[1]),
+            },
+            "model": embed_request.model,
+            "id": f"textembed-{uuid4()}",
+            "created": int(time.time()),
+        }
+    )
+
+
 @embed_router.post(
     "/embedding",
     response_class=ORJSONResponse,
-    response_model=EmbeddingResponse,
+    response_model=Union[EmbeddingResponse, RaggedEmbeddingResponse],
     status_code=status.HTTP_200_OK,
     dependencies=[Depends(valid_token_dependency)],  # type: ignore
+    # The body is parsed by the handler, the documented schema stays the same
+    openapi_extra={
+        "requestBody": {
+            "content": {
+                "application/json": {"schema": EmbeddingRequest.model_json_schema()}
+            },
+            "required": True,
+        }
+    },
 )
 async def create_embedding(
-    request: Request, embed_request: EmbeddingRequest
-) -> EmbeddingResponse:
+    request: Request,
+) -> Union[EmbeddingResponse, ORJSONResponse]:
     """Create embeddings for the given input text.
 
+    The body, an `EmbeddingRequest`, is parsed with orjson and validated in a
+    single pass over the inputs, instead of by pydantic, to keep the parsing
+    of requests with thousands of inputs cheap.
+
     Args:
         request (Request): The user request.
-        embed_request (EmbeddingRequest): The request containing input text
-                                        and optional model and user information.
+
+    Raises:
+        RequestTooLargeException: If the body exceeds the configured size limit.
+        InvalidRequestException: If the body is not a valid embedding request.
 
     Returns:
-        EmbeddingResponse: The response containing embedding data.
+        Union[EmbeddingResponse, ORJSONResponse]: The response containing embedding data.
     """
+    limits: RequestLimits = request.app.state.request_limits
+    body = await read_body(request, limits.max_bytes)
+    embed_request = parse_embedding_request(body, limits)
+    trace = get_trace(request)
+
     # Get engine for the requested model
     engine: AsyncEngine = await get_engine(request=request, embed_request=embed_request)
 
-    # Ensure input
-    if isinstance(embed_request.input, str):
-        embed_request.input = [embed_request.input]
+    # Ensure the model can produce the requested output mode
+    if not await engine.supports_output_mode(embed_request.output_mode):
+        raise EmbeddingException(
+            message=f"The output mode `{embed_request.output_mode}` is not supported "
+            f"by the model `{embed_request.model}`.",
+            status_code=status.HTTP_400_BAD_REQUEST,
+            exc_type="UnsupportedOutputMode",
+        )
+    if (
+        embed_request.encoding_format != "float"
+        and embed_request.output_mode != OutputMode.DENSE.value
+    ):
+        raise EmbeddingException(
+            message=f"The `{embed_request.encoding_format}` encoding format is only "
+            f"supported by dense outputs.",
+            status_code=status.HTTP_400_BAD_REQUEST,
+            exc_type="UnsupportedEncodingFormat",
+        )
 
     start_time = time.perf_counter()
+    inputs, prefix_tokens = await resolve_inputs(
+        engine, embed_request.input, embed_request.prompt_name
+    )
 
     # Generate embeddings
-    loop = asyncio.get_running_loop()
-    future = loop.create_future()
-    await engine.aembed(sentences=embed_request.input, future=future)  # type: ignore
-    results = await future
+    results = await embed_inputs(
+        engine=engine,
+        inputs=inputs,
+        output_mode=embed_request.output_mode,
+        trace=trace,
+    )
 
-    logger.info(
+    log_request(
+        request.scope["route"].path,
         "Received request with %d inputs. Processed in %.4f ms",
         len(embed_request.input),
         (time.perf_counter() - start_time) * 1000,
     )
 
+    # Closed when the response starts, after FastAPI serialized the response model
+    if trace is not None:
+        trace.start_span("serialization")
+    if embed_request.output_mode != OutputMode.DENSE.value:
+        return prepare_ragged_response(
+            results=results, embed_request=embed_request, prefix_tokens=prefix_tokens
+        )
+    return await prepare_response(
+        results=results, embed_request=embed_request, prefix_tokens=prefix_tokens
+    )
+
+
+async def embed_images(
+    request: Request, embed_request: EmbeddingRequest, images: list
+) -> EmbeddingResponse:
+    """Decode images in the worker pool of the engine and embed them.
+
+    Args:
+        request (Request): The user request.
+        embed_request (EmbeddingRequest): The request containing the model.
+        images (list): Base64 encoded or raw image files.
+
+    Raises:
+        ImageTooLargeException: If an image exceeds the configured limits.
+        InvalidImageException: If an image cannot be decoded or the model does not accept images.
+
+    Returns:
+        EmbeddingResponse: The response containing embedding data.
+    """
+    trace = get_trace(request)
+
+    # Get engine for the requested model
+    engine: AsyncEngine = await get_engine(request=request, embed_request=embed_request)
+
+    start_time = time.perf_counter()
+
+    try:
+        image_input = await engine.adecode_images(images)
+    except ImageTooLargeError as e:
+        raise ImageTooLargeException(message=str(e)) from e
+    except (ValueError, OSError) as e:
+        raise InvalidImageException(message=str(e)) from e
+    if trace is not None:
+        trace.add_span("decode", start_time, time.perf_counter())
+
+    # Generate embeddings
+    results = await embed_inputs(engine=engine, inputs=image_input, trace=trace)
+
+    log_request(
+        request.scope["route"].path,
+        "Received request with %d inputs. Processed in %.4f ms",
+        len(images),
+        (time.perf_counter() - start_time) * 1000,
+    )
+
+    if trace is not None:
+        trace.start_span("serialization")
     return await prepare_response(results=results, embed_request=embed_request)
 
 
@@ -196,30 +472,87 @@ async def create_image_embedding(
     Returns:
         EmbeddingResponse: The response containing embedding data.
     """
-    # Get engine for the requested model
-    engine: AsyncEngine = await get_engine(request=request, embed_request=embed_request)
-
     # Ensure input
     if isinstance(embed_request.input, str):
         embed_request.input = [embed_request.input]
+    if not all(isinstance(image, str) for image in embed_request.input):
+        raise InvalidImageException(message="Images must be base64 encoded strings.")
 
-    start_time = time.perf_counter()
+    return await embed_images(
+        request=request, embed_request=embed_request, images=embed_request.input
+    )
 
-    image_input = [
-        Image.open(BytesIO(base64.b64decode(image))).convert("RGB")
-        for image in embed_request.input
-    ]
 
-    # Generate embeddings
-    loop = asyncio.get_running_loop()
-    future = loop.create_future()
-    await engine.aembed(sentences=image_input, future=future)  # type: ignore
-    results = await future
+# Request body of the image uploads, read by the endpoint itself
+_UPLOAD_REQUEST_BODY = {
+    "required": True,
+    "content": {
+        "multipart/form-data": {
+            "schema": {
+                "type": "object",
+                "required": ["model", "files"],
+                "properties": {
+                    "model": {"type": "string"},
+                    "files": {
+                        "type": "array",
+                        "items": {"type": "string", "format": "binary"},
+                    },
+                },
+            }
+        }
+    },
+}
 
-    logger.info(
-        "Received request with %d inputs. Processed in %.4f ms",
-        len(embed_request.input),
-        (time.perf_counter() - start_time) * 1000,
+
+@embed_router.post(
+    "/image_embedding/upload",
+    response_class=ORJSONResponse,
+    response_model=EmbeddingResponse,
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(valid_token_dependency)],  # type: ignore
+    openapi_extra={"requestBody": _UPLOAD_REQUEST_BODY},
+)
+async def upload_image_embedding(request: Request) -> EmbeddingResponse:
+    """Create embeddings for images uploaded as multipart form files.
+
+    The raw image bytes avoid the size and decoding overhead of base64. The
+    form is read as it is received, so an upload exceeding the image size
+    limit is rejected without receiving the rest of it. The form has the
+    `model` field and a `files` file per image.
+
+    Args:
+        request (Request): The user request.
+
+    Raises:
+        InvalidRequestException: If the form is invalid or has no image.
+        RequestTooLargeException: If the body is larger than the images it may hold.
+        ImageTooLargeException: If an image exceeds the configured limits.
+
+    Returns:
+        EmbeddingResponse: The response containing embedding data.
+    """
+    limits: RequestLimits = request.app.state.request_limits
+    # The model is a field of the form, the largest image limit applies until it is read
+    max_bytes = max(
+        engine_args.max_image_bytes
+        for engine_args in request.app.state.async_engine_array.engine_args
+    )
+    fields, files = await read_multipart(request, max_bytes, limits.max_inputs)
+    images = [data for name, data in files if name == "files"]
+    if "model" not in fields or not images:
+        raise InvalidRequestException(
+            message="The form must have a `model` field and at least one `files` file."
+        )
+    embed_request = EmbeddingRequest.model_construct(
+        input=[""] * len(images), model=fields["model"]
     )
+    engine: AsyncEngine = await get_engine(request=request, embed_request=embed_request)
+    max_bytes = engine.engine_args.max_image_bytes
+    if any(len(image) > max_bytes for image in images):
+        raise ImageTooLargeException(
+            message=f"Images must not exceed {max_bytes} bytes."
+        )
 
-    return await prepare_response(results=results, embed_request=embed_request)
+    return await embed_images(
+        request=request, embed_request=embed_request, images=images
+    )
@@ -8,6 +8,7 @@ from fastapi import Request, status
 from fastapi.exceptions import HTTPException, RequestValidationError
 from fastapi.responses import JSONResponse
 
+from textembed.engine.async_engine import ModelUnavailableError
 from textembed.log import logger
 
 
@@ -50,6 +51,90 @@ class ModelNotFoundException(EmbeddingException):
         super().__init__(message, status.HTTP_404_NOT_FOUND, exc_type="ModelNotFound")
 
 
+class IndexNotFoundException(EmbeddingException):
+    """Custom exception for index not found errors."""
+
+    def __init__(self, message: str = "Index not found"):
+        super().__init__(message, status.HTTP_404_NOT_FOUND, exc_type="IndexNotFound")
+
+
+class ModelUnavailableException(EmbeddingException):
+    """Custom exception for models that failed to load and are not retried yet."""
+
+    def __init__(self, message: str = "Model unavailable"):
+        super().__init__(
+            message, status.HTTP_503_SERVICE_UNAVAILABLE, exc_type="ModelUnavailable"
+        )
+
+
+class InvalidIndexRequestException(EmbeddingException):
+    """Custom exception for invalid index requests."""
+
+    def __init__(self, message: str = "Invalid index request"):
+        super().__init__(
+            message, status.HTTP_400_BAD_REQUEST, exc_type="InvalidIndexRequest"
+        )
+
+
+class InvalidImageException(EmbeddingException):
+    """Custom exception for images that cannot be decoded."""
+
+    def __init__(self, message: str = "Invalid image"):
+        super().__init__(message, status.HTTP_400_BAD_REQUEST, exc_type="InvalidImage")
+
+
+class ImageTooLargeException(EmbeddingException):
+    """Custom exception for images exceeding the configured limits."""
+
+    def __init__(self, message: str = "Image too large"):
+        super().__init__(
+            message, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, exc_type="ImageTooLarge"
+        )
+
+
+class InvalidTokenIdsException(EmbeddingException):
+    """Custom exception for token id inputs a model cannot embed."""
+
+    def __init__(self, message: str = "Invalid token ids"):
+        super().__init__(
+            message, status.HTTP_400_BAD_REQUEST, exc_type="InvalidTokenIds"
+        )
+
+
+class PromptNotFoundException(EmbeddingException):
+    """Custom exception for prompt names not configured for a model."""
+
+    def __init__(self, message: str = "Prompt not found"):
+        super().__init__(message, status.HTTP_404_NOT_FOUND, exc_type="PromptNotFound")
+
+
+class InvalidRequestException(EmbeddingException):
+    """Custom exception for request bodies that are not valid embedding requests."""
+
+    def __init__(self, message: str = "Invalid request"):
+        super().__init__(
+            message, status.HTTP_422_UNPROCESSABLE_ENTITY, exc_type="InvalidRequest"
+        )
+
+
+class RequestTooLargeException(EmbeddingException):
+    """Custom exception for request bodies exceeding the configured size limit."""
+
+    def __init__(self, message: str = "Request too large"):
+        super().__init__(
+            message,
+            status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            exc_type="RequestTooLarge",
+        )
+
+
+class ProfilerBusyException(EmbeddingException):
+    """Custom exception for profiling requests while a profile is being captured."""
+
+    def __init__(self, message: str = "A profile is already being captured"):
+        super().__init__(message, status.HTTP_409_CONFLICT, exc_type="ProfilerBusy")
+
+
 class HandleExceptions:
     """Handle Exceptions"""
 
@@ -57,6 +142,7 @@ class HandleExceptions:
         self.app = app
         self._handle_custom_exception()
         self._handle_model_not_found_exception()
+        self._handle_model_unavailable_error()
         self._handle_pydantic_exception()
         self._handle_fastapi_http_exception()
         self._handle_default_exception()
@@ -81,6 +167,18 @@ class HandleExceptions:
                 content=exc.json(),
             )
 
+    def _handle_model_unavailable_error(self):
+        @self.app.exception_handler(ModelUnavailableError)
+        async def model_unavailable_error_handler(
+            request: Request, exc: ModelUnavailableError
+        ):
+            error = ModelUnavailableException(message=str(exc))
+            logger.error(error.message)
+            return JSONResponse(
+                status_code=error.status_code,
+                content=error.json(),
+            )
+
     def _handle_pydantic_exception(self):
         @self.app.exception_handler(RequestValidationError)
         async def pydantic_exception_handler(
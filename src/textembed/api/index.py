@@ -0,0 +1,216 @@
+"""Vector index apis"""
+
+import asyncio
+import time
+
+from fastapi import APIRouter, Depends, Path, Request, status
+from fastapi.responses import ORJSONResponse
+from typing_extensions import Annotated
+
+from textembed.api.dependencies import valid_token_dependency
+from textembed.api.embed import embed_inputs, get_engine, resolve_inputs
+from textembed.api.errors import IndexNotFoundException, InvalidIndexRequestException
+from textembed.api.schemas import (
+    EmbeddingRequest,
+    HealthCheck,
+    IndexAddRequest,
+    IndexAddResponse,
+    IndexHit,
+    IndexSaveRequest,
+    IndexSearchData,
+    IndexSearchRequest,
+    IndexSearchResponse,
+)
+from textembed.engine.async_engine import AsyncEngine
+from textembed.executor.primitives import OutputMode
+from textembed.index import VectorIndex
+from textembed.log import log_request
+
+index_router = APIRouter(prefix="/v1/index", tags=["Index"])
+
+IndexName = Annotated[str, Path(pattern=r"^[A-Za-z0-9_\-]+$", max_length=128)]
+
+
+def get_index(engine: AsyncEngine, name: str, create: bool = False) -> VectorIndex:
+    """Retrieve a vector index of the engine.
+
+    Args:
+        engine (AsyncEngine): The engine owning the index.
+        name (str): Name of the index.
+        create (bool): Whether to create the index if it does not exist.
+
+    Raises:
+        InvalidIndexRequestException: If indexes are disabled for the engine.
+        IndexNotFoundException: If the index does not exist.
+
+    Returns:
+        VectorIndex: The requested index.
+    """
+    try:
+        index = engine.get_index(name, create=create)
+    except ValueError as e:
+        raise InvalidIndexRequestException(message=str(e)) from e
+    if index is None:
+        raise IndexNotFoundException(
+            message=f"The requested index `{name}` was not found. "
+            f"Available indexes `{list(engine.indexes)}`."
+        )
+    return index
+
+
+def check_index_request(index_request: EmbeddingRequest):
+    """Check that a request asks for the dense float embeddings the indexes store.
+
+    Args:
+        index_request (EmbeddingRequest): The index add or search request.
+
+    Raises:
+        InvalidIndexRequestException: If the request asks for another output mode
+            or encoding format.
+    """
+    if index_request.output_mode != OutputMode.DENSE.value:
+        raise InvalidIndexRequestException(
+            message=f"Indexes only store dense embeddings, not `{index_request.output_mode}` ones."
+        )
+    if index_request.encoding_format != "float":
+        raise InvalidIndexRequestException(
+            message=f"Index requests do not support the `{index_request.encoding_format}` "
+            "encoding format."
+        )
+
+
+@index_router.post(
+    "/{name}/add",
+    response_class=ORJSONResponse,
+    response_model=IndexAddResponse,
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(valid_token_dependency)],  # type: ignore
+)
+async def add_to_index(
+    request: Request, name: IndexName, index_request: IndexAddRequest
+) -> IndexAddResponse:
+    """Embed the given input text and store it in a vector index.
+
+    The index is created on the first add.
+
+    Args:
+        request (Request): The user request.
+        name (str): Name of the index.
+        index_request (IndexAddRequest): The request containing input text,
+                                         the model and optional identifiers.
+
+    Returns:
+        IndexAddResponse: The identifiers of the added inputs.
+    """
+    check_index_request(index_request)
+    engine = await get_engine(request=request, embed_request=index_request)
+    index = get_index(engine=engine, name=name, create=True)
+    if index_request.ids is not None and len(index_request.ids) != len(
+        index_request.input
+    ):
+        raise InvalidIndexRequestException(
+            message="The number of ids must match the number of inputs."
+        )
+
+    start_time = time.perf_counter()
+    inputs, _ = await resolve_inputs(
+        engine, index_request.input, index_request.prompt_name
+    )
+    embeddings, _ = await embed_inputs(engine=engine, inputs=inputs)
+    try:
+        ids = await asyncio.to_thread(index.add, embeddings, index_request.ids)
+    except ValueError as e:
+        raise InvalidIndexRequestException(message=str(e)) from e
+
+    log_request(
+        request.scope["route"].path,
+        "Added %d inputs to index %s in %.4f ms",
+        len(ids),
+        name,
+        (time.perf_counter() - start_time) * 1000,
+    )
+    return IndexAddResponse(
+        index=name, model=index_request.model, ids=ids, count=len(index)
+    )
+
+
+@index_router.post(
+    "/{name}/search",
+    response_class=ORJSONResponse,
+    response_model=IndexSearchResponse,
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(valid_token_dependency)],  # type: ignore
+)
+async def search_index(
+    request: Request, name: IndexName, index_request: IndexSearchRequest
+) -> IndexSearchResponse:
+    """Embed the given queries and return their closest stored inputs.
+
+    Args:
+        request (Request): The user request.
+        name (str): Name of the index.
+        index_request (IndexSearchRequest): The request containing the queries,
+                                            the model and the number of results.
+
+    Returns:
+        IndexSearchResponse: The top-k results of every query.
+    """
+    check_index_request(index_request)
+    engine = await get_engine(request=request, embed_request=index_request)
+    index = get_index(engine=engine, name=name)
+
+    start_time = time.perf_counter()
+    inputs, _ = await resolve_inputs(
+        engine, index_request.input, index_request.prompt_name
+    )
+    embeddings, _ = await embed_inputs(engine=engine, inputs=inputs)
+    try:
+        results = await asyncio.to_thread(index.search, embeddings, index_request.top_k)
+    except ValueError as e:
+        raise InvalidIndexRequestException(message=str(e)) from e
+
+    log_request(
+        request.scope["route"].path,
+        "Searched index %s with %d queries in %.4f ms",
+        name,
+        len(index_request.input),
+        (time.perf_counter() - start_time) * 1000,
+    )
+    return IndexSearchResponse(
+        data=[
+            IndexSearchData(
+                hits=[IndexHit(id=hit_id, score=score) for hit_id, score in hits],
+                index=count,
+            )
+            for count, hits in enumerate(results)
+        ],
+        model=index_request.model,
+    )
+
+
+@index_router.post(
+    "/{name}/save",
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(valid_token_dependency)],  # type: ignore
+)
+async def save_index(
+    request: Request, name: IndexName, index_request: IndexSaveRequest
+) -> HealthCheck:
+    """Write a snapshot of a vector index to the configured index directory.
+
+    Args:
+        request (Request): The user request.
+        name (str): Name of the index.
+        index_request (IndexSaveRequest): The request containing the model owning the index.
+
+    Returns:
+        HealthCheck: An object containing the snapshot directory.
+    """
+    engine = await get_engine(request=request, embed_request=index_request)  # type: ignore
+    get_index(engine=engine, name=name)
+    path = await asyncio.to_thread(engine.save_index, name)
+    if path is None:
+        raise InvalidIndexRequestException(
+            message="No index directory is configured for snapshots."
+        )
+    return HealthCheck(payload={"path": path}, message="Index saved", code=200)
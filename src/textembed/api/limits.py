@@ -0,0 +1,28 @@
+"""Limits of the embedding requests"""
+
+from dataclasses import dataclass
+from typing import Optional
+
+
+@dataclass
+class RequestLimits:
+    """Limits of the embedding requests parsed from their raw body.
+
+    Attributes:
+        max_inputs (Optional[int]): Maximum number of inputs of a request, unlimited when None.
+        max_bytes (Optional[int]): Maximum size of a request body in bytes, unlimited when None.
+        max_input_chars (Optional[int]): Maximum number of characters of a text input,
+                                         unlimited when None.
+    """
+
+    max_inputs: Optional[int] = 16384
+    max_bytes: Optional[int] = 64 * 1024 * 1024
+    max_input_chars: Optional[int] = 65536
+
+    def __post_init__(self):
+        if self.max_inputs is not None and self.max_inputs < 1:
+            raise ValueError("Max inputs must be greater than or equal to 1.")
+        if self.max_bytes is not None and self.max_bytes < 1:
+            raise ValueError("Max bytes must be greater than or equal to 1.")
+        if self.max_input_chars is not None and self.max_input_chars < 1:
+            raise ValueError("Max input chars must be greater than or equal to 1.")
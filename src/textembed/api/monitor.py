@@ -1,11 +1,13 @@
 """Monitor FastAPI app."""
 
+import os
 import time
 
-from fastapi import APIRouter, Response
-from prometheus_client import REGISTRY, generate_latest
+from fastapi import APIRouter, Request, Response, status
+from prometheus_client import REGISTRY, CollectorRegistry, generate_latest, multiprocess
 
 from textembed.api.schemas import HealthCheck, Root
+from textembed.executor.primitives import EngineState
 
 monitor_router = APIRouter(tags=["Monitor"])
 
@@ -46,17 +48,54 @@ async def _health() -> HealthCheck:
     )
 
 
+@monitor_router.get("/ready")
+async def _ready(request: Request, response: Response) -> HealthCheck:
+    """
+    Readiness check endpoint.
+
+    This endpoint reports the load state of every served model. It responds
+    with status 200 once every model is either loaded or loadable on demand
+    (lazy or idle-unloaded), and with status 503 while models are still
+    loading or failed to load.
+
+    Returns:
+        HealthCheck: An object containing the load state of every served model.
+    """
+    async_engine_array = getattr(request.app.state, "async_engine_array", None)
+    engines = [] if async_engine_array is None else list(async_engine_array)
+    ready = bool(engines) and all(
+        engine.state == EngineState.READY
+        or (engine.state == EngineState.UNLOADED and engine.running)
+        for engine in engines
+    )
+    if not ready:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return HealthCheck(
+        payload={
+            engine.engine_args.served_model_name: engine.state.value
+            for engine in engines
+        },
+        message="Ready" if ready else "Not ready",
+        code=response.status_code or status.HTTP_200_OK,
+    )
+
+
 @monitor_router.get("/metrics")
 async def metrics() -> Response:
     """
     Endpoint to retrieve the current metrics.
 
     This endpoint generates and returns the latest metrics collected by the
-    Prometheus REGISTRY. The metrics are returned in a plain text format
-    that is compatible with Prometheus scraping.
+    Prometheus REGISTRY, or with several server processes, the metrics of all
+    of them aggregated from `PROMETHEUS_MULTIPROC_DIR`. The metrics are
+    returned in a plain text format that is compatible with Prometheus scraping.
 
     Returns:
         Response: A response object containing the latest metrics in plain text format.
     """
-    metrics_str = generate_latest(REGISTRY)
+    registry = REGISTRY
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    metrics_str = generate_latest(registry)
     return Response(content=metrics_str, media_type="text/plain")
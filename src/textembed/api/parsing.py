@@ -0,0 +1,281 @@
+"""Fast parsing of embedding requests"""
+
+from typing import Dict, List, Optional, Tuple
+
+import orjson
+from multipart.exceptions import MultipartParseError
+from multipart.multipart import MultipartParser, parse_options_header
+from starlette.requests import Request
+
+from textembed.api.errors import (
+    ImageTooLargeException,
+    InvalidRequestException,
+    RequestTooLargeException,
+)
+from textembed.api.limits import RequestLimits
+from textembed.api.schemas import EmbeddingRequest
+from textembed.executor.primitives import OutputMode
+
+_OUTPUT_MODES = frozenset(mode.value for mode in OutputMode)
+_ENCODING_FORMATS = frozenset(("float", "base64"))
+_STR = frozenset((str,))
+_INT = frozenset((int,))
+
+# Allowance for the boundary and headers of every part of a multipart body
+_MULTIPART_PART_OVERHEAD = 4096
+
+
+async def read_body(request: Request, max_bytes: Optional[int]) -> bytes:
+    """Read the body of a request, failing as soon as it exceeds `max_bytes`.
+
+    Args:
+        request (Request): The request.
+        max_bytes (Optional[int]): Maximum size of the body in bytes, unlimited when None.
+
+    Raises:
+        RequestTooLargeException: If the body is larger than `max_bytes`.
+
+    Returns:
+        bytes: The body.
+    """
+    too_large = RequestTooLargeException(
+        message=f"Request bodies must not exceed {max_bytes} bytes."
+    )
+    content_length = request.headers.get("content-length", "")
+    if max_bytes is not None and content_length.isdigit():
+        if int(content_length) > max_bytes:
+            raise too_large
+    chunks = []
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if max_bytes is not None and size > max_bytes:
+            raise too_large
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+class _MultipartReader:
+    """Callbacks of the multipart parser keeping the parts in memory, within limits."""
+
+    def __init__(self, max_file_bytes: int, max_files: Optional[int]) -> None:
+        self.max_file_bytes = max_file_bytes
+        self.max_files = max_files
+        self.fields: Dict[str, str] = {}
+        self.files: List[Tuple[str, bytes]] = []
+        self._headers: Dict[bytes, bytes] = {}
+        self._header_field = b""
+        self._header_value = b""
+        self._name = ""
+        self._filename: Optional[str] = None
+        self._chunks: List[bytes] = []
+        self._size = 0
+
+    def on_part_begin(self):
+        self._headers = {}
+        self._chunks = []
+        self._size = 0
+
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(
+            self._headers.get(b"content-disposition", b"")
+        )
+        self._name = options.get(b"name", b"").decode("utf-8", errors="replace")
+        filename = options.get(b"filename")
+        self._filename = (
+            None if filename is None else filename.decode("utf-8", errors="replace")
+        )
+        if self._filename is not None and self.max_files is not None:
+            if len(self.files) >= self.max_files:
+                raise InvalidRequestException(
+                    message=f"Requests must not have more than {self.max_files} inputs."
+                )
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        self._size += end - start
+        if self._size > self.max_file_bytes:
+            raise ImageTooLargeException(
+                message=f"Images must not exceed {self.max_file_bytes} bytes."
+            )
+        self._chunks.append(data[start:end])
+
+    def on_part_end(self):
+        data = b"".join(self._chunks)
+        if self._filename is None:
+            self.fields[self._name] = data.decode("utf-8", errors="replace")
+        else:
+            self.files.append((self._name, data))
+
+
+async def read_multipart(
+    request: Request, max_file_bytes: int, max_files: Optional[int]
+) -> Tuple[Dict[str, str], List[Tuple[str, bytes]]]:
+    """Read a multipart form as it is received, failing as soon as a part exceeds the limits.
+
+    Bodies announcing more than `max_files` parts of `max_file_bytes` are
+    rejected before they are read, and a part is rejected as soon as it
+    exceeds `max_file_bytes`, without receiving the rest of the body.
+
+    Args:
+        request (Request): The request.
+        max_file_bytes (int): Maximum size of a part in bytes.
+        max_files (Optional[int]): Maximum number of files, unlimited when None.
+
+    Raises:
+        InvalidRequestException: If the body is not a multipart form or has too many files.
+        RequestTooLargeException: If the body is larger than the files it may hold.
+        ImageTooLargeException: If a part is larger than `max_file_bytes`.
+
+    Returns:
+        Tuple[Dict[str, str], List[Tuple[str, bytes]]]: The fields, and the field
+            name and content of every file, in order.
+    """
+    content_type, options = parse_options_header(
+        request.headers.get("content-type", "")
+    )
+    if content_type != b"multipart/form-data" or b"boundary" not in options:
+        raise InvalidRequestException(message="The body must be a multipart form.")
+    content_length = request.headers.get("content-length", "")
+    if max_files is not None and content_length.isdigit():
+        max_bytes = max_files * (max_file_bytes + _MULTIPART_PART_OVERHEAD)
+        if int(content_length) > max_bytes:
+            raise RequestTooLargeException(
+                message=f"Uploads of at most {max_files} images must not exceed "
+                f"{max_bytes} bytes."
+            )
+
+    reader = _MultipartReader(max_file_bytes, max_files)
+    callbacks = {
+        "on_part_begin": reader.on_part_begin,
+        "on_header_field": reader.on_header_field,
+        "on_header_value": reader.on_header_value,
+        "on_header_end": reader.on_header_end,
+        "on_headers_finished": reader.on_headers_finished,
+        "on_part_data": reader.on_part_data,
+        "on_part_end": reader.on_part_end,
+    }
+    parser = MultipartParser(options[b"boundary"], callbacks)  # type: ignore
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+        parser.finalize()
+    except MultipartParseError as e:
+        raise InvalidRequestException(message=f"Invalid multipart body: {e}") from e
+    return reader.fields, reader.files
+
+
+def _check_input(value, limits: RequestLimits) -> list:
+    """Check the structure and limits of the `input` field in a single pass.
+
+    Args:
+        value: The `input` field.
+        limits (RequestLimits): The request limits.
+
+    Raises:
+        InvalidRequestException: If the input is not a non-empty list of strings, of
+            token ids or of token id lists, or exceeds the limits.
+
+    Returns:
+        list: The inputs, a single list of token ids being one input.
+    """
+    if not isinstance(value, list) or not value:
+        raise InvalidRequestException(
+            message="The input must be a non-empty list of strings or token ids."
+        )
+    first = value[0]
+    # A single list of token ids is one input, its length is checked against
+    # the token limit of the model once embedded
+    if type(first) is int:
+        if not _INT.issuperset(map(type, value)):
+            raise InvalidRequestException(message="Token ids must be integers.")
+        return [value]
+    if limits.max_inputs is not None and len(value) > limits.max_inputs:
+        raise InvalidRequestException(
+            message=f"Requests must not have more than {limits.max_inputs} inputs."
+        )
+    # Checking the types with map runs the loops in C, the index of an
+    # invalid input is only searched for the error message
+    if type(first) is str:
+        if not _STR.issuperset(map(type, value)):
+            index = next(i for i, item in enumerate(value) if type(item) is not str)
+            raise InvalidRequestException(
+                message=f"Input {index} must be a string like the other inputs."
+            )
+        max_chars = limits.max_input_chars
+        if max_chars is not None and max(map(len, value)) > max_chars:
+            index = next(i for i, item in enumerate(value) if len(item) > max_chars)
+            raise InvalidRequestException(
+                message=f"Input {index} has more than {max_chars} characters."
+            )
+        return value
+    for index, item in enumerate(value):
+        if type(item) is not list or not _INT.issuperset(map(type, item)):
+            raise InvalidRequestException(
+                message=f"Input {index} must be a list of integer token ids."
+            )
+    return value
+
+
+def parse_embedding_request(body: bytes, limits: RequestLimits) -> EmbeddingRequest:
+    """Parse and validate the raw body of an embedding request.
+
+    The body is parsed with orjson and the fields are checked directly,
+    without pydantic validating every input, which dominates the parsing
+    time of requests with many inputs. The accepted documents are the ones
+    of the `EmbeddingRequest` schema.
+
+    Args:
+        body (bytes): The raw request body.
+        limits (RequestLimits): The request limits.
+
+    Raises:
+        InvalidRequestException: If the body is not a valid embedding request.
+
+    Returns:
+        EmbeddingRequest: The request, built without validation.
+    """
+    try:
+        document = orjson.loads(body)
+    except orjson.JSONDecodeError as e:
+        raise InvalidRequestException(message=f"Invalid JSON body: {e}") from e
+    if not isinstance(document, dict):
+        raise InvalidRequestException(message="The body must be a JSON object.")
+
+    model = document.get("model")
+    if not isinstance(model, str):
+        raise InvalidRequestException(message="The model must be a string.")
+    output_mode = document.get("output_mode", OutputMode.DENSE.value)
+    if type(output_mode) is not str or output_mode not in _OUTPUT_MODES:
+        raise InvalidRequestException(
+            message=f"The output mode must be one of {sorted(_OUTPUT_MODES)}."
+        )
+    encoding_format = document.get("encoding_format", "float")
+    if type(encoding_format) is not str or encoding_format not in _ENCODING_FORMATS:
+        raise InvalidRequestException(
+            message=f"The encoding format must be one of {sorted(_ENCODING_FORMATS)}."
+        )
+    for field in ("user", "prompt_name"):
+        if not isinstance(document.get(field), (str, type(None))):
+            raise InvalidRequestException(message=f"The {field} must be a string.")
+    if "input" not in document:
+        raise InvalidRequestException(message="The input is required.")
+
+    return EmbeddingRequest.model_construct(
+        input=_check_input(document["input"], limits),
+        model=model,
+        user=document.get("user"),
+        output_mode=output_mode,
+        prompt_name=document.get("prompt_name"),
+        encoding_format=encoding_format,
+    )
@@ -4,7 +4,7 @@ import time
 from typing import List, Literal, Optional, Union
 from uuid import uuid4
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, field_validator
 
 
 class HealthCheck(BaseModel):
@@ -69,14 +69,35 @@ class EmbeddingRequest(BaseModel):
     """Request for embedding text data.
 
     Attributes:
-        input (List[str]): List of input sentences to be embedded.
+        input (Union[List[str], List[List[int]]]): List of input sentences to be embedded, or
+            of their token ids from the tokenizer of the model, special tokens included. A
+            single list of token ids is one input.
         model str: Model to be used for embedding.
         user (Optional[str], optional): User making the request.
+        output_mode (Literal["dense", "multi_vector", "sparse"]): Output mode of the embeddings,
+            default is "dense".
+        prompt_name (Optional[str], optional): Name of a prompt of the model prefixed to every
+            input, such as "query" or "passage".
+        encoding_format (Literal["float", "base64"]): Encoding of the dense embeddings, lists
+            of numbers or the base64 of their little-endian bytes, default is "float".
     """
 
-    input: List[str]
+    input: Union[List[str], List[List[int]], List[int]]
     model: str
     user: Optional[str] = None
+    output_mode: Literal["dense", "multi_vector", "sparse"] = "dense"
+    prompt_name: Optional[str] = None
+    encoding_format: Literal["float", "base64"] = "float"
+
+    @field_validator("input")
+    @classmethod
+    def _wrap_token_ids(cls, value: list) -> list:
+        """Reject an empty input and wrap a single list of token ids as one input."""
+        if not value:
+            raise ValueError("The input must not be empty.")
+        if isinstance(value[0], int):
+            return [value]
+        return value
 
 
 class Usage(BaseModel):
@@ -85,10 +106,13 @@ class Usage(BaseModel):
     Attributes:
         prompt_tokens (str): Count of prompt tokens.
         total_tokens (str): Count of total tokens.
+        prefix_tokens (int): Count of the tokens of the selected prompt prefix, not
+            included in the other counts.
     """
 
     prompt_tokens: int | str
     total_tokens: int | str
+    prefix_tokens: int = 0
 
 
 class EmbeddingData(BaseModel):
@@ -96,12 +120,13 @@ class EmbeddingData(BaseModel):
 
     Attributes:
         object (Literal["embedding"]): Type of the object, default is "embedding".
-        embedding (List[Union[float, int]]): Embedding vector.
+        embedding (Union[List[Union[float, int]], str]): Embedding vector, or the base64 of its
+            little-endian bytes.
         index (int): Index of the embedding in the input list.
     """
 
     object: Literal["embedding"] = "embedding"
-    embedding: List[Union[float, int]]
+    embedding: Union[List[Union[float, int]], str]
     usage: Usage
     index: int
 
@@ -122,3 +147,132 @@ class EmbeddingResponse(BaseModel):
     model: str
     id: str = Field(default_factory=lambda: f"textembed-{uuid4()}")
     created: int = Field(default_factory=lambda: int(time.time()))
+
+
+class RaggedEmbeddingData(BaseModel):
+    """Variable-length embeddings of every input, stored in flat arrays.
+
+    The rows of input `i` are `values[offsets[i]:offsets[i + 1]]`.
+
+    Attributes:
+        values (List[Union[List[Union[float, int]], float]]): Token embeddings for multi-vector
+            outputs, non-zero vocabulary weights for sparse outputs.
+        offsets (List[int]): Start of every input in `values`, followed by the total length.
+        indices (Optional[List[int]], optional): Vocabulary ids of the sparse weights.
+    """
+
+    values: List[Union[List[Union[float, int]], float]]
+    offsets: List[int]
+    indices: Optional[List[int]] = None
+
+
+class RaggedEmbeddingResponse(BaseModel):
+    """Response containing multi-vector or sparse embedding data.
+
+    Attributes:
+        object (Literal["multi_vector", "sparse"]): Output mode of the embeddings.
+        data (RaggedEmbeddingData): Embeddings of every input.
+        usage (Usage): Prompt and total tokens of the request.
+        model (str): Model used for generating embeddings.
+        id (str): Unique identifier for the request, default is a UUID4 string prefixed with "textembed".
+        created (int): Timestamp when the request was created.
+    """
+
+    object: Literal["multi_vector", "sparse"]
+    data: RaggedEmbeddingData
+    usage: Usage
+    model: str
+    id: str = Field(default_factory=lambda: f"textembed-{uuid4()}")
+    created: int = Field(default_factory=lambda: int(time.time()))
+
+
+class IndexAddRequest(EmbeddingRequest):
+    """Request for embedding text data and adding it to a vector index.
+
+    Indexes store dense embeddings, other output modes and the `base64`
+    encoding format are rejected.
+
+    Attributes:
+        ids (Optional[List[str]], optional): Identifiers of the inputs. Defaults to their row numbers.
+    """
+
+    ids: Optional[List[str]] = None
+
+
+class IndexAddResponse(BaseModel):
+    """Response of an index add request.
+
+    Attributes:
+        object (Literal["index.add"]): Type of the object, default is "index.add".
+        index (str): Name of the index.
+        model (str): Model used for generating embeddings.
+        ids (List[str]): Identifiers of the added inputs.
+        count (int): Number of vectors stored in the index.
+    """
+
+    object: Literal["index.add"] = "index.add"
+    index: str
+    model: str
+    ids: List[str]
+    count: int
+
+
+class IndexSearchRequest(EmbeddingRequest):
+    """Request for searching a vector index with embedded queries.
+
+    Queries are embedded as dense embeddings, other output modes and the
+    `base64` encoding format are rejected.
+
+    Attributes:
+        top_k (int): Number of results per query, default is 10.
+    """
+
+    top_k: int = Field(default=10, ge=1)
+
+
+class IndexHit(BaseModel):
+    """A single search result.
+
+    Attributes:
+        id (str): Identifier of the stored input.
+        score (float): Inner product for float indexes, Hamming distance for binary ones.
+    """
+
+    id: str
+    score: float
+
+
+class IndexSearchData(BaseModel):
+    """Search results of one query.
+
+    Attributes:
+        hits (List[IndexHit]): Closest stored inputs, best first.
+        index (int): Index of the query in the input list.
+    """
+
+    hits: List[IndexHit]
+    index: int
+
+
+class IndexSearchResponse(BaseModel):
+    """Response of an index search request.
+
+    Attributes:
+        object (Literal["index.search"]): Type of the object, default is "index.search".
+        data (List[IndexSearchData]): Search results of every query.
+        model (str): Model used for generating embeddings.
+    """
+
+    object: Literal["index.search"] = "index.search"
+    data: List[IndexSearchData]
+    model: str
+
+
+class IndexSaveRequest(BaseModel):
+    """Request for writing a snapshot of a vector index.
+
+    Attributes:
+        model (str): Model owning the index.
+    """
+
+    model: str
@@ -1,24 +1,40 @@
 """Application configuration"""
 
+import asyncio
 from contextlib import asynccontextmanager
-from typing import List, Union
+from typing import List, Optional, Union
 
 from fastapi import FastAPI
 from prometheus_fastapi_instrumentator import Instrumentator
 
 import textembed
 from textembed.api import docs
+from textembed.api.debug import debug_router
 from textembed.api.embed import embed_router
+from textembed.api.index import index_router
+from textembed.api.limits import RequestLimits
 from textembed.api.monitor import monitor_router
+from textembed.binary.server import BinaryEmbeddingServer
+from textembed.compression import CompressionConfig, CompressionMiddleware
 from textembed.engine.args import AsyncEngineArgs
 from textembed.engine.async_engine_array import AsyncEngineArray
 from textembed.log import logger
+from textembed.tracing import SpanExporter, TracingMiddleware
 
 
 def create_application(
     engine_args_list: List[AsyncEngineArgs],
     doc_extra: dict,
     api_key: Union[str, None] = None,
+    memory_budget: Optional[int] = None,
+    max_concurrent_batches: Optional[int] = None,
+    admin_key: Union[str, None] = None,
+    tracing: bool = False,
+    span_exporter: Optional[SpanExporter] = None,
+    binary_port: Optional[int] = None,
+    reuse_port: bool = False,
+    request_limits: Optional[RequestLimits] = None,
+    compression: Optional[CompressionConfig] = None,
 ) -> FastAPI:
     """Crate FastAPI Application
 
@@ -26,6 +42,17 @@ def create_application(
         engine_args (AsyncEngineArgs): Async engine arguments
         doc_extra (dict): Dict of host and port.
         api_key (Union(str, None)): Api key.
+        memory_budget (Optional[int]): Maximum resident size of the loaded models, in bytes.
+        max_concurrent_batches (Optional[int]): Maximum number of batches running at once across the models.
+        admin_key (Union(str, None)): Admin key of the debugging endpoints, disabled when None.
+        tracing (bool): Whether to trace the embedding requests and add a `Server-Timing` header.
+        span_exporter (Optional[SpanExporter]): Exporter of the request traces. Enables tracing.
+        binary_port (Optional[int]): Port of the binary embedding protocol, disabled when None.
+        reuse_port (bool): Whether the binary protocol port is shared by several server processes.
+        request_limits (Optional[RequestLimits]): Limits of the embedding requests, the
+                                                  `RequestLimits` defaults when None.
+        compression (Optional[CompressionConfig]): Compression of the embedding responses,
+                                                   disabled when None.
 
     Returns:
         FastAPI: FastAPI application
@@ -43,13 +70,34 @@ def create_application(
             )
         )
         app.state.async_engine_array = AsyncEngineArray.from_args(
-            engine_args_list=engine_args_list
+            engine_args_list=engine_args_list,
+            memory_budget=memory_budget,
+            max_concurrent_batches=max_concurrent_batches,
         )
         app.state.api_key = api_key
+        app.state.admin_key = admin_key
+        app.state.request_limits = request_limits or RequestLimits()
 
-        await app.state.async_engine_array.start_all()
+        # Load the models in the background so `/ready` can report their progress
+        start_task = asyncio.create_task(app.state.async_engine_array.start_all())
+
+        binary_server = None
+        if binary_port is not None:
+            binary_server = BinaryEmbeddingServer(
+                app.state.async_engine_array, api_key=api_key
+            )
+            await binary_server.start(
+                host=doc_extra.get("host", "localhost"),
+                port=binary_port,
+                reuse_port=reuse_port,
+            )
         yield
+        if binary_server is not None:
+            await binary_server.stop()
+        await start_task
         await app.state.async_engine_array.stop_all()
+        if span_exporter is not None:
+            span_exporter.shutdown()
 
     app = FastAPI(
         title=docs.FASTAPI_TITLE,
@@ -67,13 +115,22 @@ def create_application(
         should_ignore_untemplated=True,
         should_respect_env_var=True,
         should_instrument_requests_inprogress=True,
-        excluded_handlers=[".*admin.*"],
+        excluded_handlers=[".*admin.*", ".*debug.*"],
         inprogress_name="inprogress",
         inprogress_labels=True,
     )
     instrumentator.instrument(app)
 
+    # Added first so that the traces, outside of it, cover the compression
+    if compression is not None:
+        app.add_middleware(CompressionMiddleware, config=compression)
+
+    if tracing or span_exporter is not None:
+        app.add_middleware(TracingMiddleware, exporter=span_exporter)
+
     app.include_router(monitor_router)
     app.include_router(embed_router)
+    app.include_router(index_router)
+    app.include_router(debug_router)
 
     return app
@@ -0,0 +1,104 @@
+"""Multi-process serving"""
+
+import gc
+import multiprocessing
+import os
+import signal
+import socket
+
+import uvicorn
+from fastapi import FastAPI
+
+from textembed.log import logger
+
+
+def _reuse_port_socket(host: str, port: int) -> socket.socket:
+    """Bind a listening socket that other processes can bind to the same port.
+
+    Args:
+        host (str): The host address to bind.
+        port (int): The port to bind.
+
+    Returns:
+        socket.socket: The bound socket.
+    """
+    family = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)[0][0]
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.set_inheritable(True)
+    return sock
+
+
+def _serve_process(app: FastAPI, host: str, port: int, threads: int):
+    """Run the application in a forked server process.
+
+    Args:
+        app (FastAPI): The application.
+        host (str): The host address on which the application will run.
+        port (int): The port number on which the application will run.
+        threads (int): Number of torch threads of the process.
+    """
+    import torch
+
+    torch.set_num_threads(threads)
+    sock = _reuse_port_socket(host, port)
+    server = uvicorn.Server(uvicorn.Config(app, log_level="error"))
+    server.run(sockets=[sock])
+
+
+def serve_processes(app: FastAPI, host: str, port: int, processes: int):
+    """Serve the application from several forked processes.
+
+    Every process binds its own socket with `SO_REUSEPORT`, so the kernel
+    balances the connections between them. Models loaded before calling this,
+    see `preload_model`, are shared copy-on-write by the processes. The cores
+    are split between the processes for the torch intra-op threads.
+
+    Args:
+        app (FastAPI): The application.
+        host (str): The host address on which the application will run.
+        port (int): The port number on which the application will run.
+        processes (int): Number of server processes.
+
+    Raises:
+        RuntimeError: If the platform does not support `SO_REUSEPORT` or `fork`.
+    """
+    if not hasattr(socket, "SO_REUSEPORT"):
+        raise RuntimeError("Several server processes require SO_REUSEPORT support.")
+    if "fork" not in multiprocessing.get_all_start_methods():
+        raise RuntimeError("Several server processes require fork support.")
+
+    # Keep the garbage collector of the children from touching, and so copying,
+    # the pages of every object allocated so far
+    gc.freeze()
+    threads = max((os.cpu_count() or 1) // processes, 1)
+    context = multiprocessing.get_context("fork")
+    children = [
+        context.Process(
+            target=_serve_process,
+            args=(app, host, port, threads),
+            name=f"textembed-server-{index}",
+        )
+        for index in range(processes)
+    ]
+    for child in children:
+        child.start()
+    logger.info(
+        "Started %d server processes with %d torch threads each.", processes, threads
+    )
+
+    def stop_children(signum, frame):
+        for child in children:
+            if child.is_alive():
+                child.terminate()
+
+    signal.signal(signal.SIGINT, stop_children)
+    signal.signal(signal.SIGTERM, stop_children)
+    for child in children:
+        child.join()
+        if child.exitcode:
+            logger.error(
+                "Server process %s exited with code %d.", child.name, child.exitcode
+            )
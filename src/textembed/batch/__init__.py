@@ -1,5 +1,23 @@
 """Init batch"""
 
-from textembed.batch.batch_processor import BatchProcessor
+import importlib
+from typing import TYPE_CHECKING
 
-__all__ = ["BatchProcessor"]
+if TYPE_CHECKING:
+    from textembed.batch.batch_processor import BatchProcessor
+    from textembed.batch.scheduler import BatchScheduler
+
+__all__ = ["BatchProcessor", "BatchScheduler"]
+
+# The batch processor imports torch, it is only imported on first access
+_EXPORTS = {
+    "BatchProcessor": "textembed.batch.batch_processor",
+    "BatchScheduler": "textembed.batch.scheduler",
+}
+
+
+def __getattr__(name: str):
+    """Import an export of the package on first access."""
+    if name in _EXPORTS:
+        return getattr(importlib.import_module(_EXPORTS[name]), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -2,26 +2,98 @@
 
 import asyncio
 import time
-from asyncio import Queue
-from typing import List
+from collections import deque
+from typing import Deque, Dict, List, Optional
 
+import numpy as np
+from PIL import Image
+
+from textembed.batch.scheduler import BatchScheduler
 from textembed.executor.embedder.sentence_transformer import SentenceTransformerEmbedder
+from textembed.executor.images import PreprocessedImage
+from textembed.executor.primitives import OutputMode
+from textembed.executor.tokens import PromptedText, TokenIds
 from textembed.log import logger
+from textembed.metrics import (
+    BATCH_QUEUE_WAIT_SECONDS,
+    BATCH_SIZE_TEXTS,
+    BATCH_WORKER_BUSY_SECONDS,
+    BATCH_WORKERS,
+    QUEUE_DEPTH,
+)
+from textembed.tracing import BATCH_STAGES, Trace, new_id
+
+TEXT = "text"
+IMAGE = "image"
+
+
+def _is_image(item) -> bool:
+    """Whether an input is an image rather than a text."""
+    return isinstance(item, (PreprocessedImage, Image.Image))
+
+
+def _estimate_tokens(text: str) -> int:
+    """Estimate the tokens of a text, without its special tokens.
+
+    ASCII text averages about 4 characters per token. Other scripts get far
+    fewer, down to a token per character for CJK, so their characters are
+    counted as a token each to keep batches within their token budget.
+    """
+    if text.isascii():
+        return len(text) // 4
+    ascii_chars = len(text.encode("ascii", "ignore"))
+    return ascii_chars // 4 + len(text) - ascii_chars
+
+
+def _estimate_cost(modality: str, items: list) -> int:
+    """Estimate the cost of inputs: roughly their tokens for texts, their count for images.
+
+    Args:
+        modality (str): Modality of the inputs, `text` or `image`.
+        items (list): The inputs.
+
+    Returns:
+        int: The estimated cost.
+    """
+    if modality == IMAGE:
+        return len(items)
+    cost = 0
+    for item in items:
+        if isinstance(item, TokenIds):
+            cost += item.input_ids.shape[0]
+        elif isinstance(item, PromptedText):
+            cost += _estimate_tokens(item.text) + 2 + item.prompt_ids.shape[0]
+        else:
+            # Plus the special tokens
+            cost += _estimate_tokens(item) + 2
+    return cost
 
 
 class BatchProcessor:
     """Batch Processor for handling asynchronous text embedding requests.
 
-    This class manages a queue of embedding requests and processes them in batches
-    using multiple worker tasks.
+    This class manages a queue of embedding requests and processes them in batches.
+    When to run a batch, and from which queue, is decided by a `BatchScheduler`,
+    which may be shared with the processors of other models. Texts and images
+    have their own queue and batch limits, so the two modalities are never
+    mixed in a batch. A batch is limited both in requests and in estimated
+    cost: tokens for texts, images for images. Requests mixing texts and images
+    are split between the two queues and joined back once both parts are
+    processed. Queue wait, queue depth, batch size and worker busy time are
+    exported as Prometheus metrics labelled by served model. Traced requests
+    get spans for their queue wait, the batch they joined and its processing
+    stages.
 
     Attributes:
         model (SentenceTransformerEmbedder): The model used for generating embeddings.
-        workers (int): The number of worker tasks to process requests.
+        workers (int): The maximum number of batches of a modality running at once.
         batch_size (int): The maximum number of requests to process in a single batch.
-        request_queue (Queue): The queue holding incoming embedding requests.
-        loop (asyncio.AbstractEventLoop): The event loop used to create worker tasks.
-        worker_tasks (List[asyncio.Task]): The list of worker tasks.
+        max_batch_tokens (Optional[int]): The maximum estimated tokens of a text batch.
+        image_batch_size (int): The maximum number of images of an image batch.
+        request_queues (Dict[str, Deque[tuple]]): The queues holding incoming embedding
+            requests, by modality, with their cost estimated once queued.
+        scheduler (BatchScheduler): The scheduler running the batches.
+        loop (asyncio.AbstractEventLoop): The event loop of the processor.
     """
 
     def __init__(
@@ -29,99 +101,382 @@ class BatchProcessor:
         model: SentenceTransformerEmbedder,
         workers: int,
         batch_size: int,
+        max_batch_tokens: Optional[int] = None,
+        image_batch_size: int = 16,
+        scheduler: Optional[BatchScheduler] = None,
     ) -> None:
         """Initialize the BatchProcessor with the given model, number of workers, and batch size.
 
+        The image queue only exists for models accepting images.
+
         Args:
             model (SentenceTransformerEmbedder): The model used for generating embeddings.
-            workers (int): The number of worker tasks to process requests.
+            workers (int): The maximum number of batches of a modality running at once.
             batch_size (int): The maximum number of requests to process in a single batch.
+            max_batch_tokens (Optional[int]): The maximum estimated tokens of a text batch.
+                                              Unlimited when None.
+            image_batch_size (int): The maximum number of images of an image batch.
+            scheduler (Optional[BatchScheduler]): Scheduler shared with other processors.
+                                                  The processor gets its own when None.
         """
         self.model = model
         self.workers = workers
         self.batch_size = batch_size
-        self.request_queue: Queue = Queue()
+        self.max_batch_tokens = max_batch_tokens
+        self.image_batch_size = image_batch_size
+        modalities = [TEXT] if model.image_processor is None else [TEXT, IMAGE]
+        self.request_queues: Dict[str, Deque[tuple]] = {
+            modality: deque() for modality in modalities
+        }
+        # Measured batch duration per unit of estimated cost, by modality
+        self._seconds_per_cost: Dict[str, float] = {}
+        self._pending: Dict[SentenceTransformerEmbedder, int] = {}
+        self._progress = asyncio.Event()
         self.loop = asyncio.get_running_loop()
-        self.worker_tasks = [
-            self.loop.create_task(self.batch_processor(i)) for i in range(workers)
-        ]
-        # Wait until all worker tasks are started
-        self.loop.create_task(self._log_workers_started())
-
-    async def _log_workers_started(self):
-        await asyncio.sleep(0)  # Yield control to ensure workers have started
+        self._own_scheduler = scheduler is None
+        self.scheduler = (
+            BatchScheduler(max_concurrent_batches=workers * len(modalities))
+            if scheduler is None
+            else scheduler
+        )
+        BATCH_WORKERS.labels(model=self.model.engine_args.served_model_name).inc(
+            workers * len(modalities)
+        )
+        self.scheduler.register(self)
         logger.info(
-            "All %d workers have started batch processing for the %s model.",
+            "Batch processing started with %d workers for the %s model.",
             self.workers,
             self.model.engine_args.model,
         )
 
-    async def batch_processor(self, worker_id: int):
-        """Worker task that processes requests from the queue in batches.
+    def _batch_limit(self, modality: str) -> Optional[int]:
+        """The maximum estimated cost of a batch of the given modality."""
+        return self.image_batch_size if modality == IMAGE else self.max_batch_tokens
+
+    def _batch_size(self, modality: str) -> int:
+        """The number of requests at the head of a queue forming its next batch.
+
+        Requests are taken until the batch reaches its request or cost limit. A
+        single request is always accepted, whatever its cost.
 
         Args:
-            worker_id (int): The identifier for the worker task.
+            modality (str): Modality of the queue, `text` or `image`.
+
+        Returns:
+            int: The number of requests of the next batch.
         """
+        queue = self.request_queues[modality]
+        limit = self._batch_limit(modality)
+        size = min(len(queue), self.batch_size)
+        if limit is None:
+            return size
+        cost = 0
+        for i in range(size):
+            cost += queue[i][6]
+            if i and cost > limit:
+                return i
+        return size
+
+    def oldest(self, modality: str) -> Optional[float]:
+        """Get the time the oldest queued request of a modality was queued.
+
+        Args:
+            modality (str): Modality of the queue, `text` or `image`.
+
+        Returns:
+            Optional[float]: The `time.perf_counter` time it was queued, None if the queue is empty.
+        """
+        queue = self.request_queues[modality]
+        return queue[0][4] if queue else None
+
+    def estimate_batch_seconds(self, modality: str) -> float:
+        """Estimate the duration of the next batch of a queue from its cost.
+
+        Args:
+            modality (str): Modality of the queue, `text` or `image`.
+
+        Returns:
+            float: The estimated duration in seconds, 0 until a batch was measured.
+        """
+        queue = self.request_queues[modality]
+        cost = sum(queue[i][6] for i in range(self._batch_size(modality)))
+        return cost * self._seconds_per_cost.get(modality, 0.0)
+
+    def take_batch(self, modality: str) -> list:
+        """Take the requests of the next batch from the queue of a modality.
+
+        Args:
+            modality (str): Modality of the batch, `text` or `image`.
+
+        Returns:
+            list: The requests of the batch, possibly empty.
+        """
+        queue = self.request_queues[modality]
+        return [queue.popleft() for _ in range(self._batch_size(modality))]
+
+    async def run_batch(self, modality: str, requests: list):
+        """Process a batch of requests and set their results.
+
+        Args:
+            modality (str): Modality of the requests, `text` or `image`.
+            requests (list): The requests of the batch.
+        """
+        start_time = time.perf_counter()
+        for req in requests:
+            model_name = req[3].engine_args.served_model_name
+            QUEUE_DEPTH.labels(model=model_name).dec()
+            BATCH_QUEUE_WAIT_SECONDS.labels(model=model_name).observe(
+                start_time - req[4]
+            )
+
+        # Group the requests of every model sharing this processor
+        models = list(dict.fromkeys(req[3] for req in requests))
+        requests.sort(key=lambda req: models.index(req[3]))
+        all_texts = [
+            text for req in requests for text in req[0]
+        ]  # Flatten list of lists
+        segments = [
+            (
+                model,
+                sum(len(req[0]) for req in requests if req[3] is model),
+                list(dict.fromkeys(req[2] for req in requests if req[3] is model)),
+            )
+            for model in models
+        ]
+        # A batch shared by several models counts the texts of each under its name
+        for model, count, _ in segments:
+            BATCH_SIZE_TEXTS.labels(model=model.engine_args.served_model_name).observe(
+                count
+            )
+        traced = any(req[5] is not None for req in requests)
+        stages_token = BATCH_STAGES.set([] if traced else None)
+
+        try:
+            if len(segments) == 1:
+                results = [await models[0].process_batch(all_texts, segments[0][2])]
+            else:
+                results = await models[0].process_shared_batch(all_texts, segments)
+            # Split embeddings back to individual futures
+            for (model, _, _), (embeddings, usage) in zip(segments, results):
+                idx = 0
+                for req in requests:
+                    if req[3] is not model:
+                        continue
+                    num_texts = len(req[0])
+                    req[1].set_result(
+                        (
+                            embeddings[req[2]][idx : idx + num_texts],
+                            usage[idx : idx + num_texts],
+                        )
+                    )
+                    idx += num_texts
+        except Exception as e:
+            for req in requests:
+                if not req[1].done():
+                    req[1].set_exception(e)
+        finally:
+            if traced:
+                self._trace_batch(requests, start_time, BATCH_STAGES.get())
+            BATCH_STAGES.reset(stages_token)
+            self._complete(requests)
+
+        elapsed = time.perf_counter() - start_time
+        BATCH_WORKER_BUSY_SECONDS.labels(
+            model=self.model.engine_args.served_model_name
+        ).inc(elapsed)
+        # Exponential moving average of the duration per unit of cost
+        cost = sum(req[6] for req in requests)
+        seconds_per_cost = elapsed / max(cost, 1)
+        previous = self._seconds_per_cost.get(modality)
+        self._seconds_per_cost[modality] = (
+            seconds_per_cost
+            if previous is None
+            else 0.8 * previous + 0.2 * seconds_per_cost
+        )
         logger.debug(
-            "Worker with ID %d has started batch processing for the %s model.",
-            worker_id,
-            self.model.engine_args.model,
+            "Processed %s batch of %d requests in %.4f ms",
+            modality,
+            len(requests),
+            elapsed * 1000,
         )
-        while True:
-            start_time = time.perf_counter()
-            requests = []
-            try:
-                while len(requests) < self.batch_size:
-                    request = await asyncio.wait_for(
-                        self.request_queue.get(), timeout=0.05
-                    )
-                    requests.append(request)
-            except asyncio.TimeoutError:
-                pass
-
-            if requests:
-                all_texts = [
-                    text for req in requests for text in req[0]
-                ]  # Flatten list of lists
-                futures = [req[1] for req in requests]
-
-                try:
-                    embeddings, usage = await self.model.process_batch(all_texts)
-                    # Split embeddings back to individual futures
-                    idx = 0
-                    for future, req in zip(futures, requests):
-                        num_texts = len(req[0])
-                        future.set_result(
-                            (
-                                embeddings[idx : idx + num_texts],
-                                usage[idx : idx + num_texts],
-                            )
-                        )
-                        idx += num_texts
-                except Exception as e:
-                    for future in futures:
-                        future.set_exception(e)
-
-                logger.debug(
-                    "Worker %d processed batch in %.4f ms",
-                    worker_id,
-                    (time.perf_counter() - start_time) * 1000,
-                )
-
-    async def add_request(self, texts: List[str], future: asyncio.Future):
+
+    @staticmethod
+    def _trace_batch(requests: list, start_time: float, stages: list):
+        """Add the queue wait, batch and stage spans to the traced requests.
+
+        Args:
+            requests (list): The requests of the batch.
+            start_time (float): Time the batch was picked from the queue.
+            stages (list): Name, start and end time of the processing stages.
+        """
+        batch_id = new_id()
+        end_time = time.perf_counter()
+        num_texts = sum(len(req[0]) for req in requests)
+        for req in requests:
+            trace: Trace = req[5]
+            if trace is None:
+                continue
+            trace.add_span("queue_wait", req[4], start_time)
+            batch_span = trace.add_span(
+                "batch",
+                start_time,
+                end_time,
+                batch_id=batch_id,
+                batch_requests=len(requests),
+                batch_texts=num_texts,
+            )
+            for stage, stage_start, stage_end in stages:
+                trace.add_span(stage, stage_start, stage_end, parent=batch_span)
+
+    @property
+    def pending(self) -> int:
+        """The number of requests queued or being processed."""
+        return sum(self._pending.values())
+
+    def pending_for(self, model: SentenceTransformerEmbedder) -> int:
+        """Get the number of requests of a model queued or being processed.
+
+        Args:
+            model (SentenceTransformerEmbedder): The model of the requests.
+
+        Returns:
+            int: The number of pending requests.
+        """
+        return self._pending.get(model, 0)
+
+    def _complete(self, requests: list):
+        """Mark processed requests as done and wake up the drain waiters.
+
+        Args:
+            requests (list): The processed requests.
+        """
+        for request in requests:
+            self._pending[request[3]] -= 1
+            if not self._pending[request[3]]:
+                del self._pending[request[3]]
+        self._progress.set()
+
+    async def drain(self, model: Optional[SentenceTransformerEmbedder] = None):
+        """Wait until every queued request, or every request of a model, is processed.
+
+        Args:
+            model (Optional[SentenceTransformerEmbedder]): Only wait for the requests
+                of this model. Waits for all requests when None.
+        """
+        while self.pending if model is None else self.pending_for(model):
+            self._progress.clear()
+            await self._progress.wait()
+
+    async def add_request(
+        self,
+        texts: List[str],
+        future: asyncio.Future,
+        output_mode: str = OutputMode.DENSE.value,
+        model: Optional[SentenceTransformerEmbedder] = None,
+        trace: Optional[Trace] = None,
+    ):
         """Add a new embedding request to the queue.
 
+        Requests with different output modes share batches; every output mode
+        needed by a batch is built from its single forward pass. Requests for
+        other models sharing the backbone of this processor's model share
+        batches too, only their heads run separately.
+
         Args:
             texts (List[str]): List of sentences to be embedded.
             future (asyncio.Future): Future object to set the result of embeddings.
+            output_mode (str): Output mode of the embeddings.
+            model (Optional[SentenceTransformerEmbedder]): Model of the request.
+                Defaults to the model of the processor.
+            trace (Optional[Trace]): Trace of the request, if it is traced.
+
+        Raises:
+            ValueError: If the request has images the model does not accept, or
+                mixes texts and images with an output mode other than dense.
         """
-        await self.request_queue.put((texts, future))
+        model = self.model if model is None else model
+        image_positions = [i for i, item in enumerate(texts) if _is_image(item)]
+        if image_positions and IMAGE not in self.request_queues:
+            raise ValueError(
+                f"The {model.engine_args.model} model does not accept images."
+            )
+        if not image_positions or len(image_positions) == len(texts):
+            modality = IMAGE if image_positions else TEXT
+            await self._enqueue(modality, texts, future, output_mode, model, trace)
+            return
+
+        # Split mixed requests by modality and join the parts once processed,
+        # only dense embeddings have the same shape for both
+        if output_mode != OutputMode.DENSE.value:
+            raise ValueError("Requests mixing texts and images must be dense.")
+        text_positions = [i for i, item in enumerate(texts) if not _is_image(item)]
+        parts = []
+        for modality, positions in ((TEXT, text_positions), (IMAGE, image_positions)):
+            part = self.loop.create_future()
+            parts.append((positions, part))
+            await self._enqueue(
+                modality, [texts[i] for i in positions], part, output_mode, model, trace
+            )
+        for _, part in parts:
+            part.add_done_callback(
+                lambda _: self._join_parts(future, parts, len(texts))
+            )
+
+    async def _enqueue(
+        self,
+        modality: str,
+        texts: list,
+        future: asyncio.Future,
+        output_mode: str,
+        model: SentenceTransformerEmbedder,
+        trace: Optional[Trace],
+    ):
+        """Put a request in the queue of a modality."""
+        self._pending[model] = self._pending.get(model, 0) + 1
+        QUEUE_DEPTH.labels(model=model.engine_args.served_model_name).inc()
+        self.request_queues[modality].append(
+            (
+                texts,
+                future,
+                output_mode,
+                model,
+                time.perf_counter(),
+                trace,
+                _estimate_cost(modality, texts),
+            )
+        )
+        self.scheduler.notify()
+
+    @staticmethod
+    def _join_parts(future: asyncio.Future, parts: list, num_inputs: int):
+        """Set the result of a split request once all its parts are processed.
+
+        Args:
+            future (asyncio.Future): Future of the whole request.
+            parts (list): Input positions and future of every part.
+            num_inputs (int): Number of inputs of the whole request.
+        """
+        if future.done() or not all(part.done() for _, part in parts):
+            return
+        for _, part in parts:
+            if part.exception() is not None:
+                future.set_exception(part.exception())  # type: ignore
+                return
+        first: np.ndarray = parts[0][1].result()[0]
+        embeddings = np.empty((num_inputs,) + first.shape[1:], dtype=first.dtype)
+        usage: list = [None] * num_inputs
+        for positions, part in parts:
+            part_embeddings, part_usage = part.result()
+            embeddings[positions] = part_embeddings
+            for position, input_usage in zip(positions, part_usage):
+                usage[position] = input_usage
+        future.set_result((embeddings, usage))
 
     async def shutdown(self):
-        """Shutdown the batch processor by cancelling all worker tasks."""
-        for task in self.worker_tasks:
-            task.cancel()
-            try:
-                await task
-            except asyncio.CancelledError:
-                logger.info("Worker task cancelled.")
+        """Shutdown the batch processor, its queued requests are no longer processed."""
+        BATCH_WORKERS.labels(model=self.model.engine_args.served_model_name).dec(
+            self.workers * len(self.request_queues)
+        )
+        self.scheduler.unregister(self)
+        if self._own_scheduler:
+            await self.scheduler.shutdown()
@@ -0,0 +1,146 @@
+"""Batch Scheduler"""
+
+import asyncio
+import time
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+from textembed.log import logger
+
+if TYPE_CHECKING:
+    from textembed.batch.batch_processor import BatchProcessor
+
+# Floor of the estimated batch duration, so unmeasured queues are not divided by 0
+_MIN_SERVICE_SECONDS = 1e-4
+
+
+class BatchScheduler:
+    """Chooses which batch runs next across the queues of several batch processors.
+
+    A single dispatch task owns the compute budget of an engine array: at most
+    `max_concurrent_batches` batches run at once, whatever the number of
+    models. The task sleeps until a request is queued or a batch finishes, so
+    idle models cost nothing.
+
+    Whenever a slot is free, the queue with the highest response ratio
+    `(wait + service) / service` is served, where `wait` is the queue age of
+    its oldest request and `service` the estimated duration of the batch it
+    would form, from the cost of the batch and the measured duration per cost
+    unit of the queue. Cheap batches go first, and a queue gains priority the
+    longer it waits, so expensive models are not starved.
+
+    Attributes:
+        max_concurrent_batches (int): The maximum number of batches running at once.
+        processors (List[BatchProcessor]): The batch processors whose queues are scheduled.
+    """
+
+    def __init__(self, max_concurrent_batches: int = 1) -> None:
+        """Initialize the scheduler.
+
+        Args:
+            max_concurrent_batches (int): The maximum number of batches running at once.
+        """
+        if max_concurrent_batches < 1:
+            raise ValueError(
+                "Max concurrent batches must be greater than or equal to 1."
+            )
+        self.max_concurrent_batches = max_concurrent_batches
+        self.processors: List["BatchProcessor"] = []
+        self._running: Dict[Tuple["BatchProcessor", str], int] = {}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def register(self, processor: "BatchProcessor"):
+        """Schedule the queues of a batch processor.
+
+        Args:
+            processor (BatchProcessor): The batch processor.
+        """
+        self.processors.append(processor)
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._dispatch())
+        self.notify()
+
+    def unregister(self, processor: "BatchProcessor"):
+        """Stop scheduling the queues of a batch processor.
+
+        Args:
+            processor (BatchProcessor): The batch processor.
+        """
+        if processor in self.processors:
+            self.processors.remove(processor)
+
+    def notify(self):
+        """Wake up the dispatch task, after a request was queued or a batch finished."""
+        self._wakeup.set()
+
+    @property
+    def running(self) -> int:
+        """The number of batches running."""
+        return sum(self._running.values())
+
+    def _select(self) -> Optional[Tuple["BatchProcessor", str]]:
+        """Choose the queue to serve next.
+
+        Returns:
+            Optional[Tuple[BatchProcessor, str]]: The batch processor and modality of
+                the queue with the highest response ratio, None if no queue can run.
+        """
+        now = time.perf_counter()
+        best, best_key = None, None
+        for processor in self.processors:
+            for modality in processor.request_queues:
+                oldest = processor.oldest(modality)
+                if oldest is None:
+                    continue
+                if self._running.get((processor, modality), 0) >= processor.workers:
+                    continue
+                service = max(
+                    processor.estimate_batch_seconds(modality), _MIN_SERVICE_SECONDS
+                )
+                wait = now - oldest
+                key = ((wait + service) / service, wait)
+                if best_key is None or key > best_key:
+                    best, best_key = (processor, modality), key
+        return best
+
+    async def _dispatch(self):
+        """Start the next batch whenever a slot is free and a queue has requests."""
+        while True:
+            self._wakeup.clear()
+            selected = (
+                self._select() if self.running < self.max_concurrent_batches else None
+            )
+            if selected is None:
+                await self._wakeup.wait()
+                continue
+            processor, modality = selected
+            self._running[selected] = self._running.get(selected, 0) + 1
+            # Not kept in a local, which would hold the results until the next batch
+            task = asyncio.get_running_loop().create_task(
+                processor.run_batch(modality, processor.take_batch(modality))
+            )
+            task.add_done_callback(lambda _, key=selected: self._finished(key))
+            # Let the batch and the request handlers run before choosing again
+            await asyncio.sleep(0)
+
+    def _finished(self, key: Tuple["BatchProcessor", str]):
+        """Release the slot of a finished batch.
+
+        Args:
+            key (Tuple[BatchProcessor, str]): The batch processor and modality of the batch.
+        """
+        self._running[key] -= 1
+        if not self._running[key]:
+            del self._running[key]
+        self.notify()
+
+    async def shutdown(self):
+        """Stop dispatching batches."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            logger.info("Batch scheduler stopped.")
+        self._task = None
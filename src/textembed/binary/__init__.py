@@ -0,0 +1,24 @@
+"""Init binary"""
+
+import importlib
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from textembed.binary.client import BinaryEmbeddingClient, BinaryEmbeddingError
+    from textembed.binary.server import BinaryEmbeddingServer
+
+__all__ = ["BinaryEmbeddingClient", "BinaryEmbeddingError", "BinaryEmbeddingServer"]
+
+# The server imports the web framework, clients only import the protocol
+_EXPORTS = {
+    "BinaryEmbeddingClient": "textembed.binary.client",
+    "BinaryEmbeddingError": "textembed.binary.client",
+    "BinaryEmbeddingServer": "textembed.binary.server",
+}
+
+
+def __getattr__(name: str):
+    """Import an export of the package on first access."""
+    if name in _EXPORTS:
+        return getattr(importlib.import_module(_EXPORTS[name]), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
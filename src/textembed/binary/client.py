@@ -0,0 +1,163 @@
+"""Binary embedding client"""
+
+import asyncio
+import itertools
+from collections import deque
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from textembed.binary.protocol import (
+    decode_embeddings,
+    encode_request,
+    read_response,
+)
+
+
+class BinaryEmbeddingError(Exception):
+    """Raised when the server fails to embed a request.
+
+    Attributes:
+        message (str): Description of the error.
+        status_code (int): HTTP status code associated with the error.
+        exc_type (Optional[str]): Type of error.
+    """
+
+    def __init__(self, message: str, status_code: int, exc_type: Optional[str]):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+        self.exc_type = exc_type
+
+
+class BinaryEmbeddingClient:
+    """Client of the binary embedding protocol.
+
+    Concurrent calls share the connection: requests are written as they are
+    made and matched to their responses by id, in whatever order the server
+    completes them.
+
+    Example:
+        ```python
+        async with BinaryEmbeddingClient("localhost", 8001) as client:
+            embeddings, usage = await client.embed(["Hello"], model="all-MiniLM-L6-v2")
+        ```
+    """
+
+    def __init__(self, host: str, port: int, api_key: Optional[str] = None) -> None:
+        """Initialize the client.
+
+        Args:
+            host (str): Host of the server.
+            port (int): Port of the binary protocol.
+            api_key (Optional[str]): API key of the server, if it requires one.
+        """
+        self.host = host
+        self.port = port
+        self.api_key = api_key
+        self._ids = itertools.count()
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._read_task: Optional[asyncio.Task] = None
+
+    async def connect(self):
+        """Open the connection to the server."""
+        reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        self._read_task = asyncio.create_task(self._read_responses(reader))
+
+    async def close(self):
+        """Close the connection, failing the requests still pending."""
+        if self._writer is not None:
+            self._writer.close()
+            await self._writer.wait_closed()
+            self._writer = None
+        if self._read_task is not None:
+            await self._read_task
+            self._read_task = None
+
+    async def __aenter__(self) -> "BinaryEmbeddingClient":
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def _read_responses(self, reader: asyncio.StreamReader):
+        error: Exception = ConnectionError("The connection was closed.")
+        try:
+            while True:
+                response = await read_response(reader)
+                if response is None:
+                    break
+                header, body = response
+                future = self._pending.pop(header["id"], None)
+                if future is None or future.done():
+                    continue
+                if "error" in header:
+                    future.set_exception(
+                        BinaryEmbeddingError(
+                            header["error"]["message"],
+                            header["error"]["status_code"],
+                            header["error"]["exc_type"],
+                        )
+                    )
+                else:
+                    future.set_result(
+                        (decode_embeddings(header, body), header["usage"])
+                    )
+        except Exception as e:
+            error = e
+        finally:
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(error)
+            self._pending.clear()
+
+    async def embed(self, texts: List[str], model: str) -> Tuple[np.ndarray, List[int]]:
+        """Embed sentences.
+
+        Args:
+            texts (List[str]): Sentences to be embedded.
+            model (str): Model to be used for embedding.
+
+        Raises:
+            BinaryEmbeddingError: If the server fails to embed the sentences.
+
+        Returns:
+            Tuple[np.ndarray, List[int]]: The embeddings and the number of tokens of every sentence.
+        """
+        if self._writer is None:
+            raise ConnectionError("The client is not connected.")
+        if self._read_task is not None and self._read_task.done():
+            raise ConnectionError("The connection was closed.")
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        self._writer.write(encode_request(request_id, model, texts, self.api_key))
+        await self._writer.drain()
+        return await future
+
+    async def embed_stream(
+        self, batches: Iterable[List[str]], model: str, max_in_flight: int = 16
+    ) -> AsyncIterator[Tuple[np.ndarray, List[int]]]:
+        """Embed batches of sentences, keeping several requests in flight.
+
+        Args:
+            batches (Iterable[List[str]]): Batches of sentences to be embedded.
+            model (str): Model to be used for embedding.
+            max_in_flight (int): Maximum number of batches sent ahead of their results.
+
+        Yields:
+            Tuple[np.ndarray, List[int]]: The embeddings and usage of every batch, in order.
+        """
+        pending: deque = deque()
+        try:
+            for texts in batches:
+                pending.append(asyncio.ensure_future(self.embed(texts, model)))
+                if len(pending) >= max_in_flight:
+                    yield await pending.popleft()
+            while pending:
+                yield await pending.popleft()
+        finally:
+            for task in pending:
+                task.cancel()
@@ -0,0 +1,182 @@
+"""Binary embedding protocol
+
+Frames are length prefixed, every integer is little-endian.
+
+A request frame is a `uint32` length followed by a JSON object::
+
+    {"id": 1, "model": "all-MiniLM-L6-v2", "input": ["..."], "api_key": "..."}
+
+A response frame is a `uint32` header length and a `uint32` body length,
+followed by a JSON header and the body. A successful response header looks
+like ``{"id": 1, "dtype": "float32", "shape": [2, 384], "usage": [3, 5]}``
+and its body holds the embeddings as a C-contiguous array of that shape.
+Binary embeddings are packed eight dimensions per byte with `numpy.packbits`.
+A failed request gets a ``{"id": 1, "error": {...}}`` header and an empty body.
+
+Responses carry the id of their request and are sent as soon as they are
+ready, so a client can keep many requests in flight on one connection.
+"""
+
+import asyncio
+import struct
+from typing import List, Optional, Tuple
+
+import numpy as np
+import orjson
+
+from textembed.executor.primitives import EmbeddingDtype
+
+REQUEST_PREFIX = struct.Struct("<I")
+RESPONSE_PREFIX = struct.Struct("<II")
+
+# Largest request or response frame accepted, in bytes
+MAX_FRAME_BYTES = 64 * 1024 * 1024
+
+_NUMPY_DTYPES = {
+    EmbeddingDtype.FLOAT32.value: np.dtype("<f4"),
+    EmbeddingDtype.FLOAT16.value: np.dtype("<f2"),
+}
+
+
+class ProtocolError(ValueError):
+    """Raised when a peer sends a malformed frame."""
+
+
+def encode_request(
+    request_id: int, model: str, texts: List[str], api_key: Optional[str] = None
+) -> bytes:
+    """Encode an embedding request frame.
+
+    Args:
+        request_id (int): Identifier of the request, echoed in its response.
+        model (str): Model to be used for embedding.
+        texts (List[str]): Sentences to be embedded.
+        api_key (Optional[str]): API key of the server, if it requires one.
+
+    Returns:
+        bytes: The request frame.
+    """
+    request = {"id": request_id, "model": model, "input": texts}
+    if api_key is not None:
+        request["api_key"] = api_key
+    payload = orjson.dumps(request)
+    return REQUEST_PREFIX.pack(len(payload)) + payload
+
+
+async def read_request(reader: asyncio.StreamReader) -> Optional[dict]:
+    """Read the next request frame.
+
+    Args:
+        reader (asyncio.StreamReader): The connection to read from.
+
+    Raises:
+        ProtocolError: If the frame is too large or not a JSON object.
+
+    Returns:
+        Optional[dict]: The request, or None once the peer closed the connection.
+    """
+    try:
+        prefix = await reader.readexactly(REQUEST_PREFIX.size)
+    except asyncio.IncompleteReadError:
+        return None
+    (length,) = REQUEST_PREFIX.unpack(prefix)
+    if length > MAX_FRAME_BYTES:
+        raise ProtocolError(f"Request frames must not exceed {MAX_FRAME_BYTES} bytes.")
+    payload = await reader.readexactly(length)
+    try:
+        request = orjson.loads(payload)
+    except orjson.JSONDecodeError as e:
+        raise ProtocolError(f"Invalid request frame: {e}") from e
+    if not isinstance(request, dict):
+        raise ProtocolError("Request frames must hold a JSON object.")
+    return request
+
+
+def encode_embeddings(
+    request_id: int, embeddings: np.ndarray, embedding_dtype: str, usage: List[int]
+) -> bytes:
+    """Encode the dense embeddings of a request as a response frame.
+
+    Args:
+        request_id (int): Identifier of the request.
+        embeddings (np.ndarray): Embeddings of shape (inputs, dimensions).
+        embedding_dtype (str): Embedding data type of the engine.
+        usage (List[int]): Number of tokens of every input.
+
+    Returns:
+        bytes: The response frame.
+    """
+    if embedding_dtype == EmbeddingDtype.BINARY.value:
+        body = np.packbits(embeddings.astype(bool, copy=False), axis=-1).tobytes()
+    else:
+        body = np.ascontiguousarray(
+            embeddings, dtype=_NUMPY_DTYPES[embedding_dtype]
+        ).tobytes()
+    header = orjson.dumps(
+        {
+            "id": request_id,
+            "dtype": embedding_dtype,
+            "shape": list(embeddings.shape),
+            "usage": usage,
+        }
+    )
+    return RESPONSE_PREFIX.pack(len(header), len(body)) + header + body
+
+
+def encode_error(request_id: Optional[int], error: dict) -> bytes:
+    """Encode a failed request as a response frame.
+
+    Args:
+        request_id (Optional[int]): Identifier of the request, None if it could not be read.
+        error (dict): Details of the error, as returned by `EmbeddingException.json`.
+
+    Returns:
+        bytes: The response frame.
+    """
+    header = orjson.dumps({"id": request_id, "error": error})
+    return RESPONSE_PREFIX.pack(len(header), 0) + header
+
+
+async def read_response(
+    reader: asyncio.StreamReader,
+) -> Optional[Tuple[dict, bytes]]:
+    """Read the next response frame.
+
+    Args:
+        reader (asyncio.StreamReader): The connection to read from.
+
+    Raises:
+        ProtocolError: If the frame is too large.
+
+    Returns:
+        Optional[Tuple[dict, bytes]]: The header and body of the response, or
+            None once the peer closed the connection.
+    """
+    try:
+        prefix = await reader.readexactly(RESPONSE_PREFIX.size)
+    except asyncio.IncompleteReadError:
+        return None
+    header_length, body_length = RESPONSE_PREFIX.unpack(prefix)
+    if header_length + body_length > MAX_FRAME_BYTES:
+        raise ProtocolError(f"Response frames must not exceed {MAX_FRAME_BYTES} bytes.")
+    header = orjson.loads(await reader.readexactly(header_length))
+    body = await reader.readexactly(body_length)
+    return header, body
+
+
+def decode_embeddings(header: dict, body: bytes) -> np.ndarray:
+    """Decode the embeddings of a successful response.
+
+    Args:
+        header (dict): Header of the response.
+        body (bytes): Body of the response.
+
+    Returns:
+        np.ndarray: Embeddings of shape (inputs, dimensions). Binary embeddings
+            are unpacked to one `uint8` 0 or 1 per dimension.
+    """
+    shape = tuple(header["shape"])
+    if header["dtype"] == EmbeddingDtype.BINARY.value:
+        packed = np.frombuffer(body, dtype=np.uint8).reshape(shape[0], -1)
+        return np.unpackbits(packed, axis=-1, count=shape[1])
+    return np.frombuffer(body, dtype=_NUMPY_DTYPES[header["dtype"]]).reshape(shape)
@@ -0,0 +1,190 @@
+"""Binary embedding server"""
+
+import asyncio
+from typing import Dict, Optional, Set, Tuple
+
+from fastapi import status
+
+from textembed.api.embed import embed_inputs, resolve_engine
+from textembed.api.errors import EmbeddingException, ModelUnavailableException
+from textembed.binary.protocol import (
+    ProtocolError,
+    encode_embeddings,
+    encode_error,
+    read_request,
+)
+from textembed.engine.async_engine import ModelUnavailableError
+from textembed.engine.async_engine_array import AsyncEngineArray
+from textembed.log import logger
+
+
+class BinaryEmbeddingServer:
+    """Serves dense embeddings over the length-prefixed binary protocol.
+
+    Requests are queued on the same engines, and so batched together with the
+    requests of the REST API. The requests of a connection are processed
+    concurrently and their responses written as soon as they are ready, which
+    lets bulk jobs stream inputs and embeddings over a single connection.
+
+    Attributes:
+        async_engine_array (AsyncEngineArray): The engines of the served models.
+        api_key (Optional[str]): API key the requests must carry, if any.
+        max_in_flight (int): Maximum number of requests processed at once per connection.
+    """
+
+    def __init__(
+        self,
+        async_engine_array: AsyncEngineArray,
+        api_key: Optional[str] = None,
+        max_in_flight: int = 64,
+    ) -> None:
+        """Initialize the server.
+
+        Args:
+            async_engine_array (AsyncEngineArray): The engines of the served models.
+            api_key (Optional[str]): API key the requests must carry, if any.
+            max_in_flight (int): Maximum number of requests processed at once per connection.
+        """
+        self.async_engine_array = async_engine_array
+        self.api_key = api_key
+        self.max_in_flight = max_in_flight
+        self._server: Optional[asyncio.AbstractServer] = None
+        # Writer and request tasks of the open connections, by connection task
+        self._connections: Dict[
+            asyncio.Task, Tuple[asyncio.StreamWriter, Set[asyncio.Task]]
+        ] = {}
+
+    async def start(self, host: str, port: int, reuse_port: bool = False):
+        """Start accepting connections.
+
+        Args:
+            host (str): The host address to listen on.
+            port (int): The port to listen on.
+            reuse_port (bool): Whether to share the port with other processes.
+        """
+        self._server = await asyncio.start_server(
+            self._handle_connection, host=host, port=port, reuse_port=reuse_port
+        )
+        logger.info("Binary embedding protocol listening on %s:%d.", host, port)
+
+    async def stop(self):
+        """Stop accepting connections and close the open ones.
+
+        The requests still being processed are cancelled, so that none of them
+        reaches the engines once they are stopped.
+        """
+        if self._server is None:
+            return
+        self._server.close()
+        connections = list(self._connections.items())
+        for _, (writer, tasks) in connections:
+            writer.close()
+            for task in tasks:
+                task.cancel()
+        await asyncio.gather(*(task for task, _ in connections), return_exceptions=True)
+        await self._server.wait_closed()
+        self._server = None
+
+    async def _handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        in_flight = asyncio.Semaphore(self.max_in_flight)
+        tasks: Set[asyncio.Task] = set()
+        connection = asyncio.current_task()
+        if connection is not None:
+            self._connections[connection] = (writer, tasks)
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                except ProtocolError as e:
+                    writer.write(
+                        encode_error(
+                            None,
+                            EmbeddingException(
+                                str(e), status.HTTP_400_BAD_REQUEST, "InvalidFrame"
+                            ).json(),
+                        )
+                    )
+                    break
+                if request is None:
+                    break
+                # Stop reading while too many requests are pending
+                await in_flight.acquire()
+                task = asyncio.create_task(self._handle_request(request, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                task.add_done_callback(lambda _: in_flight.release())
+            if tasks:
+                # Requests are cancelled when the server stops
+                await asyncio.gather(*tasks, return_exceptions=True)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            for task in tasks:
+                task.cancel()
+        finally:
+            if connection is not None:
+                self._connections.pop(connection, None)
+            writer.close()
+
+    async def _handle_request(self, request: dict, writer: asyncio.StreamWriter):
+        request_id = request.get("id")
+        try:
+            frame = await self._embed(request)
+        except EmbeddingException as e:
+            frame = encode_error(request_id, e.json())
+        except ModelUnavailableError as e:
+            frame = encode_error(request_id, ModelUnavailableException(str(e)).json())
+        except ValueError as e:
+            frame = encode_error(
+                request_id,
+                EmbeddingException(
+                    str(e), status.HTTP_400_BAD_REQUEST, "ValueError"
+                ).json(),
+            )
+        except Exception as e:
+            logger.error("Binary embedding request failed: %s", e)
+            frame = encode_error(
+                request_id,
+                EmbeddingException(
+                    "Internal server error",
+                    status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    "InternalServerError",
+                ).json(),
+            )
+        if writer.is_closing():
+            return
+        writer.write(frame)
+        await writer.drain()
+
+    async def _embed(self, request: dict) -> bytes:
+        """Embed the inputs of a request.
+
+        Args:
+            request (dict): The decoded request frame.
+
+        Raises:
+            EmbeddingException: If the request is unauthorized or invalid.
+
+        Returns:
+            bytes: The response frame.
+        """
+        if self.api_key and request.get("api_key") != self.api_key:
+            raise EmbeddingException(
+                "Unauthorized", status.HTTP_401_UNAUTHORIZED, "Unauthorized"
+            )
+        texts = request.get("input")
+        if (
+            not isinstance(texts, list)
+            or not texts
+            or not all(isinstance(text, str) for text in texts)
+        ):
+            raise EmbeddingException(
+                "The input must be a non-empty list of strings.",
+                status.HTTP_400_BAD_REQUEST,
+                "InvalidRequest",
+            )
+        engine = resolve_engine(self.async_engine_array, str(request.get("model")))
+        embeddings, usage = await embed_inputs(engine=engine, inputs=texts)
+        return encode_embeddings(
+            request.get("id"), embeddings, engine.engine_args.embedding_dtype, usage
+        )
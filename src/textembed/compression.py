@@ -0,0 +1,231 @@
+"""Negotiated response compression"""
+
+import asyncio
+import gzip
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Optional, Tuple
+
+from textembed.tracing import Trace
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None  # type: ignore
+
+try:
+    import brotli
+except ImportError:
+    brotli = None  # type: ignore
+
+# Preferred encodings first, among the ones a client accepts equally
+ENCODINGS = ("zstd", "br", "gzip")
+DEFAULT_LEVELS = {"zstd": 3, "br": 4, "gzip": 6}
+LEVEL_RANGES = {"zstd": (1, 22), "br": (0, 11), "gzip": (0, 9)}
+
+# Paths of the responses holding embeddings
+EMBEDDING_PATHS = ("/v1/embedding", "/v1/image_embedding", "/v1/image_embedding/upload")
+
+
+def available_encodings() -> Tuple[str, ...]:
+    """Get the encodings whose compression library is installed.
+
+    Returns:
+        Tuple[str, ...]: The available encodings, preferred first.
+    """
+    installed = {"zstd": zstandard is not None, "br": brotli is not None, "gzip": True}
+    return tuple(encoding for encoding in ENCODINGS if installed[encoding])
+
+
+def _compressor(encoding: str, level: int) -> Callable[[bytes], bytes]:
+    """Get the function compressing a body with an encoding at a level."""
+    if encoding == "zstd":
+        # Compressors are not thread-safe, every response gets its own
+        return lambda body: zstandard.ZstdCompressor(level=level).compress(body)
+    if encoding == "br":
+        return lambda body: brotli.compress(body, quality=level)
+    return lambda body: gzip.compress(body, compresslevel=level, mtime=0)
+
+
+@dataclass
+class CompressionConfig:
+    """Compression of the embedding responses.
+
+    Attributes:
+        levels (Dict[str, Optional[int]]): Compression level of every enabled encoding,
+            the default level of the encoding when None.
+        min_bytes (int): Minimum size of a response body to compress, in bytes.
+    """
+
+    levels: Dict[str, Optional[int]] = field(default_factory=lambda: {"gzip": None})
+    min_bytes: int = 1024
+
+    def __post_init__(self):
+        if not self.levels:
+            raise ValueError("At least one compression encoding must be enabled.")
+        for encoding, level in self.levels.items():
+            if encoding not in ENCODINGS:
+                raise ValueError(
+                    f"Unsupported compression encoding: '{encoding}'. "
+                    f"Choose from {list(ENCODINGS)}."
+                )
+            if encoding not in available_encodings():
+                package = "zstandard" if encoding == "zstd" else "brotli"
+                raise ValueError(
+                    f"The '{encoding}' compression requires the {package} package."
+                )
+            low, high = LEVEL_RANGES[encoding]
+            if level is not None and not low <= level <= high:
+                raise ValueError(
+                    f"The '{encoding}' compression level must be between {low} and {high}."
+                )
+        if self.min_bytes < 0:
+            raise ValueError(
+                "Compression min bytes must be greater than or equal to 0."
+            )
+
+    @classmethod
+    def from_spec(cls, spec: str, min_bytes: int = 1024) -> "CompressionConfig":
+        """Parse comma-separated encodings with optional levels, e.g. 'zstd:3,gzip'.
+
+        Args:
+            spec (str): The encodings.
+            min_bytes (int): Minimum size of a response body to compress, in bytes.
+
+        Returns:
+            CompressionConfig: The configuration.
+        """
+        levels: Dict[str, Optional[int]] = {}
+        for item in spec.split(","):
+            encoding, _, level = item.strip().partition(":")
+            if encoding:
+                levels[encoding] = int(level) if level else None
+        return cls(levels=levels, min_bytes=min_bytes)
+
+
+def negotiate(accept_encoding: str, encodings) -> Optional[str]:
+    """Choose the encoding of a response from the `Accept-Encoding` header of a request.
+
+    The encoding with the highest quality value wins, the preferred one of
+    `ENCODINGS` among equal ones. `*` stands for the encodings not listed.
+
+    Args:
+        accept_encoding (str): The `Accept-Encoding` header.
+        encodings: The enabled encodings.
+
+    Returns:
+        Optional[str]: The chosen encoding, None to send the response uncompressed.
+    """
+    qualities: Dict[str, float] = {}
+    for item in accept_encoding.lower().split(","):
+        name, *params = (part.strip() for part in item.split(";"))
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if name:
+            qualities[name] = quality
+    wildcard = qualities.get("*", 0.0)
+    best, best_quality = None, 0.0
+    for encoding in ENCODINGS:
+        if encoding not in encodings:
+            continue
+        quality = qualities.get(encoding, wildcard)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+class CompressionMiddleware:
+    """ASGI middleware compressing the embedding responses.
+
+    The encoding is negotiated with the `Accept-Encoding` header of the
+    request. Bodies of at least `min_bytes` are compressed in a worker thread,
+    so that large responses do not hold up the event loop and the other
+    requests. Traced requests get a compression span.
+    """
+
+    def __init__(
+        self, app, config: CompressionConfig, paths: Tuple[str, ...] = EMBEDDING_PATHS
+    ) -> None:
+        """Wrap an ASGI application.
+
+        Args:
+            app: The ASGI application.
+            config (CompressionConfig): The compression configuration.
+            paths (Tuple[str, ...]): Paths of the compressed responses.
+        """
+        self.app = app
+        self.config = config
+        self.paths = paths
+        self._compressors = {
+            encoding: _compressor(
+                encoding, DEFAULT_LEVELS[encoding] if level is None else level
+            )
+            for encoding, level in config.levels.items()
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope["headers"])
+        encoding = negotiate(
+            headers.get(b"accept-encoding", b"").decode("latin-1"), self._compressors
+        )
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message: dict = {}
+        chunks = []
+
+        async def send_compressed(message):
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+            chunks.append(message.get("body", b""))
+            if message.get("more_body", False):
+                return
+            await self._send(scope, send, start_message, b"".join(chunks), encoding)
+
+        await self.app(scope, receive, send_compressed)
+
+    async def _send(
+        self, scope, send, start_message: dict, body: bytes, encoding: str
+    ) -> None:
+        """Send a buffered response, compressed if it is large enough."""
+        headers = [
+            (name, value)
+            for name, value in start_message.get("headers", [])
+            if name.lower() != b"content-length"
+        ]
+        headers.append((b"vary", b"Accept-Encoding"))
+        already_encoded = any(
+            name.lower() == b"content-encoding" for name, _ in headers
+        )
+        if len(body) >= self.config.min_bytes and not already_encoded:
+            trace: Optional[Trace] = scope.get("state", {}).get("trace")
+            start = time.perf_counter()
+            if trace is not None:
+                # The serialization ends where the compression starts
+                for span in trace.spans[1:]:
+                    if span.end is None:
+                        span.finish(start)
+            body = await asyncio.to_thread(self._compressors[encoding], body)
+            if trace is not None:
+                trace.add_span(
+                    "compression", start, time.perf_counter(), encoding=encoding
+                )
+            headers.append((b"content-encoding", encoding.encode()))
+        headers.append((b"content-length", str(len(body)).encode()))
+        await send({**start_message, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
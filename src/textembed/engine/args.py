@@ -2,9 +2,20 @@
 
 import multiprocessing
 from dataclasses import dataclass
-from typing import Optional, Union
+from typing import Dict, Optional, Tuple, Union
 
-from textembed.executor.primitives import EmbeddingDtype
+from textembed.executor.primitives import EmbeddingDtype, IndexMode
+
+COMPILE_MODES = ["compile", "trace"]
+
+POOLING_MODES = [
+    "mean",
+    "max",
+    "cls",
+    "weightedmean",
+    "lasttoken",
+    "mean_sqrt_len_tokens",
+]
 
 
 @dataclass
@@ -19,7 +30,42 @@ class AsyncEngineArgs:
         workers (int): The number of worker tasks to process requests. Defaults to the number of CPU cores.
         batch_size (int): The maximum number of requests to process in a single batch.
                           Must be greater than or equal to 1.
+        max_batch_tokens (Optional[int]): The maximum estimated number of tokens of a text batch.
+                                          Unlimited when None.
+        image_batch_size (int): The maximum number of images of an image batch.
         embedding_dtype(str): Embedding data type for final generate embedding.
+        pooling_mode (Optional[str]): Pooling mode overriding the one of the model,
+                                      e.g. `mean`, `cls`, `max` or `lasttoken`.
+        index_mode (Optional[str]): Search mode of the in-memory vector indexes, `flat` or `ivf`.
+                                    Indexes are disabled when None.
+        index_dir (Optional[str]): Directory where index snapshots are loaded from and saved to.
+        sparse_top_k (int): Maximum number of non-zero weights kept per sparse embedding.
+                            Keeps every non-zero weight when 0.
+        lazy_load (bool): Whether to load the model on its first request instead of at startup.
+        idle_ttl (Optional[float]): Seconds without requests after which the model is unloaded.
+                                    The model stays loaded when None.
+        max_image_bytes (int): Maximum size of an input image file, in bytes.
+        max_image_pixels (int): Maximum number of pixels of an input image.
+        compile_mode (Optional[str]): Run the transformer through graphs compiled per input
+                                      shape bucket, with `torch.compile` (`compile`) or
+                                      TorchScript tracing (`trace`). Eager when None.
+        compile_batch_buckets (Optional[Tuple[int, ...]]): Batch sizes the inputs are padded to
+                                                           in compiled mode. Defaults to powers of
+                                                           two up to `batch_size`.
+        compile_seq_buckets (Optional[Tuple[int, ...]]): Sequence lengths the inputs are padded to
+                                                         in compiled mode. Defaults to powers of
+                                                         two from 16 up to the model maximum.
+        sequence_packing (bool): Whether to run BERT-family transformers on the sequences of a
+                                 batch packed together without padding.
+        prompts (Optional[Dict[str, str]]): Named prompts prefixed to the inputs of the requests
+                                            selecting them, added to the prompts of the model.
+        autotune (bool): Whether to choose `batch_size` and, unless set, `max_batch_tokens`
+                         from measurements of the model at startup.
+        autotune_slo_ms (float): The maximum duration of a batch targeted by autotuning,
+                                 in milliseconds.
+        autotune_profile (Optional[str]): File the autotuning measurements are saved to and
+                                          reused from. Defaults to
+                                          `~/.cache/textembed/autotune.json`.
     """
 
     model: str
@@ -27,7 +73,25 @@ class AsyncEngineArgs:
     trust_remote_code: bool = True
     workers: int = multiprocessing.cpu_count()
     batch_size: int = 32
+    max_batch_tokens: Optional[int] = None
+    image_batch_size: int = 16
     embedding_dtype: str = "float32"
+    pooling_mode: Optional[str] = None
+    index_mode: Optional[str] = None
+    index_dir: Optional[str] = None
+    sparse_top_k: int = 256
+    lazy_load: bool = False
+    idle_ttl: Optional[float] = None
+    max_image_bytes: int = 20 * 1024 * 1024
+    max_image_pixels: int = 64 * 1024 * 1024
+    compile_mode: Optional[str] = None
+    compile_batch_buckets: Optional[Tuple[int, ...]] = None
+    compile_seq_buckets: Optional[Tuple[int, ...]] = None
+    sequence_packing: bool = False
+    prompts: Optional[Dict[str, str]] = None
+    autotune: bool = False
+    autotune_slo_ms: float = 100.0
+    autotune_profile: Optional[str] = None
 
     def __post_init__(self):
         # If served_model_name is not provided, derive it from the model path
@@ -37,13 +101,61 @@ class AsyncEngineArgs:
         # Ensure the batch size is valid
         if self.batch_size < 1:
             raise ValueError("Batch size must be greater than or equal to 1.")
+        if self.max_batch_tokens is not None and self.max_batch_tokens < 1:
+            raise ValueError("Max batch tokens must be greater than or equal to 1.")
+        if self.image_batch_size < 1:
+            raise ValueError("Image batch size must be greater than or equal to 1.")
 
         # Ensure the number of workers is valid
         if self.workers < 1:
             raise ValueError("Number of workers must be greater than or equal to 1.")
 
+        if self.autotune_slo_ms <= 0:
+            raise ValueError("Autotune latency SLO must be greater than 0 ms.")
+
+        # Ensure the idle TTL is valid
+        if self.idle_ttl is not None and self.idle_ttl <= 0:
+            raise ValueError("Idle TTL must be greater than 0 seconds.")
+
+        # Ensure the sparse top-k is valid
+        if self.sparse_top_k < 0:
+            raise ValueError("Sparse top-k must be greater than or equal to 0.")
+
+        # Ensure the image limits are valid
+        if self.max_image_bytes < 1 or self.max_image_pixels < 1:
+            raise ValueError("Image limits must be greater than or equal to 1.")
+
         if self.embedding_dtype not in [dtype.value for dtype in EmbeddingDtype]:
             raise ValueError(
                 f"Unsupported embedding dtype: '{self.embedding_dtype}'. "
                 f"Valid dtype are: {[dtype.value for dtype in EmbeddingDtype]}."
             )
+
+        if self.compile_mode is not None and self.compile_mode not in COMPILE_MODES:
+            raise ValueError(
+                f"Unsupported compile mode: '{self.compile_mode}'. "
+                f"Valid modes are: {COMPILE_MODES}."
+            )
+        if self.compile_mode is not None and self.sequence_packing:
+            raise ValueError("Sequence packing cannot be combined with a compile mode.")
+        for buckets in (self.compile_batch_buckets, self.compile_seq_buckets):
+            if buckets is not None and (
+                not buckets or any(bucket < 1 for bucket in buckets)
+            ):
+                raise ValueError(
+                    "Compile buckets must be a non-empty list of sizes greater than or equal to 1."
+                )
+
+        if self.pooling_mode is not None and self.pooling_mode not in POOLING_MODES:
+            raise ValueError(
+                f"Unsupported pooling mode: '{self.pooling_mode}'. "
+                f"Valid modes are: {POOLING_MODES}."
+            )
+
+        if self.index_mode is not None and self.index_mode not in [
+            mode.value for mode in IndexMode
+        ]:
+            raise ValueError(
+                f"Unsupported index mode: '{self.index_mode}'. "
+                f"Valid modes are: {[mode.value for mode in IndexMode]}."
+            )
@@ -1,11 +1,69 @@
 """Asynchronous engine creation."""
 
-from typing import List
+import asyncio
+import functools
+import gc
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple, Union
 
-from textembed.batch import BatchProcessor
+from textembed.batch import BatchScheduler
 from textembed.engine.args import AsyncEngineArgs
-from textembed.executor.embedder.sentence_transformer import SentenceTransformerEmbedder
+from textembed.engine.model_pool import checkpoint_bytes
+from textembed.executor.images import PreprocessedImage, decode_image
+from textembed.executor.primitives import EngineState, OutputMode
+from textembed.index import VectorIndex
 from textembed.log import logger
+from textembed.metrics import MODEL_LOADS, MODEL_RESIDENT_BYTES
+from textembed.tracing import Trace
+
+# The model is imported with torch when it is loaded, not with the engine
+if TYPE_CHECKING:
+    from textembed.batch import BatchProcessor
+    from textembed.engine.autotune import BatchLimits
+    from textembed.engine.model_pool import ModelPool
+    from textembed.executor.embedder.sentence_transformer import (
+        SentenceTransformerEmbedder,
+    )
+
+# Models loaded ahead of the engines, by served model name
+_PRELOADED_MODELS: Dict[str, "SentenceTransformerEmbedder"] = {}
+
+# Delay before loading a model again after a failure, doubled on every failure
+_LOAD_RETRY_MIN_SECONDS = 1.0
+_LOAD_RETRY_MAX_SECONDS = 60.0
+
+
+class ModelUnavailableError(RuntimeError):
+    """Raised for requests to a model whose last load failed, until it is retried.
+
+    Attributes:
+        retry_after (float): Seconds until the model is loaded again.
+    """
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def preload_model(engine_args: AsyncEngineArgs):
+    """Load a model before its engine starts, to be picked up by the engine.
+
+    Used to load the models once in a parent process before forking the server
+    processes, which then share the weights copy-on-write. The model is only
+    loaded here; running it, including the warm-up, is left to the engine.
+
+    Args:
+        engine_args (AsyncEngineArgs): Arguments of the engine serving the model.
+    """
+    from textembed.executor.embedder.sentence_transformer import (
+        SentenceTransformerEmbedder,
+    )
+
+    _PRELOADED_MODELS[engine_args.served_model_name] = SentenceTransformerEmbedder(  # type: ignore
+        engine_args=engine_args
+    )
 
 
 class AsyncEngine:
@@ -14,11 +72,35 @@ class AsyncEngine:
     This class provides functionality to asynchronously handle and process
     text data using an underlying engine defined by `AsyncEngineArgs`.
 
+    The model is loaded in a background thread, either when the engine starts or,
+    with `lazy_load`, on its first request. With `idle_ttl`, a model without
+    requests for that long is unloaded and loaded again on the next request.
+    An engine registered in a `ModelPool` may also be unloaded to make room
+    for other models. A model that fails to load is not loaded again by every
+    request: requests fail fast until a retry delay, doubled on every failure,
+    has passed, or until the load is retried explicitly with `reload`.
+    Engines of an `AsyncEngineArray` whose models share a
+    backbone also share a batch processor, so their requests are batched
+    together. Engines given a
+    shared `BatchScheduler` share its compute budget. With `autotune`, the
+    batch limits are measured once the model is warmed up, or read from the
+    profile of an earlier start. torch and the model libraries are only
+    imported when the first model loads.
+
     Attributes:
         engine_args (AsyncEngineArgs): Arguments required to initialize the engine.
         running (bool): Flag indicating if the engine is currently running.
+        state (EngineState): Load state of the model.
         batch_processor (BatchProcessor): Processor for handling batch requests.
         model (SentenceTransformerEmbedder): Model for generating embeddings.
+        indexes (Dict[str, VectorIndex]): In-memory vector indexes of the engine, by name.
+        pool (Optional[ModelPool]): Pool keeping the loaded models within a memory budget.
+        scheduler (Optional[BatchScheduler]): Scheduler running the batches of the engine and
+            of other engines. The batch processor gets its own when None.
+        shared_batch_processors (Dict[int, Tuple[BatchProcessor, int]]): Batch processors
+            and their number of engines, by model backbone, shared by the engines of
+            an `AsyncEngineArray`.
+        resident_bytes (int): Size of the model when it was last loaded, in bytes.
     """
 
     def __init__(self, engine_args: AsyncEngineArgs) -> None:
@@ -30,8 +112,22 @@ class AsyncEngine:
         """
         self._engine_args = engine_args
         self.running = False
+        self.state = EngineState.UNLOADED
         self.batch_processor = None
         self.model = None
+        self.indexes: Dict[str, VectorIndex] = {}
+        self.pool: Optional["ModelPool"] = None
+        self.scheduler: Optional[BatchScheduler] = None
+        self.shared_batch_processors: Dict[int, Tuple["BatchProcessor", int]] = {}
+        self.resident_bytes = 0
+        self._load_lock = asyncio.Lock()
+        self._last_used = time.monotonic()
+        self._idle_task: Optional[asyncio.Task] = None
+        self._image_executor: Optional[ThreadPoolExecutor] = None
+        self._batch_limits: Optional["BatchLimits"] = None
+        self._load_failures = 0
+        self._retry_at = 0.0
+        self._sparse_head_recorded = False
 
     @classmethod
     def from_args(cls, engine_args: AsyncEngineArgs) -> "AsyncEngine":
@@ -48,25 +144,254 @@ class AsyncEngine:
     async def start(self):
         """Start the engine.
 
-        This method initializes the model and batch processor, and sets the
-        running flag to True, indicating that the engine is active and ready
-        to process requests.
+        This method sets the running flag to True, indicating that the engine
+        is active and accepts requests, and then loads the model unless
+        `lazy_load` is set. Requests received while the model is loading wait
+        for it instead of failing.
         """
         if self.running:
             logger.warning("The engine is already running.")
             return
 
-        self.model = SentenceTransformerEmbedder(engine_args=self._engine_args)
-        self.batch_processor = BatchProcessor(
-            model=self.model,
-            workers=self._engine_args.workers,
-            batch_size=self._engine_args.batch_size,
-        )
         self.running = True
+        self._load_indexes()
+        if self._engine_args.idle_ttl is not None:
+            self._idle_task = asyncio.get_running_loop().create_task(
+                self._unload_when_idle()
+            )
         logger.info("Engine started for the %s model.", self._engine_args.model)
 
-        # Warm-up the model
-        await self.model.warm_up()
+        if not self._engine_args.lazy_load:
+            await self.load()
+
+    async def load(self):
+        """Load and warm up the model if it is not loaded yet.
+
+        The model weights are loaded in a worker thread so several engines can
+        load concurrently without blocking the event loop.
+
+        Raises:
+            ModelUnavailableError: If the last load failed and is not retried yet.
+            Exception: Any error raised while loading the model.
+        """
+        if self.state == EngineState.READY:
+            return
+        self.check_available()
+        async with self._load_lock:
+            if self.state == EngineState.READY:
+                return
+            # The load may have failed while waiting for the lock
+            self.check_available()
+            self.state = EngineState.LOADING
+            if self.pool is not None:
+                # Before the first load, the checkpoint stands in for the model size
+                required = self.resident_bytes or await asyncio.to_thread(
+                    checkpoint_bytes, self._engine_args.model
+                )
+                await self.pool.make_room(self, required)
+
+            from textembed.engine.autotune import autotune
+            from textembed.executor.embedder.sentence_transformer import (
+                SentenceTransformerEmbedder,
+            )
+
+            start_time = time.perf_counter()
+            try:
+                model = _PRELOADED_MODELS.pop(
+                    self._engine_args.served_model_name, None  # type: ignore
+                ) or await asyncio.to_thread(
+                    SentenceTransformerEmbedder, engine_args=self._engine_args
+                )
+                # Warm-up the model
+                await model.warm_up()
+                if self._engine_args.autotune and self._batch_limits is None:
+                    self._batch_limits = await autotune(model, self._engine_args)
+                if self._batch_limits is not None:
+                    await model.fit_batch_size(self._batch_limits.batch_size)
+            except Exception:
+                self.state = EngineState.FAILED
+                self._load_failures += 1
+                retry_delay = min(
+                    _LOAD_RETRY_MIN_SECONDS * 2 ** (self._load_failures - 1),
+                    _LOAD_RETRY_MAX_SECONDS,
+                )
+                self._retry_at = time.monotonic() + retry_delay
+                logger.exception(
+                    "Failed to load the %s model, retrying in %.0f s.",
+                    self._engine_args.model,
+                    retry_delay,
+                )
+                raise
+
+            self.model = model
+            self.batch_processor = self._attach_batch_processor(model)
+            self._load_failures = 0
+            self._sparse_head_recorded = False
+            self._last_used = time.monotonic()
+            self.state = EngineState.READY
+            MODEL_LOADS.labels(model=self._engine_args.served_model_name).inc()
+            self._record_resident_bytes()
+            logger.info(
+                "Model %s loaded in %.4f s.",
+                self._engine_args.model,
+                time.perf_counter() - start_time,
+            )
+
+        if self.pool is not None:
+            await self.pool.make_room(self)
+
+    def _record_resident_bytes(self):
+        """Record the size of the loaded model, for the pool and the metrics."""
+        self.resident_bytes = self.model.resident_bytes  # type: ignore
+        MODEL_RESIDENT_BYTES.labels(model=self._engine_args.served_model_name).set(
+            self.resident_bytes
+        )
+
+    async def supports_output_mode(self, output_mode: str) -> bool:
+        """Check whether the model can produce an output mode, loading the model first.
+
+        The MLM head of sparse outputs is loaded on the first request for them,
+        the size of the model is then recorded again and the pool makes room
+        for the head.
+
+        Args:
+            output_mode (str): Output mode of the embeddings.
+
+        Returns:
+            bool: True if the output mode is supported.
+        """
+        await self.load()
+        supported = await self.model.supports_output_mode(output_mode)  # type: ignore
+        if (
+            supported
+            and output_mode == OutputMode.SPARSE.value
+            and not self._sparse_head_recorded
+        ):
+            self._sparse_head_recorded = True
+            self._record_resident_bytes()
+            if self.pool is not None:
+                await self.pool.make_room(self)
+        return supported
+
+    async def reload(self):
+        """Load a model whose last load failed without waiting for the retry delay.
+
+        Raises:
+            Exception: Any error raised while loading the model.
+        """
+        self._retry_at = 0.0
+        await self.load()
+
+    def check_available(self):
+        """Check that the model is not waiting to be loaded again after a failure.
+
+        Raises:
+            ModelUnavailableError: If the last load failed and is not retried yet.
+        """
+        if self.state != EngineState.FAILED:
+            return
+        retry_after = self._retry_at - time.monotonic()
+        if retry_after > 0:
+            raise ModelUnavailableError(
+                f"The {self._engine_args.model} model failed to load, "
+                f"it is loaded again in {retry_after:.0f} s.",
+                retry_after=retry_after,
+            )
+
+    async def unload(self):
+        """Release the model once its queued requests are processed.
+
+        Requests received while the model is unloading wait and load it again.
+        """
+        async with self._load_lock:
+            if self.state != EngineState.READY:
+                return
+            self.state = EngineState.UNLOADING
+            await self._detach_batch_processor()
+            self.batch_processor = None
+            self.model = None
+            gc.collect()
+            self.state = EngineState.UNLOADED
+            MODEL_RESIDENT_BYTES.labels(model=self._engine_args.served_model_name).set(
+                0
+            )
+            logger.info("Model %s unloaded.", self._engine_args.model)
+
+    def _attach_batch_processor(
+        self, model: "SentenceTransformerEmbedder"
+    ) -> "BatchProcessor":
+        """Get the batch processor of the model backbone, creating it if needed.
+
+        Args:
+            model (SentenceTransformerEmbedder): The loaded model.
+
+        Returns:
+            BatchProcessor: The batch processor for the model.
+        """
+        from textembed.batch import BatchProcessor
+
+        key = id(model.backbone)
+        if key in self.shared_batch_processors:
+            batch_processor, engines = self.shared_batch_processors[key]
+            logger.info(
+                "The %s model shares its backbone and batches with the %s model.",
+                self._engine_args.model,
+                batch_processor.model.engine_args.model,
+            )
+        else:
+            batch_size = self._engine_args.batch_size
+            max_batch_tokens = self._engine_args.max_batch_tokens
+            if self._batch_limits is not None:
+                batch_size = self._batch_limits.batch_size
+                # An explicit token limit takes precedence
+                if max_batch_tokens is None:
+                    max_batch_tokens = self._batch_limits.max_batch_tokens
+            batch_processor, engines = (
+                BatchProcessor(
+                    model=model,
+                    workers=self._engine_args.workers,
+                    batch_size=batch_size,
+                    max_batch_tokens=max_batch_tokens,
+                    image_batch_size=self._engine_args.image_batch_size,
+                    scheduler=self.scheduler,
+                ),
+                0,
+            )
+        self.shared_batch_processors[key] = (batch_processor, engines + 1)
+        return batch_processor
+
+    async def _detach_batch_processor(self):
+        """Wait for the requests of the model, then release its batch processor.
+
+        The batch processor is shut down once no engine uses it anymore.
+        """
+        if self.batch_processor is None or self.model is None:
+            return
+        await self.batch_processor.drain(self.model)
+        key = id(self.model.backbone)
+        batch_processor, engines = self.shared_batch_processors.pop(key)
+        if engines > 1:
+            self.shared_batch_processors[key] = (batch_processor, engines - 1)
+        else:
+            await batch_processor.shutdown()
+
+    @property
+    def last_used(self) -> float:
+        """Monotonic time of the last request received by the engine."""
+        return self._last_used
+
+    async def _unload_when_idle(self):
+        """Unload the model once it has not been used for `idle_ttl` seconds."""
+        idle_ttl: float = self._engine_args.idle_ttl  # type: ignore
+        while True:
+            await asyncio.sleep(min(idle_ttl, 1.0))
+            if (
+                self.state == EngineState.READY
+                and self.batch_processor is not None
+                and self.batch_processor.pending_for(self.model) == 0  # type: ignore
+                and time.monotonic() - self._last_used >= idle_ttl
+            ):
+                await self.unload()
 
     async def stop(self):
         """Stop the engine.
@@ -79,8 +404,15 @@ class AsyncEngine:
         """
         self._check_running()
         self.running = False
-        if self.batch_processor is not None:
-            await self.batch_processor.shutdown()
+        if self._idle_task is not None:
+            self._idle_task.cancel()
+            self._idle_task = None
+        await self.unload()
+        if self._image_executor is not None:
+            self._image_executor.shutdown(wait=False, cancel_futures=True)
+            self._image_executor = None
+        for name in self.indexes:
+            self.save_index(name)
         logger.info("Engine stopped for the %s model.", self._engine_args.model)
 
     def _check_running(self):
@@ -107,7 +439,13 @@ class AsyncEngine:
         """
         return self._engine_args
 
-    async def aembed(self, sentences: List[str], future):
+    async def aembed(
+        self,
+        sentences: List[str],
+        future,
+        output_mode: str = OutputMode.DENSE.value,
+        trace: Optional[Trace] = None,
+    ):
         """Asynchronously embed a list of sentences.
 
         This method processes the input sentences using the underlying engine.
@@ -116,11 +454,155 @@ class AsyncEngine:
         Args:
             sentences (List[str]): List of sentences to be embedded.
             future (asyncio.Future): A future object to set the result of embeddings.
+            output_mode (str): Output mode of the embeddings.
+            trace (Optional[Trace]): Trace of the request, if it is traced.
 
         Raises:
             ValueError: If the engine is not running when this method is called.
         """
         self._check_running()
+        await self.load()
         if self.batch_processor is None:
             raise ValueError("Batch processor is not initialized.")
-        await self.batch_processor.add_request(sentences, future)
+        self._last_used = time.monotonic()
+        await self.batch_processor.add_request(
+            sentences, future, output_mode, self.model, trace
+        )
+
+    async def adecode_images(
+        self, images: List[Union[str, bytes]]
+    ) -> List[PreprocessedImage]:
+        """Decode images into model inputs in a pool of worker threads.
+
+        Images are decoded concurrently, off the event loop, so that large
+        images do not stall other requests. The pool has one thread per
+        worker of the engine.
+
+        Args:
+            images (List[Union[str, bytes]]): Base64 encoded or raw image files.
+
+        Raises:
+            ValueError: If the model does not accept images or an image is invalid.
+            ImageTooLargeError: If an image exceeds the configured limits.
+
+        Returns:
+            List[PreprocessedImage]: The decoded images.
+        """
+        self._check_running()
+        await self.load()
+        image_processor = self.model.image_processor  # type: ignore
+        if image_processor is None:
+            raise ValueError(
+                f"The {self._engine_args.model} model does not accept images."
+            )
+        if self._image_executor is None:
+            self._image_executor = ThreadPoolExecutor(
+                max_workers=self._engine_args.workers,
+                thread_name_prefix="textembed-image",
+            )
+        loop = asyncio.get_running_loop()
+        decode = functools.partial(
+            decode_image,
+            image_processor=image_processor,
+            max_bytes=self._engine_args.max_image_bytes,
+            max_pixels=self._engine_args.max_image_pixels,
+        )
+        return await asyncio.gather(
+            *(
+                loop.run_in_executor(self._image_executor, decode, image)
+                for image in images
+            )
+        )
+
+    @property
+    def index_enabled(self) -> bool:
+        """Whether the in-memory vector indexes are enabled for this engine."""
+        return self._engine_args.index_mode is not None
+
+    def _index_path(self, name: str) -> Optional[str]:
+        """Get the snapshot directory of an index, if snapshots are configured.
+
+        Args:
+            name (str): Name of the index.
+
+        Returns:
+            Optional[str]: The snapshot directory or None.
+        """
+        if self._engine_args.index_dir is None:
+            return None
+        served_model_name = str(self._engine_args.served_model_name)
+        return os.path.join(
+            self._engine_args.index_dir,
+            served_model_name.strip("/").replace("/", "--"),
+            name,
+        )
+
+    def _load_indexes(self):
+        """Load the index snapshots of this engine from `index_dir`.
+
+        A snapshot that cannot be read is logged and skipped, so that it does
+        not keep the engine from starting.
+        """
+        if not self.index_enabled:
+            return
+        root = self._index_path("")
+        if root is None or not os.path.isdir(root):
+            return
+        for name in VectorIndex.snapshot_names(root):
+            try:
+                self.indexes[name] = VectorIndex.load(
+                    os.path.join(root, name),
+                    embedding_dtype=self._engine_args.embedding_dtype,
+                )
+            except Exception:
+                logger.exception(
+                    "Failed to load the index %s of the %s model, skipping it.",
+                    name,
+                    self._engine_args.model,
+                )
+                continue
+            logger.info(
+                "Loaded index %s with %d vectors for the %s model.",
+                name,
+                len(self.indexes[name]),
+                self._engine_args.model,
+            )
+
+    def get_index(self, name: str, create: bool = False) -> Optional[VectorIndex]:
+        """Get an in-memory vector index by name.
+
+        Args:
+            name (str): Name of the index.
+            create (bool): Whether to create the index if it does not exist.
+
+        Raises:
+            ValueError: If indexes are disabled for this engine.
+
+        Returns:
+            Optional[VectorIndex]: The index, or None if it does not exist.
+        """
+        if not self.index_enabled:
+            raise ValueError(
+                f"Indexes are not enabled for the {self._engine_args.model} model."
+            )
+        if name not in self.indexes and create:
+            self.indexes[name] = VectorIndex(
+                embedding_dtype=self._engine_args.embedding_dtype,
+                mode=self._engine_args.index_mode,  # type: ignore
+            )
+        return self.indexes.get(name)
+
+    def save_index(self, name: str) -> Optional[str]:
+        """Write a snapshot of an index to `index_dir`.
+
+        Args:
+            name (str): Name of the index.
+
+        Returns:
+            Optional[str]: The snapshot directory, or None if snapshots are not configured.
+        """
+        path = self._index_path(name)
+        if path is not None:
+            self.indexes[name].save(path)
+            logger.info("Saved index %s to %s.", name, path)
+        return path
@@ -1,15 +1,37 @@
 """Async engine array."""
 
-from typing import Iterable, Iterator, List, Union
+import asyncio
+import dataclasses
+from typing import Iterable, Iterator, List, Optional, Union
+
+from textembed.batch import BatchScheduler
+from textembed.log import logger
 
 from .args import AsyncEngineArgs
 from .async_engine import AsyncEngine
+from .model_pool import ModelPool
 
 
 class AsyncEngineArray:
-    """AsyncEngineArray is a collection of AsyncEngine objects."""
-
-    def __init__(self, engines: Iterable["AsyncEngine"]):
+    """AsyncEngineArray is a collection of AsyncEngine objects.
+
+    With a memory budget, the engines share a `ModelPool` that loads models on
+    their first request and unloads the least recently used ones to stay within
+    the budget.
+
+    The engines share a `BatchScheduler`, which runs at most
+    `max_concurrent_batches` batches at once across every model and chooses
+    the next one from the age and cost of the queued requests. Engines whose
+    models share a backbone share a batch processor of the array, bound to
+    its scheduler and event loop.
+    """
+
+    def __init__(
+        self,
+        engines: Iterable["AsyncEngine"],
+        memory_budget: Optional[int] = None,
+        max_concurrent_batches: Optional[int] = None,
+    ):
         if not engines:
             raise ValueError("Engines collection cannot be empty.")
         unique_model_names = set(
@@ -20,21 +42,52 @@ class AsyncEngineArray:
         self.engines_dict = {
             engine.engine_args.served_model_name: engine for engine in engines
         }
+        self.pool = None if memory_budget is None else ModelPool(memory_budget)
+        if self.pool is not None:
+            for engine in engines:
+                self.pool.register(engine)
+        if max_concurrent_batches is None:
+            max_concurrent_batches = max(
+                engine.engine_args.workers for engine in engines
+            )
+        self.scheduler = BatchScheduler(max_concurrent_batches)
+        shared_batch_processors: dict = {}
+        for engine in engines:
+            engine.scheduler = self.scheduler
+            engine.shared_batch_processors = shared_batch_processors
 
     @classmethod
     def from_args(
-        cls, engine_args_list: Iterable[AsyncEngineArgs]
+        cls,
+        engine_args_list: Iterable[AsyncEngineArgs],
+        memory_budget: Optional[int] = None,
+        max_concurrent_batches: Optional[int] = None,
     ) -> "AsyncEngineArray":
         """Create an AsyncEngineArray from a list of AsyncEngineArgs.
 
         Args:
             engine_args_list (Iterable[AsyncEngineArgs]): List of AsyncEngineArgs objects.
+            memory_budget (Optional[int]): Maximum resident size of the loaded models, in bytes.
+                                           Every model stays loaded when None.
+            max_concurrent_batches (Optional[int]): Maximum number of batches running at once
+                                                    across the models. Defaults to the largest
+                                                    number of workers of the engines.
 
         Returns:
             AsyncEngineArray: An instance of the AsyncEngineArray class.
         """
+        if memory_budget is not None:
+            # Pooled models are only loaded when a request needs them
+            engine_args_list = [
+                dataclasses.replace(engine_args, lazy_load=True)
+                for engine_args in engine_args_list
+            ]
         engines = map(AsyncEngine.from_args, engine_args_list)
-        return cls(engines=tuple(engines))
+        return cls(
+            engines=tuple(engines),
+            memory_budget=memory_budget,
+            max_concurrent_batches=max_concurrent_batches,
+        )
 
     @property
     def engine_args(self) -> List[AsyncEngineArgs]:
@@ -49,14 +102,30 @@ class AsyncEngineArray:
         return iter(self.engines_dict.values())
 
     async def start_all(self):
-        """Start up all engines asynchronously."""
-        for engine in self.engines_dict.values():
-            await engine.start()
+        """Start up all engines concurrently.
+
+        A model that fails to load is reported in its engine state and does not
+        prevent the other engines from starting. The error of every engine that
+        fails to start is logged.
+        """
+        engines = list(self.engines_dict.values())
+        results = await asyncio.gather(
+            *(engine.start() for engine in engines),
+            return_exceptions=True,
+        )
+        for engine, result in zip(engines, results):
+            if isinstance(result, BaseException):
+                logger.error(
+                    "The engine of the %s model failed to start: %s",
+                    engine.engine_args.model,
+                    result,
+                )
 
     async def stop_all(self):
         """Stop all engines asynchronously."""
         for engine in self.engines_dict.values():
             await engine.stop()
+        await self.scheduler.shutdown()
 
     def __getitem__(self, key: Union[str, int]) -> "AsyncEngine":
         """Retrieve an engine by model name or index. Auto resolve if only one engine is present.
@@ -0,0 +1,307 @@
+"""Batch size autotuning"""
+
+import asyncio
+import json
+import os
+import platform
+import statistics
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional
+
+import torch
+
+from textembed.engine.args import AsyncEngineArgs
+from textembed.executor.embedder.sentence_transformer import SentenceTransformerEmbedder
+from textembed.log import logger
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None  # type: ignore
+
+DEFAULT_PROFILE_PATH = os.path.join(
+    os.path.expanduser("~"), ".cache", "textembed", "autotune.json"
+)
+
+# Candidate batch sizes and sequence lengths, clamped to the model maximum
+BATCH_SIZES = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+SEQ_LENGTHS = (16, 64, 256, 1024)
+
+# Single token word repeated to build texts of a given number of tokens
+_SAMPLE_WORD = "the"
+
+
+@dataclass
+class BatchLimits:
+    """Batch limits of an engine chosen by autotuning.
+
+    Attributes:
+        batch_size (int): The maximum number of requests of a batch, measured with one
+            text per request.
+        max_batch_tokens (Optional[int]): The maximum number of tokens of a text batch,
+            None when no measured sequence length needed one.
+        measurements (List[Dict]): Latency and throughput of every measured batch size
+            and sequence length.
+    """
+
+    batch_size: int
+    max_batch_tokens: Optional[int]
+    measurements: List[Dict] = field(default_factory=list)
+
+    def __post_init__(self):
+        if not isinstance(self.batch_size, int) or self.batch_size < 1:
+            raise ValueError(
+                f"`batch_size` must be a positive integer, got {self.batch_size!r}."
+            )
+        if self.max_batch_tokens is not None and (
+            not isinstance(self.max_batch_tokens, int) or self.max_batch_tokens < 1
+        ):
+            raise ValueError(
+                "`max_batch_tokens` must be a positive integer or None, "
+                f"got {self.max_batch_tokens!r}."
+            )
+        if not isinstance(self.measurements, list):
+            raise ValueError(
+                f"`measurements` must be a list, got {self.measurements!r}."
+            )
+
+
+def profile_key(engine_args: AsyncEngineArgs) -> str:
+    """Key of the measurements of an engine in the profile file.
+
+    Everything changing the speed of a batch is part of the key, so a profile
+    is only reused for the same model, settings and machine.
+
+    Args:
+        engine_args (AsyncEngineArgs): Arguments of the engine.
+
+    Returns:
+        str: The profile key.
+    """
+    return json.dumps(
+        {
+            "model": engine_args.model,
+            "pooling_mode": engine_args.pooling_mode,
+            "embedding_dtype": engine_args.embedding_dtype,
+            "compile_mode": engine_args.compile_mode,
+            "sequence_packing": engine_args.sequence_packing,
+            "latency_slo_ms": engine_args.autotune_slo_ms,
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+            "cpu_count": os.cpu_count(),
+            "torch": torch.__version__,
+            "torch_threads": torch.get_num_threads(),
+        },
+        sort_keys=True,
+    )
+
+
+def read_profile(path: str) -> Dict[str, Dict]:
+    """Read a profile file.
+
+    Args:
+        path (str): Path of the profile file.
+
+    Returns:
+        Dict[str, Dict]: Batch limits by profile key, empty if the file is missing or invalid.
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            profile = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.warning("Ignoring the unreadable autotune profile %s: %s", path, e)
+        return {}
+    return profile if isinstance(profile, dict) else {}
+
+
+def write_profile(path: str, profile: Dict[str, Dict]):
+    """Write a profile file atomically.
+
+    Args:
+        path (str): Path of the profile file.
+        profile (Dict[str, Dict]): Batch limits by profile key.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(profile, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _sample_texts(model: SentenceTransformerEmbedder, tokens: int, count: int):
+    """Texts of about `tokens` tokens each, special tokens included."""
+    one, two = (
+        model.tokenize([" ".join([_SAMPLE_WORD] * words)])["input_ids"].shape[1]
+        for words in (1, 2)
+    )
+    tokens_per_word = max(two - one, 1)
+    words = max((tokens - (one - tokens_per_word)) // tokens_per_word, 1)
+    return [" ".join([_SAMPLE_WORD] * words)] * count
+
+
+async def _batch_seconds(
+    model: SentenceTransformerEmbedder, texts: List[str], rounds: int
+) -> float:
+    """Median duration of a batch, from tokenization to postprocessing."""
+    timings = []
+    for _ in range(rounds + 1):
+        start = time.perf_counter()
+        features, _ = await model.preprocess(texts)
+        features = await model.transfer_to_device(features)
+        out_features = await model.generate_embeddings(features)
+        await model.postprocess(out_features)
+        timings.append(time.perf_counter() - start)
+    # The first round warms up the shape
+    return statistics.median(timings[1:])
+
+
+async def measure_batch_limits(
+    model: SentenceTransformerEmbedder, latency_slo_ms: float, rounds: int = 3
+) -> BatchLimits:
+    """Measure the largest batches of a model meeting a per-batch latency SLO.
+
+    Every candidate sequence length is measured with increasing batch sizes
+    until a batch misses the SLO. The batch size is the largest one meeting
+    the SLO with the shortest texts, and the token limit the smallest token
+    count of the largest passing batches of the other sequence lengths, so
+    that a batch of any length distribution within both limits meets the SLO.
+    The measurement blocks its event loop, `autotune` runs it on the loop of
+    a worker thread.
+
+    Args:
+        model (SentenceTransformerEmbedder): The warmed up model.
+        latency_slo_ms (float): The maximum duration of a batch, in milliseconds.
+        rounds (int): Number of measured runs of every batch.
+
+    Returns:
+        BatchLimits: The chosen limits and the measurements.
+    """
+    max_seq_length = getattr(model.backbone, "max_seq_length", None)
+    # Without a known maximum, as for CLIP, longer texts may not fit the model
+    seq_lengths = (
+        sorted({min(length, max_seq_length) for length in SEQ_LENGTHS})
+        if max_seq_length
+        else list(SEQ_LENGTHS[:1])
+    )
+    measurements: List[Dict] = []
+    largest: Dict[int, int] = {}
+    for seq_length in seq_lengths:
+        for batch_size in BATCH_SIZES:
+            texts = _sample_texts(model, seq_length, batch_size)
+            seconds = await _batch_seconds(model, texts, rounds)
+            measurements.append(
+                {
+                    "batch_size": batch_size,
+                    "seq_length": seq_length,
+                    "latency_ms": seconds * 1000,
+                    "texts_per_second": batch_size / seconds,
+                }
+            )
+            if seconds * 1000 > latency_slo_ms:
+                break
+            largest[seq_length] = batch_size
+
+    if seq_lengths[0] not in largest:
+        logger.warning(
+            "No batch of the %s model meets the %.1f ms latency SLO, batches are limited to 1 text.",
+            model.engine_args.model,
+            latency_slo_ms,
+        )
+    batch_size = largest.get(seq_lengths[0], 1)
+    # Sequence lengths whose largest candidate met the SLO do not bound the tokens
+    token_limits = [
+        seq_length * size
+        for seq_length, size in largest.items()
+        if seq_length != seq_lengths[0] and size < BATCH_SIZES[-1]
+    ]
+    return BatchLimits(
+        batch_size=batch_size,
+        max_batch_tokens=min(token_limits) if token_limits else None,
+        measurements=measurements,
+    )
+
+
+def _lock(path: str):
+    """Open and lock the lock file of a profile, None without file locking."""
+    if fcntl is None:
+        return None
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        lock_file = open(f"{path}.lock", "w")
+    except OSError as e:
+        logger.warning("Failed to lock the autotune profile %s: %s", path, e)
+        return None
+    fcntl.flock(lock_file, fcntl.LOCK_EX)
+    return lock_file
+
+
+async def autotune(
+    model: SentenceTransformerEmbedder, engine_args: AsyncEngineArgs
+) -> BatchLimits:
+    """Get the batch limits of a model from the profile file, measuring them if missing.
+
+    A stale or malformed entry of the model is measured again and overwritten.
+
+    The profile file is locked while measuring, so the server processes of
+    `--server_processes` measure a model once, one at a time, and the others
+    reuse its measurements.
+
+    Args:
+        model (SentenceTransformerEmbedder): The warmed up model.
+        engine_args (AsyncEngineArgs): Arguments of the engine.
+
+    Returns:
+        BatchLimits: The batch limits.
+    """
+    path = engine_args.autotune_profile or DEFAULT_PROFILE_PATH
+    key = profile_key(engine_args)
+    lock_file = await asyncio.to_thread(_lock, path)
+    try:
+        profile = read_profile(path)
+        if key in profile:
+            try:
+                limits = BatchLimits(**profile[key])
+            except (TypeError, ValueError) as e:
+                logger.warning(
+                    "Ignoring the invalid autotuned batch limits of the %s model in %s: %s",
+                    engine_args.model,
+                    path,
+                    e,
+                )
+            else:
+                logger.info(
+                    "Reusing the autotuned batch size %d and token limit %s of the %s model.",
+                    limits.batch_size,
+                    limits.max_batch_tokens,
+                    engine_args.model,
+                )
+                return limits
+
+        logger.info(
+            "Autotuning the batches of the %s model for a %.1f ms latency SLO.",
+            engine_args.model,
+            engine_args.autotune_slo_ms,
+        )
+        # The batches run in a worker thread, so that the other engines keep
+        # serving their requests while the model is measured
+        limits = await asyncio.to_thread(
+            asyncio.run, measure_batch_limits(model, engine_args.autotune_slo_ms)
+        )
+        profile[key] = asdict(limits)
+        try:
+            write_profile(path, profile)
+        except OSError as e:
+            logger.warning("Failed to save the autotune profile %s: %s", path, e)
+        logger.info(
+            "Autotuned batch size %d and token limit %s for the %s model.",
+            limits.batch_size,
+            limits.max_batch_tokens,
+            engine_args.model,
+        )
+        return limits
+    finally:
+        if lock_file is not None:
+            lock_file.close()
@@ -0,0 +1,150 @@
+"""Memory-budgeted model pool."""
+
+import asyncio
+import json
+import os
+from typing import TYPE_CHECKING, List
+
+from textembed.executor.primitives import EngineState
+from textembed.log import logger
+from textembed.metrics import MODEL_EVICTIONS
+
+if TYPE_CHECKING:
+    from textembed.engine.async_engine import AsyncEngine
+
+# Weight files of the transformers and sentence-transformers checkpoints
+_WEIGHT_PREFIXES = ("model", "pytorch_model")
+_WEIGHT_SUFFIXES = (".bin", ".pt", ".pth")
+
+
+def checkpoint_bytes(model: str) -> int:
+    """Estimate the resident size of a model from the size of its weight files.
+
+    Used to make room for a model before its first load, when its resident
+    size is not known yet. Local directories are read directly, models of
+    the Hugging Face Hub only once they are in the local cache. Only the
+    directories of the modules listed in the `modules.json` file of a
+    sentence-transformers checkpoint are read, and every one counts its
+    safetensors files when it has some, as they are the ones loaded, and
+    its PyTorch files otherwise.
+
+    Args:
+        model (str): Local path or Hugging Face Hub id of the model.
+
+    Returns:
+        int: Size of the weight files in bytes, 0 when the checkpoint is not found.
+    """
+    directory = model
+    if not os.path.isdir(directory):
+        from huggingface_hub import snapshot_download
+
+        try:
+            directory = snapshot_download(model, local_files_only=True)
+        except (OSError, ValueError):
+            return 0
+
+    module_dirs = {""}
+    modules_path = os.path.join(directory, "modules.json")
+    if os.path.isfile(modules_path):
+        with open(modules_path, encoding="utf-8") as f:
+            module_dirs |= {module.get("path", "") for module in json.load(f)}
+
+    total = 0
+    for module_dir in module_dirs:
+        root = os.path.join(directory, module_dir)
+        if not os.path.isdir(root):
+            continue
+        weights = [
+            name for name in os.listdir(root) if name.startswith(_WEIGHT_PREFIXES)
+        ]
+        safetensors = [name for name in weights if name.endswith(".safetensors")]
+        total += sum(
+            os.path.getsize(os.path.join(root, name))
+            for name in safetensors
+            or [name for name in weights if name.endswith(_WEIGHT_SUFFIXES)]
+        )
+    return total
+
+
+class ModelPool:
+    """Keeps the loaded models of a set of engines within a memory budget.
+
+    Engines are registered up front and load their model on demand. Whenever a
+    model is about to be loaded, or has just been loaded, the least recently used
+    loaded models are unloaded until the resident size fits the budget. An
+    evicted engine finishes its queued requests before releasing its model.
+
+    Attributes:
+        memory_budget (int): Maximum resident size of the loaded models, in bytes.
+        engines (List[AsyncEngine]): The engines sharing the budget.
+    """
+
+    def __init__(self, memory_budget: int) -> None:
+        """Initialize an empty pool.
+
+        Args:
+            memory_budget (int): Maximum resident size of the loaded models, in bytes.
+        """
+        if memory_budget <= 0:
+            raise ValueError("Memory budget must be greater than 0 bytes.")
+        self.memory_budget = memory_budget
+        self.engines: List["AsyncEngine"] = []
+        self._lock = asyncio.Lock()
+
+    def register(self, engine: "AsyncEngine"):
+        """Add an engine to the pool.
+
+        Args:
+            engine (AsyncEngine): The engine to manage.
+        """
+        engine.pool = self
+        self.engines.append(engine)
+
+    @property
+    def resident_bytes(self) -> int:
+        """Resident size of the loaded models, in bytes.
+
+        Tensors shared by several models, such as a shared backbone, are only
+        counted once. The tensors of a model are the ones of its
+        `resident_bytes`, MLM head included.
+        """
+        tensors = {}
+        for engine in self.engines:
+            if engine.model is not None:
+                tensors.update(engine.model.resident_tensors())
+        return sum(
+            tensor.numel() * tensor.element_size() for tensor in tensors.values()
+        )
+
+    async def make_room(self, engine: "AsyncEngine", required: int = 0):
+        """Unload least recently used models until `required` more bytes fit.
+
+        Args:
+            engine (AsyncEngine): The engine that needs the memory, never evicted.
+            required (int): Bytes about to be loaded on top of the resident models.
+        """
+        async with self._lock:
+            candidates = sorted(
+                (
+                    other
+                    for other in self.engines
+                    if other is not engine and other.state == EngineState.READY
+                ),
+                key=lambda other: other.last_used,
+            )
+            for other in candidates:
+                if self.resident_bytes + required <= self.memory_budget:
+                    break
+                logger.info(
+                    "Evicting the %s model to stay within the memory budget.",
+                    other.engine_args.model,
+                )
+                await other.unload()
+                MODEL_EVICTIONS.labels(model=other.engine_args.served_model_name).inc()
+
+            if self.resident_bytes + required > self.memory_budget:
+                logger.warning(
+                    "The loaded models need %d bytes, over the %d bytes memory budget.",
+                    self.resident_bytes + required,
+                    self.memory_budget,
+                )
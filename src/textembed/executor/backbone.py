@@ -0,0 +1,97 @@
+"""Shared transformer backbones"""
+
+import hashlib
+import threading
+import weakref
+from typing import Dict, List, Optional, Tuple
+
+import torch
+from torch import nn
+
+from textembed.log import logger
+
+
+class BackboneRegistry:
+    """Deduplicates transformer backbones with identical weights across embedders.
+
+    Backbones are first grouped by a cheap signature (architecture, parameter
+    count and tokenizer). Only when two backbones share a signature are their
+    weights and vocabularies hashed, so loading a model with no look-alike costs
+    nothing. The registry holds weak references: a backbone is released as soon
+    as no embedder uses it anymore.
+    """
+
+    def __init__(self) -> None:
+        """Initialize an empty registry."""
+        self._by_signature: Dict[Tuple, List[weakref.ref]] = {}
+        self._digests: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _signature(module: nn.Module) -> Optional[Tuple]:
+        """Cheap description of a backbone, equal for identical backbones.
+
+        Returns:
+            Optional[Tuple]: The signature, or None if the module is not a shareable transformer.
+        """
+        auto_model = getattr(module, "auto_model", None)
+        tokenizer = getattr(module, "tokenizer", None)
+        if auto_model is None or tokenizer is None:
+            return None
+        state_dict = module.state_dict()
+        return (
+            type(auto_model).__name__,
+            tuple(
+                (name, tuple(tensor.shape), str(tensor.dtype))
+                for name, tensor in state_dict.items()
+            ),
+            type(tokenizer).__name__,
+            len(tokenizer),
+            getattr(module, "max_seq_length", None),
+            getattr(module, "do_lower_case", None),
+        )
+
+    def _digest(self, module: nn.Module) -> str:
+        """Content hash of the backbone weights and vocabulary, cached per module."""
+        if module in self._digests:
+            return self._digests[module]
+        hasher = hashlib.blake2b(digest_size=32)
+        for name, tensor in sorted(module.state_dict().items()):
+            hasher.update(name.encode())
+            data = tensor.detach().cpu().contiguous().reshape(-1)
+            hasher.update(data.view(dtype=torch.uint8).numpy())
+        vocab = sorted(module.tokenizer.get_vocab().items())  # type: ignore
+        hasher.update(repr(vocab).encode())
+        digest = hasher.hexdigest()
+        self._digests[module] = digest
+        return digest
+
+    def share(self, module: nn.Module) -> nn.Module:
+        """Return an already loaded backbone identical to `module`, or register it.
+
+        Args:
+            module (nn.Module): A freshly loaded backbone.
+
+        Returns:
+            nn.Module: The backbone to use, either `module` itself or a shared one.
+        """
+        signature = self._signature(module)
+        if signature is None:
+            return module
+        with self._lock:
+            refs = self._by_signature.setdefault(signature, [])
+            refs[:] = [ref for ref in refs if ref() is not None]
+            candidates = [ref() for ref in refs]
+            if candidates:
+                digest = self._digest(module)
+                for candidate in candidates:
+                    if candidate is not None and self._digest(candidate) == digest:
+                        logger.info(
+                            "Sharing an already loaded backbone %s.", digest[:12]
+                        )
+                        return candidate
+            refs.append(weakref.ref(module))
+            return module
+
+
+BACKBONES = BackboneRegistry()
@@ -1,11 +1,16 @@
 """Base class for embeddings creation"""
 
 from abc import ABC, abstractmethod
-from typing import Dict, List, Tuple, Union
+from typing import Dict, List, Sequence, Tuple, Union
 
 import numpy as np
 from torch import Tensor
 
+from textembed.executor.outputs import RaggedEmbeddings
+from textembed.executor.primitives import OutputMode
+
+EmbeddingOutput = Union[np.ndarray, RaggedEmbeddings]
+
 
 class BaseEmbedder(ABC):
     """Abstract base class for embedding models.
@@ -41,34 +46,50 @@ class BaseEmbedder(ABC):
         """
 
     @abstractmethod
-    async def generate_embeddings(self, features: Dict[str, Tensor]) -> Tensor:
-        """Performs the forward pass to generate sentence embeddings.
+    async def generate_embeddings(
+        self,
+        features: Dict[str, Tensor],
+        output_modes: Sequence[str] = (OutputMode.DENSE.value,),
+    ) -> Dict[str, Tensor]:
+        """Performs the forward pass to generate embeddings.
 
         Args:
             features (Dict[str, Tensor]): Tokenized features moved to the device.
+            output_modes (Sequence[str]): Output modes the forward outputs are needed for.
 
         Returns:
-            Tensor: Raw embeddings from the model.
+            Dict[str, Tensor]: Raw outputs from the model.
         """
 
     @abstractmethod
-    async def postprocess(self, out_features: Tensor) -> np.ndarray:
+    async def postprocess(
+        self,
+        out_features: Dict[str, Tensor],
+        output_mode: str = OutputMode.DENSE.value,
+    ) -> EmbeddingOutput:
         """Converts the output tensors to numpy arrays.
 
         Args:
-            out_features (Tensor): Raw embeddings from the model.
+            out_features (Dict[str, Tensor]): Raw outputs from the model.
+            output_mode (str): Output mode to build the embeddings for.
 
         Returns:
-            np.ndarray: Postprocessed embeddings in numpy array format.
+            EmbeddingOutput: Postprocessed embeddings in numpy array format.
         """
 
     @abstractmethod
-    async def process_batch(self, sentences: List[str]) -> Tuple[np.ndarray, List[int]]:
+    async def process_batch(
+        self,
+        sentences: List[str],
+        output_modes: Sequence[str] = (OutputMode.DENSE.value,),
+    ) -> Tuple[Dict[str, EmbeddingOutput], List[int]]:
         """Processes a batch of sentences to generate embeddings.
 
         Args:
             sentences (List[str]): List of sentences to be embedded.
+            output_modes (Sequence[str]): Output modes to build from the forward pass.
 
         Returns:
-            Tuple[np.ndarray, List[int]]: Generated embeddings and lengths of sentences.
+            Tuple[Dict[str, EmbeddingOutput], List[int]]: Generated embeddings by output mode
+                and lengths of sentences.
         """
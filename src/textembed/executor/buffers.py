@@ -0,0 +1,100 @@
+"""Pooled output buffers"""
+
+import threading
+import weakref
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from textembed.metrics import OUTPUT_BUFFERS
+
+# Maximum size of the free buffers kept by a pool, larger ones are released
+DEFAULT_MAX_FREE_BYTES = 64 * 1024 * 1024
+
+
+class _Lease:
+    """Owner of the memory of the arrays handed out by `OutputBufferPool.take`.
+
+    The arrays and every view of them keep the lease alive, so the buffer is
+    recycled once the last of them is garbage collected.
+    """
+
+    __slots__ = ("__array_interface__", "buffer", "__weakref__")
+
+    def __init__(self, buffer: np.ndarray) -> None:
+        self.buffer = buffer
+        self.__array_interface__ = buffer.__array_interface__
+
+
+class OutputBufferPool:
+    """Reusable buffers the embeddings of the batches of a model are written to.
+
+    A batch takes a buffer of at least its number of rows, with a power of two
+    capacity so that buffers fit batches of similar sizes, and the requests get
+    views of its rows. The buffer goes back to the pool once the last view,
+    typically the one of the slowest request, is garbage collected after its
+    response was serialized. Views kept for longer only delay the reuse, a
+    buffer is never handed out twice at once.
+
+    Attributes:
+        model (str): Served model name labelling the metrics of the pool.
+        max_free_bytes (int): Maximum size of the free buffers kept for reuse.
+    """
+
+    def __init__(self, model: str, max_free_bytes: int = DEFAULT_MAX_FREE_BYTES):
+        """Initialize an empty pool.
+
+        Args:
+            model (str): Served model name labelling the metrics of the pool.
+            max_free_bytes (int): Maximum size of the free buffers kept for reuse.
+        """
+        self.model = model
+        self.max_free_bytes = max_free_bytes
+        self._free: Dict[Tuple[str, Tuple[int, ...]], List[np.ndarray]] = {}
+        self._free_bytes = 0
+        # Buffers are recycled by whichever thread drops their last view
+        self._lock = threading.Lock()
+
+    @property
+    def free_bytes(self) -> int:
+        """The size of the free buffers kept for reuse."""
+        return self._free_bytes
+
+    def take(self, shape: Tuple[int, ...], dtype) -> np.ndarray:
+        """Take an uninitialized array backed by a pooled buffer.
+
+        Args:
+            shape (Tuple[int, ...]): Shape of the array, rows first.
+            dtype: Data type of the array.
+
+        Returns:
+            np.ndarray: The array, recycled with its buffer once no longer referenced.
+        """
+        rows, row_shape = shape[0], tuple(shape[1:])
+        key = (np.dtype(dtype).str, row_shape)
+        buffer = None
+        with self._lock:
+            free = self._free.get(key, [])
+            fitting = [i for i, candidate in enumerate(free) if len(candidate) >= rows]
+            if fitting:
+                buffer = free.pop(min(fitting, key=lambda i: len(free[i])))
+                self._free_bytes -= buffer.nbytes
+        OUTPUT_BUFFERS.labels(
+            model=self.model, outcome="allocated" if buffer is None else "reused"
+        ).inc()
+        if buffer is None:
+            capacity = 1 << max(rows - 1, 0).bit_length()
+            buffer = np.empty((capacity,) + row_shape, dtype=dtype)
+
+        lease = _Lease(buffer[:rows])
+        finalizer = weakref.finalize(lease, self._recycle, key, buffer)
+        finalizer.atexit = False
+        return np.asarray(lease)
+
+    def _recycle(self, key: Tuple[str, Tuple[int, ...]], buffer: np.ndarray):
+        """Put a buffer no longer referenced back in the pool, if it has room."""
+        with self._lock:
+            if self._free_bytes + buffer.nbytes > self.max_free_bytes:
+                return
+            self._free.setdefault(key, []).append(buffer)
+            self._free_bytes += buffer.nbytes
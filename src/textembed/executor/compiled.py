@@ -0,0 +1,276 @@
+"""Compiled transformer backbones"""
+
+import bisect
+import weakref
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import torch
+from sentence_transformers import models
+from torch import Tensor, nn
+
+from textembed.engine.args import COMPILE_MODES
+from textembed.log import logger
+
+
+def default_buckets(limit: int, start: int = 1) -> List[int]:
+    """Powers of two from `start` up to `limit`, `limit` included.
+
+    Args:
+        limit (int): The largest bucket.
+        start (int): The smallest bucket.
+
+    Returns:
+        List[int]: The buckets in increasing order.
+    """
+    buckets = []
+    bucket = start
+    while bucket < limit:
+        buckets.append(bucket)
+        bucket *= 2
+    buckets.append(limit)
+    return buckets
+
+
+class _Encoder(nn.Module):
+    """The transformer of a backbone, returning its last hidden state."""
+
+    def __init__(self, auto_model: nn.Module) -> None:
+        super().__init__()
+        self.auto_model = auto_model
+
+    def forward(
+        self,
+        input_ids: Tensor,
+        attention_mask: Tensor,
+        token_type_ids: Optional[Tensor] = None,
+    ) -> Tensor:
+        kwargs = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if token_type_ids is not None:
+            kwargs["token_type_ids"] = token_type_ids
+        return self.auto_model(**kwargs, return_dict=False)[0]
+
+
+class CompiledBackbone:
+    """Runs a transformer backbone through graphs compiled for fixed input shapes.
+
+    Inputs are padded to the smallest (batch size, sequence length) bucket
+    holding them, so a graph is compiled once per bucket and reused by every
+    later batch; batches larger than the largest batch bucket are split. The
+    maximum sequence length of the model is always the largest sequence bucket. The
+    padding rows and tokens are masked and dropped from the outputs. Graphs
+    are built with `torch.compile`, or traced with TorchScript, which is also
+    the fallback when `torch.compile` fails.
+
+    Attributes:
+        backbone (models.Transformer): The eager backbone.
+        mode (str): How the graphs are built, `compile` or `trace`.
+        batch_buckets (List[int]): Batch sizes the inputs are padded to.
+        seq_buckets (List[int]): Sequence lengths the inputs are padded to.
+    """
+
+    def __init__(
+        self,
+        backbone: models.Transformer,
+        mode: str,
+        batch_buckets: Sequence[int],
+        seq_buckets: Sequence[int],
+    ) -> None:
+        """Prepare the compiled backbone, graphs are built on their first use.
+
+        Args:
+            backbone (models.Transformer): The eager backbone.
+            mode (str): How the graphs are built, `compile` or `trace`.
+            batch_buckets (Sequence[int]): Batch sizes the inputs are padded to.
+            seq_buckets (Sequence[int]): Sequence lengths the inputs are padded to.
+        """
+        if mode not in COMPILE_MODES:
+            raise ValueError(
+                f"Unsupported compile mode: '{mode}'. Valid modes are: {COMPILE_MODES}."
+            )
+        self.backbone = backbone
+        self.mode = mode
+        self.batch_buckets = sorted(set(batch_buckets))
+        # Inputs are truncated to the maximum sequence length of the model,
+        # the last bucket, so that no request builds a graph of its own
+        max_seq_length = backbone.max_seq_length or getattr(
+            backbone.auto_model.config, "max_position_embeddings", None
+        )
+        self.seq_buckets = sorted(
+            set(
+                seq_buckets
+                if max_seq_length is None
+                else [min(bucket, max_seq_length) for bucket in seq_buckets]
+                + [max_seq_length]
+            )
+        )
+        self.pad_token_id = backbone.tokenizer.pad_token_id or 0
+        self._encoder = _Encoder(backbone.auto_model).eval()
+        self._compiled: Optional[nn.Module] = None
+        self._traced: Dict[Tuple[int, int], torch.jit.ScriptModule] = {}
+
+        if mode == "compile":
+            self._raise_cache_size_limit()
+            self._compiled = torch.compile(self._encoder, dynamic=False)
+
+    def _raise_cache_size_limit(self):
+        """Let torch.compile cache a graph for every bucket."""
+        import torch._dynamo
+
+        torch._dynamo.config.cache_size_limit = max(
+            torch._dynamo.config.cache_size_limit, len(self.buckets)
+        )
+
+    def extend_batch_buckets(self, batch_size: int) -> bool:
+        """Add the batch buckets needed to run batches of `batch_size` inputs unsplit.
+
+        Args:
+            batch_size (int): The largest batch size.
+
+        Returns:
+            bool: Whether buckets were added, their graphs are built by the next warm-up.
+        """
+        if batch_size <= self.batch_buckets[-1]:
+            return False
+        self.batch_buckets = sorted(
+            set(self.batch_buckets) | set(default_buckets(batch_size))
+        )
+        if self.mode == "compile":
+            self._raise_cache_size_limit()
+        return True
+
+    @property
+    def buckets(self) -> List[Tuple[int, int]]:
+        """Every (batch size, sequence length) bucket."""
+        return [(b, s) for b in self.batch_buckets for s in self.seq_buckets]
+
+    def _bucket(self, size: int, buckets: List[int]) -> int:
+        """The smallest bucket holding `size`, or `size` itself if none does."""
+        index = bisect.bisect_left(buckets, size)
+        return buckets[index] if index < len(buckets) else size
+
+    def _encode(self, inputs: Dict[str, Tensor]) -> Tensor:
+        """Run the graph of the bucket of padded inputs."""
+        args = tuple(inputs.values())
+        if self._compiled is not None:
+            try:
+                return self._compiled(*args)
+            except Exception as e:
+                logger.warning(
+                    "torch.compile failed, falling back to TorchScript tracing: %s", e
+                )
+                self._compiled = None
+                self.mode = "trace"
+        key = tuple(inputs["input_ids"].shape)
+        traced = self._traced.get(key)  # type: ignore
+        if traced is None:
+            with torch.no_grad():
+                traced = torch.jit.trace(
+                    self._encoder, args, check_trace=False, strict=False
+                )
+            self._traced[key] = traced  # type: ignore
+        return traced(*args)
+
+    def _pad(self, tensor: Tensor, rows: int, columns: int, value: int) -> Tensor:
+        """Pad a (batch, sequence) tensor to `rows` x `columns`."""
+        padded = tensor.new_full((rows, columns), value)
+        padded[: tensor.shape[0], : tensor.shape[1]] = tensor
+        # Padding rows repeat the first input, fully masked rows may produce NaNs
+        padded[tensor.shape[0] :, : tensor.shape[1]] = tensor[:1]
+        return padded
+
+    def __call__(self, features: Dict[str, Tensor]) -> Dict[str, Tensor]:
+        """Compute the token embeddings, like the forward of the eager backbone.
+
+        Args:
+            features (Dict[str, Tensor]): Tokenized features.
+
+        Returns:
+            Dict[str, Tensor]: The features with the token embeddings, padded to
+                the sequence length bucket along with the attention mask.
+        """
+        names = ["input_ids", "attention_mask"]
+        if "token_type_ids" in features:
+            names.append("token_type_ids")
+        batch, length = features["input_ids"].shape
+        columns = self._bucket(length, self.seq_buckets)
+        chunk_size = self.batch_buckets[-1]
+
+        outputs = []
+        for start in range(0, batch, chunk_size):
+            chunk = {name: features[name][start : start + chunk_size] for name in names}
+            size = chunk["input_ids"].shape[0]
+            rows = self._bucket(size, self.batch_buckets)
+            padded = {
+                name: self._pad(
+                    tensor,
+                    rows,
+                    columns,
+                    self.pad_token_id if name == "input_ids" else 0,
+                )
+                for name, tensor in chunk.items()
+            }
+            outputs.append(self._encode(padded)[:size])
+
+        attention_mask = features["attention_mask"]
+        features["attention_mask"] = attention_mask.new_zeros((batch, columns))
+        features["attention_mask"][:, :length] = attention_mask
+        features["token_embeddings"] = torch.cat(outputs)
+        return features
+
+    def warm_up(self):
+        """Build and run the graph of every bucket.
+
+        Every graph runs twice: TorchScript optimizes a traced graph on its
+        second run, after profiling the first one.
+        """
+        token_id = self.backbone.tokenizer.cls_token_id or self.pad_token_id
+        with torch.inference_mode():
+            for rows, columns in self.buckets * 2:
+                features = {
+                    "input_ids": torch.full((rows, columns), token_id),
+                    "attention_mask": torch.ones((rows, columns), dtype=torch.int64),
+                }
+                if "token_type_ids" in self.backbone.tokenizer.model_input_names:
+                    features["token_type_ids"] = torch.zeros(
+                        (rows, columns), dtype=torch.int64
+                    )
+                self(features)
+
+
+# Compiled backbones, by backbone and compile mode
+_COMPILED_BACKBONES: (
+    "weakref.WeakKeyDictionary[nn.Module, Dict[str, CompiledBackbone]]"
+) = weakref.WeakKeyDictionary()
+
+
+def compile_backbone(
+    backbone: nn.Module,
+    mode: str,
+    batch_buckets: Sequence[int],
+    seq_buckets: Sequence[int],
+) -> Optional[CompiledBackbone]:
+    """Get the compiled version of a backbone, shared by the embedders sharing the backbone.
+
+    Args:
+        backbone (nn.Module): The eager backbone.
+        mode (str): How the graphs are built, `compile` or `trace`.
+        batch_buckets (Sequence[int]): Batch sizes the inputs are padded to.
+        seq_buckets (Sequence[int]): Sequence lengths the inputs are padded to.
+
+    Returns:
+        Optional[CompiledBackbone]: The compiled backbone, or None if the backbone
+            is not a text transformer that can be compiled.
+    """
+    if (
+        not isinstance(backbone, models.Transformer)
+        or backbone.auto_model.config.output_hidden_states
+    ):
+        logger.warning(
+            "The %s backbone cannot be compiled, it runs eagerly.",
+            type(backbone).__name__,
+        )
+        return None
+    compiled = _COMPILED_BACKBONES.setdefault(backbone, {})
+    if mode not in compiled:
+        compiled[mode] = CompiledBackbone(backbone, mode, batch_buckets, seq_buckets)
+    return compiled[mode]
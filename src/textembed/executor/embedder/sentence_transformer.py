@@ -1,15 +1,42 @@
 """Sentence Transformers"""
 
-from typing import Dict, List, Tuple, Union
+import asyncio
+import importlib.util
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence, Tuple, Union
 
 import numpy as np
 import torch
-from sentence_transformers import SentenceTransformer, util
-from torch import Tensor
+from sentence_transformers import SentenceTransformer, models, util
+from torch import Tensor, nn
 
 from textembed.engine.args import AsyncEngineArgs
-from textembed.executor.base import BaseEmbedder
-from textembed.executor.primitives import EmbeddingDtype
+from textembed.executor.backbone import BACKBONES
+from textembed.executor.base import BaseEmbedder, EmbeddingOutput
+from textembed.executor.buffers import OutputBufferPool
+from textembed.executor.compiled import compile_backbone, default_buckets
+from textembed.executor.images import PreprocessedImage
+from textembed.executor.outputs import RaggedEmbeddings
+from textembed.executor.packing import pack_backbone
+from textembed.executor.primitives import EmbeddingDtype, OutputMode
+from textembed.executor.sparse import load_mlm_head, mlm_head
+from textembed.executor.tokens import (
+    InvalidTokenIdsError,
+    PromptedText,
+    PromptNotFoundError,
+    TokenIds,
+    pad_token_ids,
+    splice_prompt,
+    to_token_ids,
+)
+from textembed.metrics import (
+    BATCH_PADDING_RATIO,
+    BATCH_SIZE_TOKENS,
+    BATCH_STAGE_SECONDS,
+)
+from textembed.profiling import FORWARD_TRACER
+from textembed.tracing import record_stage
 
 
 class SentenceTransformerEmbedder(SentenceTransformer, BaseEmbedder):
@@ -23,43 +50,396 @@ class SentenceTransformerEmbedder(SentenceTransformer, BaseEmbedder):
     def __init__(self, engine_args: AsyncEngineArgs) -> None:
         """Initializes the embedder with the given engine arguments.
 
+        Safetensors checkpoints are preferred and memory-mapped by transformers.
+        When `accelerate` is installed, the random initialization of the weights
+        is skipped as well, since they are overwritten by the checkpoint anyway.
+
+        The transformer backbone is replaced by an identical one already loaded
+        by another embedder, if any, so that only the pooling head is duplicated.
+        With a `compile_mode`, the backbone runs through graphs compiled per
+        input shape bucket, built when the model is warmed up. With
+        `sequence_packing`, it runs on the sequences packed without padding.
+        The `prompts` of the engine are added to the ones of the model. The
+        embeddings of the batches are written to the buffers of an output pool.
+
         Args:
             engine_args (AsyncEngineArgs): The arguments required to configure the engine.
         """
+        model_kwargs = {}
+        if importlib.util.find_spec("accelerate") is not None:
+            model_kwargs["low_cpu_mem_usage"] = True
         super().__init__(
             model_name_or_path=engine_args.model,
             device="cpu",
             trust_remote_code=engine_args.trust_remote_code,
+            model_kwargs=model_kwargs,
         )
+        # Options of `from_pretrained`, for the MLM head loaded later
+        self.model_kwargs = model_kwargs
         self.embedding_dtype = engine_args.embedding_dtype
         self.engine_args = engine_args
+        if engine_args.pooling_mode is not None:
+            self._set_pooling_mode(engine_args.pooling_mode)
+        self._modules[next(iter(self._modules))] = BACKBONES.share(self._first_module())
         self.eval()
+        self.compiled_backbone = None
+        if engine_args.compile_mode is not None:
+            self.compiled_backbone = compile_backbone(
+                self.backbone,
+                engine_args.compile_mode,
+                batch_buckets=engine_args.compile_batch_buckets
+                or default_buckets(engine_args.batch_size),
+                seq_buckets=engine_args.compile_seq_buckets
+                or default_buckets(
+                    getattr(self.backbone, "max_seq_length", None) or 512, start=16
+                ),
+            )
+        self.packed_backbone = (
+            pack_backbone(self.backbone) if engine_args.sequence_packing else None
+        )
+        # Prompts of the model configuration, overridden by the configured ones
+        self.prompts = {**self.prompts, **(engine_args.prompts or {})}
+        self._prompt_token_ids: Dict[str, Tensor] = {}
+        self._special_tokens: Optional[Tuple[int, int]] = None
+        self.output_buffers = OutputBufferPool(engine_args.served_model_name)
+
+    def _set_pooling_mode(self, pooling_mode: str):
+        """Replaces the pooling modules of the model with the given pooling mode.
+
+        Args:
+            pooling_mode (str): Pooling mode, e.g. `mean`, `cls`, `max` or `lasttoken`.
+        """
+        for name, module in self._modules.items():
+            if isinstance(module, models.Pooling):
+                self._modules[name] = models.Pooling(
+                    module.get_sentence_embedding_dimension(),
+                    pooling_mode=pooling_mode,
+                )
+
+    @property
+    def backbone(self) -> nn.Module:
+        """The transformer backbone, possibly shared with other embedders."""
+        return self._first_module()
+
+    def resident_tensors(self) -> Dict[int, Tensor]:
+        """The parameters and buffers held by the model, including its MLM head.
+
+        Returns:
+            Dict[int, Tensor]: The tensors by data pointer, so that the weights tied
+                between the head and the backbone, or shared with other models,
+                are counted once.
+        """
+        tensors = list(self.parameters()) + list(self.buffers())
+        head = mlm_head(self.backbone)
+        if head is not None:
+            tensors += list(head.parameters()) + list(head.buffers())
+        return {tensor.data_ptr(): tensor for tensor in tensors}
+
+    @property
+    def resident_bytes(self) -> int:
+        """Size of the model parameters and buffers, in bytes."""
+        return sum(
+            tensor.numel() * tensor.element_size()
+            for tensor in self.resident_tensors().values()
+        )
+
+    @property
+    def image_processor(self):
+        """The image processor of multimodal models such as CLIP, None for text models."""
+        processor = getattr(self._first_module(), "processor", None)
+        return getattr(processor, "image_processor", None)
+
+    def _load_mlm_head(self) -> Optional[nn.Module]:
+        """Loads the MLM head of the checkpoint, with the options of the model.
+
+        The head is not a module of the model, which runs its modules in sequence.
+        """
+        return load_mlm_head(
+            self.backbone,
+            trust_remote_code=self.engine_args.trust_remote_code,
+            **self.model_kwargs,
+        )
+
+    async def supports_output_mode(self, output_mode: str) -> bool:
+        """Checks whether the model can produce the given output mode.
+
+        Sparse outputs need the MLM head of the checkpoint, loaded in a worker
+        thread on the first request for them.
+
+        Args:
+            output_mode (str): Output mode of the embeddings.
+
+        Returns:
+            bool: True if the output mode is supported.
+        """
+        if output_mode == OutputMode.DENSE.value:
+            return True
+        auto_model = getattr(self._first_module(), "auto_model", None)
+        if auto_model is None:
+            return False
+        if output_mode == OutputMode.MULTI_VECTOR.value:
+            return True
+        if output_mode == OutputMode.SPARSE.value:
+            head = mlm_head(self.backbone) or await asyncio.to_thread(
+                self._load_mlm_head
+            )
+            return head is not None
+        return False
 
     async def warm_up(self) -> None:
-        """Warm up the model by performing a dummy inference."""
+        """Warm up the model by performing a dummy inference.
+
+        In compiled mode, the graph of every shape bucket is built and run first,
+        in a worker thread, so that no request pays for a compilation.
+        """
+        if self.compiled_backbone is not None:
+            await asyncio.to_thread(self.compiled_backbone.warm_up)
         sample_sentences = ["This is a sample sentence."] * 10
         # Perform inference
         await self.process_batch(sample_sentences)
 
+    async def fit_batch_size(self, batch_size: int) -> None:
+        """Build the compiled graphs of batches of up to `batch_size` inputs.
+
+        The default batch buckets stop at the configured batch size, so larger
+        autotuned batches would always be split. Explicit `compile_batch_buckets`
+        are kept as they are.
+
+        Args:
+            batch_size (int): The largest batch size.
+        """
+        if (
+            self.compiled_backbone is not None
+            and not self.engine_args.compile_batch_buckets
+            and self.compiled_backbone.extend_batch_buckets(batch_size)
+        ):
+            await asyncio.to_thread(self.compiled_backbone.warm_up)
+
     async def preprocess(
         self, sentences: List[str]
     ) -> Tuple[Dict[str, Tensor], List[Union[int, str]]]:
         """Tokenizes the input sentences.
 
+        Images already decoded into pixel values are stacked as they are, and
+        pre-tokenized inputs are padded along with the tokenized texts. The
+        usage of pre-tokenized inputs is their number of tokens. The prompt
+        token ids of prompted inputs are spliced after their leading special
+        tokens, and are not part of their usage.
+
         Args:
             sentences (List[str]): List of sentences to be tokenized.
 
         Returns:
             Tuple[Dict[str, Tensor], List[Union[int, str]]: Tokenized features and lengths or shape of sentences
         """
-        tokenized = self.tokenize(sentences)
+        if any(isinstance(sentence, PreprocessedImage) for sentence in sentences):
+            tokenized = self._tokenize_preprocessed(sentences)
+        elif all(isinstance(sentence, str) for sentence in sentences):
+            tokenized = self.tokenize(sentences)
+        else:
+            tokenized = self._tokenize_token_ids(sentences)
         usage = [
-            len(sentence) if isinstance(sentence, str) else str(sentence.size)
+            (
+                len(sentence)
+                if isinstance(sentence, str)
+                else (
+                    sentence.input_ids.shape[0] - sentence.prompt_length
+                    if isinstance(sentence, TokenIds)
+                    else (
+                        len(sentence.text)
+                        if isinstance(sentence, PromptedText)
+                        else str(sentence.size)
+                    )
+                )
+            )
             for sentence in sentences
         ]
 
         return tokenized, usage
 
+    def _token_limits(self) -> Tuple[int, int]:
+        """The vocabulary size and maximum number of tokens of a text transformer.
+
+        Raises:
+            InvalidTokenIdsError: If the model does not accept token ids.
+        """
+        backbone = self.backbone
+        if not isinstance(backbone, models.Transformer):
+            raise InvalidTokenIdsError(
+                f"The {self.engine_args.model} model does not accept token ids."
+            )
+        config = backbone.auto_model.config
+        # The rows of the embedding matrix, a tokenizer may count its vocabulary with gaps
+        word_embeddings = backbone.auto_model.get_input_embeddings()
+        vocab_size = (
+            word_embeddings.num_embeddings
+            if word_embeddings is not None
+            else len(backbone.tokenizer)
+        )
+        # Position embeddings are the hard limit, whatever the configured length
+        limits = [
+            limit
+            for limit in (
+                backbone.max_seq_length,
+                getattr(config, "max_position_embeddings", None),
+            )
+            if limit
+        ]
+        return vocab_size, min(limits) if limits else 512
+
+    def _special_tokens_around(self) -> Tuple[int, int]:
+        """The number of special tokens the tokenizer adds before and after a text."""
+        if self._special_tokens is None:
+            with_special = self.tokenizer("a")["input_ids"]
+            without = self.tokenizer("a", add_special_tokens=False)["input_ids"]
+            self._special_tokens = (0, 0)
+            for leading in range(len(with_special) - len(without) + 1):
+                if with_special[leading : leading + len(without)] == without:
+                    trailing = len(with_special) - leading - len(without)
+                    self._special_tokens = (leading, trailing)
+                    break
+        return self._special_tokens
+
+    def prompt_token_ids(self, prompt_name: str) -> Tensor:
+        """Gets the token ids of a named prompt, tokenized once.
+
+        The prompt is tokenized on its own, without its trailing whitespace, as
+        the text it prefixes starts a new word.
+
+        Args:
+            prompt_name (str): Name of the prompt.
+
+        Raises:
+            PromptNotFoundError: If the prompt is not configured for the model.
+
+        Returns:
+            Tensor: The token ids of the prompt, without special tokens.
+        """
+        if prompt_name not in self._prompt_token_ids:
+            if prompt_name not in self.prompts:
+                raise PromptNotFoundError(prompt_name)
+            self._prompt_token_ids[prompt_name] = torch.tensor(
+                self.tokenizer(
+                    self.prompts[prompt_name].rstrip(), add_special_tokens=False
+                )["input_ids"],
+                dtype=torch.int64,
+            )
+        return self._prompt_token_ids[prompt_name]
+
+    def token_ids(
+        self,
+        inputs: Sequence[Sequence[int]],
+        prompt_ids: Optional[Tensor] = None,
+    ) -> List[TokenIds]:
+        """Validates pre-tokenized inputs against the vocabulary and maximum length.
+
+        Args:
+            inputs (Sequence[Sequence[int]]): Token ids of every input, special tokens included.
+            prompt_ids (Optional[Tensor]): Token ids of a prompt spliced into every input.
+
+        Raises:
+            InvalidTokenIdsError: If the model does not accept token ids or an input is invalid.
+
+        Returns:
+            List[TokenIds]: The inputs, to be embedded like texts.
+        """
+        vocab_size, max_length = self._token_limits()
+        if prompt_ids is None:
+            return to_token_ids(inputs, vocab_size, max_length)
+        token_ids = to_token_ids(inputs, vocab_size, max_length, len(prompt_ids))
+        leading, trailing = self._special_tokens_around()
+        return [
+            TokenIds(
+                splice_prompt(
+                    token_id.input_ids, prompt_ids, leading, trailing, max_length
+                ),
+                prompt_length=leading + len(prompt_ids),
+            )
+            for token_id in token_ids
+        ]
+
+    def _tokenize_token_ids(self, sentences: list) -> Dict[str, Tensor]:
+        """Tokenizes texts mixed with pre-tokenized and prompted inputs.
+
+        Args:
+            sentences (list): Texts, token ids and prompted texts.
+
+        Returns:
+            Dict[str, Tensor]: Tokenized features of every input, padded together, with
+                a `prompt_mask` marking the prompt tokens.
+        """
+        texts = [
+            sentence.text if isinstance(sentence, PromptedText) else sentence
+            for sentence in sentences
+            if isinstance(sentence, (str, PromptedText))
+        ]
+        text_rows = iter([])
+        if texts:
+            tokenized = self.tokenize(texts)
+            text_rows = iter(
+                ids[mask]
+                for ids, mask in zip(
+                    tokenized["input_ids"], tokenized["attention_mask"].bool()
+                )
+            )
+        leading, trailing = self._special_tokens_around()
+        max_length = self._token_limits()[1]
+        rows, prompt_lengths = [], []
+        for sentence in sentences:
+            if isinstance(sentence, TokenIds):
+                rows.append(sentence.input_ids)
+                prompt_lengths.append(sentence.prompt_length)
+            elif isinstance(sentence, PromptedText):
+                rows.append(
+                    splice_prompt(
+                        next(text_rows),
+                        sentence.prompt_ids,
+                        leading,
+                        trailing,
+                        max_length,
+                    )
+                )
+                prompt_lengths.append(leading + len(sentence.prompt_ids))
+            else:
+                rows.append(next(text_rows))
+                prompt_lengths.append(0)
+        tokenizer = self.tokenizer
+        return pad_token_ids(
+            rows,
+            pad_token_id=tokenizer.pad_token_id or 0,
+            padding_side=tokenizer.padding_side,
+            with_token_type_ids="token_type_ids" in tokenizer.model_input_names,
+            prompt_lengths=prompt_lengths if any(prompt_lengths) else None,
+        )
+
+    def _tokenize_preprocessed(self, sentences: list) -> Dict[str, Tensor]:
+        """Tokenizes texts mixed with preprocessed images.
+
+        Args:
+            sentences (list): Texts, PIL images and preprocessed images.
+
+        Returns:
+            Dict[str, Tensor]: Tokenized features with the stacked pixel values.
+        """
+        texts = [sentence for sentence in sentences if isinstance(sentence, str)]
+        pixel_values = [
+            (
+                sentence.pixel_values
+                if isinstance(sentence, PreprocessedImage)
+                else self.image_processor(sentence, return_tensors="pt")[
+                    "pixel_values"
+                ][0]
+            )
+            for sentence in sentences
+            if not isinstance(sentence, str)
+        ]
+        tokenized = self.tokenize(texts) if texts else {}
+        tokenized["pixel_values"] = torch.stack(pixel_values)
+        tokenized["image_text_info"] = [
+            1 if isinstance(sentence, str) else 0 for sentence in sentences
+        ]
+        return tokenized
+
     async def transfer_to_device(
         self, features: Dict[str, Tensor]
     ) -> Dict[str, Tensor]:
@@ -73,48 +453,327 @@ class SentenceTransformerEmbedder(SentenceTransformer, BaseEmbedder):
         """
         return util.batch_to_device(features, self.device)
 
-    async def generate_embeddings(self, features: Dict[str, Tensor]) -> Tensor:
-        """Performs the forward pass to generate sentence embeddings.
+    async def generate_embeddings(
+        self,
+        features: Dict[str, Tensor],
+        output_modes: Sequence[str] = (OutputMode.DENSE.value,),
+    ) -> Dict[str, Tensor]:
+        """Performs the forward pass to generate embeddings.
+
+        The dense, multi-vector and sparse outputs are all derived from the same
+        forward pass; the sparse vocabulary weights are only computed when requested.
 
         Args:
             features (Dict[str, Tensor]): Tokenized features moved to the device.
+            output_modes (Sequence[str]): Output modes the forward outputs are needed for.
 
         Returns:
-            Tensor: Raw embeddings from the model.
+            Dict[str, Tensor]: Raw outputs from the model.
         """
-        with torch.inference_mode():
-            return self.forward(features)["sentence_embedding"]
+        with torch.inference_mode(), FORWARD_TRACER.trace():
+            return self._forward_head(self._run_backbone(features), output_modes)
 
-    async def postprocess(self, out_features: Tensor) -> np.ndarray:
-        """Converts the output tensors to numpy arrays of the specified data type.
+    def _run_backbone(self, features: Dict[str, Tensor]) -> Dict[str, Tensor]:
+        """Runs the backbone, through its compiled graphs or packed when enabled.
+
+        Args:
+            features (Dict[str, Tensor]): Tokenized features moved to the device.
+
+        Returns:
+            Dict[str, Tensor]: Outputs of the backbone.
+        """
+        if self.compiled_backbone is not None and "input_ids" in features:
+            return self.compiled_backbone(features)
+        if self.packed_backbone is not None and "input_ids" in features:
+            return self.packed_backbone(features)
+        return self.backbone(features)
+
+    def _forward_head(
+        self, out_features: Dict[str, Tensor], output_modes: Sequence[str]
+    ) -> Dict[str, Tensor]:
+        """Applies the modules following the backbone, such as pooling and normalization.
+
+        Pooling modules excluding the prompt, as for Instructor models, do not
+        pool the tokens of the `prompt_mask`.
 
         Args:
-            out_features (Tensor): Raw embeddings from the model.
+            out_features (Dict[str, Tensor]): Outputs of the backbone.
+            output_modes (Sequence[str]): Output modes the outputs are needed for.
 
         Returns:
-            np.ndarray: Postprocessed embeddings in the specified numpy array format.
+            Dict[str, Tensor]: Raw outputs from the model.
+        """
+        prompt_mask = out_features.pop("prompt_mask", None)
+        for module in list(self)[1:]:
+            if (
+                prompt_mask is not None
+                and isinstance(module, models.Pooling)
+                and not module.include_prompt
+            ):
+                out_features["attention_mask"] = self._mask_prompt(
+                    out_features["attention_mask"], prompt_mask
+                )
+            out_features = module(out_features)
+        if OutputMode.SPARSE.value in output_modes:
+            out_features["sparse_embedding"] = self._sparse_weights(out_features)
+        return out_features
+
+    @staticmethod
+    def _mask_prompt(attention_mask: Tensor, prompt_mask: Tensor) -> Tensor:
+        """Excludes the prompt tokens from an attention mask, possibly padded further.
+
+        Args:
+            attention_mask (Tensor): The attention mask.
+            prompt_mask (Tensor): The prompt tokens, over the first columns of the mask.
+
+        Returns:
+            Tensor: The attention mask without the prompt tokens.
+        """
+        mask = attention_mask.clone()
+        mask[:, : prompt_mask.shape[1]].masked_fill_(prompt_mask, 0)
+        return mask
+
+    def _sparse_weights(self, out_features: Dict[str, Tensor]) -> Tensor:
+        """Computes SPLADE vocabulary weights from the token embeddings.
+
+        Token embeddings are projected onto the vocabulary by the MLM head of the
+        checkpoint, activated with log(1 + relu(x)) and max-pooled over the
+        non-padding tokens.
+
+        Args:
+            out_features (Dict[str, Tensor]): Raw outputs from the model.
+
+        Raises:
+            ValueError: If the checkpoint has no trained MLM head.
+
+        Returns:
+            Tensor: Vocabulary weights of shape (batch, vocab_size).
+        """
+        head = self._load_mlm_head()
+        if head is None:
+            raise ValueError(
+                f"Sparse output is not supported by {self.engine_args.model}."
+            )
+        token_embeddings = out_features["token_embeddings"]
+
+        mask = out_features["attention_mask"].unsqueeze(-1).to(token_embeddings.dtype)
+        weights = []
+        # One sequence at a time keeps the (seq_len, vocab_size) logits small.
+        for sequence, sequence_mask in zip(token_embeddings, mask):
+            logits = torch.log1p(torch.relu(head(sequence)))
+            weights.append((logits * sequence_mask).amax(dim=0))
+        return torch.stack(weights)
+
+    def _to_embedding_dtype(self, embeddings: np.ndarray) -> np.ndarray:
+        """Converts float embeddings to the configured embedding data type.
+
+        The embeddings are written once, converted, to a buffer of the output
+        pool of the embedder, recycled once the returned array and its views
+        are no longer referenced.
+
+        Args:
+            embeddings (np.ndarray): Float embeddings.
+
+        Returns:
+            np.ndarray: Embeddings in the specified numpy data type.
         """
-        embeddings: np.ndarray = out_features.detach().cpu().numpy()
         if self.embedding_dtype == EmbeddingDtype.BINARY.value:
-            return (embeddings > 0).astype(np.uint8)
+            out = self.output_buffers.take(embeddings.shape, np.uint8)
+            np.greater(embeddings, 0, out=out.view(np.bool_))
         elif self.embedding_dtype == EmbeddingDtype.FLOAT16.value:
-            return embeddings.astype(np.float16)
+            out = self.output_buffers.take(embeddings.shape, np.float16)
+            np.copyto(out, embeddings, casting="same_kind")
         elif self.embedding_dtype == EmbeddingDtype.FLOAT32.value:
-            return embeddings.astype(np.float32)
+            out = self.output_buffers.take(embeddings.shape, np.float32)
+            np.copyto(out, embeddings, casting="same_kind")
         else:
             raise ValueError(f"Unsupported dtype: {self.embedding_dtype}")
+        return out
+
+    async def postprocess(
+        self,
+        out_features: Dict[str, Tensor],
+        output_mode: str = OutputMode.DENSE.value,
+    ) -> EmbeddingOutput:
+        """Converts the output tensors to numpy arrays of the specified data type.
+
+        Multi-vector outputs keep the L2-normalized embeddings of the non-padding
+        tokens, sparse outputs keep the `sparse_top_k` largest non-zero vocabulary
+        weights. Both are returned as flat arrays with per-input offsets.
+
+        Args:
+            out_features (Dict[str, Tensor]): Raw outputs from the model.
+            output_mode (str): Output mode to build the embeddings for.
+
+        Returns:
+            EmbeddingOutput: Postprocessed embeddings in the specified numpy array format.
+        """
+        if output_mode == OutputMode.DENSE.value:
+            embeddings: np.ndarray = (
+                out_features["sentence_embedding"].detach().cpu().numpy()
+            )
+            return self._to_embedding_dtype(embeddings)
+
+        with torch.inference_mode():
+            mask = out_features["attention_mask"].bool()
+            offsets = torch.zeros(mask.shape[0] + 1, dtype=torch.int64)
+            if output_mode == OutputMode.MULTI_VECTOR.value:
+                token_embeddings = out_features["token_embeddings"][mask]
+                token_embeddings = torch.nn.functional.normalize(
+                    token_embeddings, dim=-1
+                )
+                torch.cumsum(mask.sum(dim=1).cpu(), dim=0, out=offsets[1:])
+                return RaggedEmbeddings(
+                    values=self._to_embedding_dtype(token_embeddings.cpu().numpy()),
+                    offsets=offsets.numpy(),
+                )
+            elif output_mode == OutputMode.SPARSE.value:
+                weights = out_features["sparse_embedding"]
+                top_k = self.engine_args.sparse_top_k or weights.shape[1]
+                values, indices = torch.topk(
+                    weights, min(top_k, weights.shape[1]), dim=1
+                )
+                keep = values > 0
+                torch.cumsum(keep.sum(dim=1).cpu(), dim=0, out=offsets[1:])
+                return RaggedEmbeddings(
+                    values=values[keep].float().cpu().numpy(),
+                    offsets=offsets.numpy(),
+                    indices=indices[keep].to(torch.int32).cpu().numpy(),
+                )
+        raise ValueError(f"Unsupported output mode: {output_mode}")
+
+    @contextmanager
+    def _stage_timer(self, stage: str):
+        """Times a batch processing stage.
+
+        The duration goes to the stage latency histogram, and to the request
+        traces when the batch is traced.
 
-    async def process_batch(self, sentences: List[str]) -> Tuple[np.ndarray, List[int]]:
+        Args:
+            stage (str): Name of the stage, e.g. `tokenize` or `forward`.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            BATCH_STAGE_SECONDS.labels(
+                model=self.engine_args.served_model_name, stage=stage
+            ).observe(end - start)
+            record_stage(stage, start, end)
+
+    def _observe_tokens(
+        self,
+        features: Dict[str, Tensor],
+        segments: Optional[
+            Sequence[Tuple["SentenceTransformerEmbedder", int, Sequence[str]]]
+        ] = None,
+    ):
+        """Records the token count and padding ratio of a tokenized batch.
+
+        The rows of every segment of a shared batch are recorded under the
+        name of their own embedder.
+
+        Args:
+            features (Dict[str, Tensor]): Tokenized features.
+            segments (Optional[Sequence[Tuple[SentenceTransformerEmbedder, int, Sequence[str]]]]):
+                The embedder, number of sentences and output modes of every segment,
+                None for a batch of this embedder only.
+        """
+        attention_mask = features.get("attention_mask")
+        if attention_mask is None:
+            return
+        if segments is None:
+            segments = ((self, attention_mask.shape[0], ()),)
+        start = 0
+        for embedder, count, _ in segments:
+            segment_mask = attention_mask[start : start + count]
+            start += count
+            if not segment_mask.numel():
+                continue
+            tokens = int(segment_mask.sum())
+            model = embedder.engine_args.served_model_name
+            BATCH_SIZE_TOKENS.labels(model=model).observe(tokens)
+            BATCH_PADDING_RATIO.labels(model=model).observe(
+                1 - tokens / segment_mask.numel()
+            )
+
+    async def process_batch(
+        self,
+        sentences: List[str],
+        output_modes: Sequence[str] = (OutputMode.DENSE.value,),
+    ) -> Tuple[Dict[str, EmbeddingOutput], List[int]]:
         """Processes a batch of sentences to generate embeddings.
 
         Args:
             sentences (List[str]): List of sentences to be embedded.
+            output_modes (Sequence[str]): Output modes to build from the forward pass.
 
         Returns:
-            Tuple[np.ndarray, List[int]]: Generated embeddings and lengths/shape of sentences.
+            Tuple[Dict[str, EmbeddingOutput], List[int]]: Generated embeddings by output mode
+                and lengths/shape of sentences.
         """
-        features, lengths = await self.preprocess(sentences)
-        features = await self.transfer_to_device(features)
-        out_features = await self.generate_embeddings(features)
-        embeddings = await self.postprocess(out_features)
+        with self._stage_timer("tokenize"):
+            features, lengths = await self.preprocess(sentences)
+        self._observe_tokens(features)
+        with self._stage_timer("transfer"):
+            features = await self.transfer_to_device(features)
+        with self._stage_timer("forward"):
+            out_features = await self.generate_embeddings(features, output_modes)
+        with self._stage_timer("postprocess"):
+            embeddings = {
+                output_mode: await self.postprocess(out_features, output_mode)
+                for output_mode in output_modes
+            }
         return embeddings, lengths  # type: ignore
+
+    async def process_shared_batch(
+        self,
+        sentences: List[str],
+        segments: Sequence[Tuple["SentenceTransformerEmbedder", int, Sequence[str]]],
+    ) -> List[Tuple[Dict[str, EmbeddingOutput], List[int]]]:
+        """Processes a batch spanning several embedders that share this backbone.
+
+        The sentences are tokenized and run through the shared backbone once,
+        then every segment goes through the head of its own embedder.
+
+        Args:
+            sentences (List[str]): List of sentences to be embedded, grouped by segment.
+            segments (Sequence[Tuple[SentenceTransformerEmbedder, int, Sequence[str]]]):
+                The embedder, number of sentences and output modes of every segment.
+
+        Returns:
+            List[Tuple[Dict[str, EmbeddingOutput], List[int]]]: Generated embeddings by
+                output mode and lengths/shape of sentences, for every segment.
+        """
+        with self._stage_timer("tokenize"):
+            features, lengths = await self.preprocess(sentences)
+        self._observe_tokens(features, segments)
+        with self._stage_timer("transfer"):
+            features = await self.transfer_to_device(features)
+        with self._stage_timer("forward"), torch.inference_mode():
+            with FORWARD_TRACER.trace():
+                backbone_features = self._run_backbone(features)
+
+        results = []
+        start = 0
+        for embedder, count, output_modes in segments:
+            stop = start + count
+            segment_features = {
+                key: (
+                    value[start:stop]
+                    if isinstance(value, Tensor) and value.dim() > 0
+                    else value
+                )
+                for key, value in backbone_features.items()
+            }
+            with embedder._stage_timer("head"), torch.inference_mode():
+                out_features = embedder._forward_head(segment_features, output_modes)
+            with embedder._stage_timer("postprocess"):
+                embeddings = {
+                    output_mode: await embedder.postprocess(out_features, output_mode)
+                    for output_mode in output_modes
+                }
+            results.append((embeddings, lengths[start:stop]))
+            start = stop
+        return results  # type: ignore
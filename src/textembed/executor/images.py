@@ -0,0 +1,95 @@
+"""Image decoding"""
+
+from __future__ import annotations
+
+import base64
+import binascii
+from dataclasses import dataclass
+from io import BytesIO
+from typing import TYPE_CHECKING, Optional, Tuple, Union
+
+# PIL and torch are imported on decoding, the API imports the types without them
+if TYPE_CHECKING:
+    from torch import Tensor
+
+
+class ImageTooLargeError(ValueError):
+    """Raised when an image exceeds the configured byte or pixel limits."""
+
+
+@dataclass
+class PreprocessedImage:
+    """An image already decoded, resized and normalized for a model.
+
+    Attributes:
+        pixel_values (Tensor): Pixel values of shape (channels, height, width).
+        size (Tuple[int, int]): Width and height of the original image.
+    """
+
+    pixel_values: Tensor
+    size: Tuple[int, int]
+
+
+def _target_edge(image_processor) -> Optional[int]:
+    """Shortest edge the image processor resizes images to, if known."""
+    size = getattr(image_processor, "size", None)
+    if isinstance(size, dict):
+        if "shortest_edge" in size:
+            return size["shortest_edge"]
+        if "height" in size and "width" in size:
+            return max(size["height"], size["width"])
+    elif isinstance(size, int):
+        return size
+    return None
+
+
+def decode_image(
+    data: Union[str, bytes],
+    image_processor,
+    max_bytes: int,
+    max_pixels: int,
+) -> PreprocessedImage:
+    """Decode an encoded image into the pixel values expected by a model.
+
+    JPEG images are decoded directly at a reduced scale that is still larger
+    than the model input, which is much faster than decoding them at full size.
+    The function is CPU bound and meant to run in a worker thread.
+
+    Args:
+        data (Union[str, bytes]): The base64 encoded or raw image file.
+        image_processor: The image processor of the model.
+        max_bytes (int): Maximum size of the image file, in bytes.
+        max_pixels (int): Maximum number of pixels of the image.
+
+    Raises:
+        ImageTooLargeError: If the image exceeds `max_bytes` or `max_pixels`.
+        ValueError: If the base64 encoding is invalid.
+        OSError: If the image cannot be decoded.
+
+    Returns:
+        PreprocessedImage: The pixel values and original size of the image.
+    """
+    from PIL import Image
+
+    if isinstance(data, str):
+        if len(data) * 3 // 4 > max_bytes + 2:
+            raise ImageTooLargeError(f"Images must not exceed {max_bytes} bytes.")
+        try:
+            data = base64.b64decode(data, validate=True)
+        except binascii.Error as e:
+            raise ValueError(f"Invalid base64 image: {e}") from e
+    if len(data) > max_bytes:
+        raise ImageTooLargeError(f"Images must not exceed {max_bytes} bytes.")
+
+    # Only the header is read here, the pixels are decoded on conversion
+    image = Image.open(BytesIO(data))
+    size = image.size
+    if size[0] * size[1] > max_pixels:
+        raise ImageTooLargeError(f"Images must not exceed {max_pixels} pixels.")
+    target_edge = _target_edge(image_processor)
+    if image.format == "JPEG" and target_edge is not None:
+        image.draft("RGB", (target_edge, target_edge))
+    image = image.convert("RGB")
+
+    pixel_values = image_processor(image, return_tensors="pt")["pixel_values"][0]
+    return PreprocessedImage(pixel_values=pixel_values, size=size)
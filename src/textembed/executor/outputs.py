@@ -0,0 +1,60 @@
+"""Ragged embedding outputs"""
+
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+
+@dataclass
+class RaggedEmbeddings:
+    """A batch of variable-length embeddings stored in flat contiguous arrays.
+
+    The rows of input `i` are `values[offsets[i]:offsets[i + 1]]`. Multi-vector
+    outputs store one token embedding per row in a 2-dimensional `values` array.
+    Sparse outputs store one non-zero weight per row in `values` and its
+    vocabulary id in `indices`.
+
+    Attributes:
+        values (np.ndarray): Concatenated rows of every input.
+        offsets (np.ndarray): Start of every input in `values`, followed by the total length.
+        indices (Optional[np.ndarray]): Vocabulary ids of sparse values, None for multi-vector outputs.
+    """
+
+    values: np.ndarray
+    offsets: np.ndarray
+    indices: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, key: slice) -> "RaggedEmbeddings":
+        """Return the embeddings of a contiguous range of inputs as views.
+
+        Args:
+            key (slice): Range of inputs.
+
+        Returns:
+            RaggedEmbeddings: Embeddings of the inputs with offsets starting at 0.
+        """
+        start, stop, step = key.indices(len(self))
+        if step != 1:
+            raise ValueError("Ragged embeddings only support contiguous slices.")
+        offsets = self.offsets[start : max(start, stop) + 1]
+        begin, end = offsets[0], offsets[-1]
+        return RaggedEmbeddings(
+            values=self.values[begin:end],
+            offsets=offsets - begin,
+            indices=None if self.indices is None else self.indices[begin:end],
+        )
+
+    def to_dict(self) -> dict:
+        """Convert to a dictionary of numpy arrays, serializable by orjson.
+
+        Returns:
+            dict: The values, offsets and, for sparse outputs, indices.
+        """
+        data = {"values": self.values, "offsets": self.offsets}
+        if self.indices is not None:
+            data["indices"] = self.indices
+        return data
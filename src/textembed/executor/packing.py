@@ -0,0 +1,180 @@
+"""Packed transformer backbones"""
+
+from typing import Dict, List, Optional, Tuple
+
+import torch
+from sentence_transformers import models
+from torch import Tensor, nn
+
+from textembed.log import logger
+
+# Offset of the position ids of the first token, by supported model type
+_POSITION_OFFSETS = {
+    "bert": lambda config: 0,
+    "roberta": lambda config: config.pad_token_id + 1,
+    "xlm-roberta": lambda config: config.pad_token_id + 1,
+    "camembert": lambda config: config.pad_token_id + 1,
+}
+
+
+def pack_sequences(lengths: List[int], capacity: int) -> List[Tuple[int, int]]:
+    """Assign sequences to rows of `capacity` tokens, first-fit by decreasing length.
+
+    Args:
+        lengths (List[int]): Number of tokens of every sequence.
+        capacity (int): Number of tokens of a row, at least the longest length.
+
+    Returns:
+        List[Tuple[int, int]]: The row and the offset in the row of every sequence.
+    """
+    placements: List[Tuple[int, int]] = [(0, 0)] * len(lengths)
+    used: List[int] = []
+    for index in sorted(range(len(lengths)), key=lambda i: -lengths[i]):
+        length = lengths[index]
+        for row, tokens in enumerate(used):
+            if tokens + length <= capacity:
+                placements[index] = (row, tokens)
+                used[row] += length
+                break
+        else:
+            placements[index] = (len(used), 0)
+            used.append(length)
+    return placements
+
+
+class PackedBackbone:
+    """Runs a BERT-family backbone on sequences packed together without padding.
+
+    The sequences of a batch are packed into as few rows as possible, each
+    row as long as the longest sequence. A block-diagonal attention mask keeps
+    the sequences of a row from attending to each other, and the position ids
+    restart with every sequence. Every token of a row but the unused tail is
+    then real, so short sequences no longer pay for the padding of long ones.
+    The token embeddings are finally scattered back to the padded layout, for
+    the pooling and the other modules to run per sequence as usual.
+
+    Attributes:
+        backbone (models.Transformer): The backbone.
+    """
+
+    def __init__(self, backbone: models.Transformer) -> None:
+        """Wrap a backbone supported by `pack_backbone`.
+
+        Args:
+            backbone (models.Transformer): The backbone.
+        """
+        self.backbone = backbone
+        config = backbone.auto_model.config
+        self._position_offset = _POSITION_OFFSETS[config.model_type](config)
+        self._pad_token_id = config.pad_token_id or 0
+
+    def pack(self, features: Dict[str, Tensor]) -> Dict[str, Tensor]:
+        """Pack the tokens of padded features into rows.
+
+        Args:
+            features (Dict[str, Tensor]): Padded tokenized features.
+
+        Returns:
+            Dict[str, Tensor]: The packed `input_ids`, `token_type_ids` and
+                `position_ids`, the block-diagonal `attention_mask` of shape
+                (rows, tokens, tokens) and the `packed_index` of every real token
+                in the flattened rows.
+        """
+        attention_mask = features["attention_mask"].bool()
+        lengths = attention_mask.sum(dim=1).tolist()
+        capacity = attention_mask.shape[1]
+        placements = pack_sequences(lengths, capacity)
+        rows = max(row for row, _ in placements) + 1
+
+        # Flat position in the packed rows of every real token, in padded order
+        starts = torch.tensor([row * capacity + offset for row, offset in placements])
+        token_positions = torch.arange(capacity).expand_as(attention_mask)
+        packed_index = (starts[:, None] + token_positions)[attention_mask]
+
+        # Sequence of every packed token, -1 for the unused tails
+        sequence_ids = torch.full((rows * capacity,), -1, dtype=torch.int64)
+        sequence_ids[packed_index] = torch.arange(len(lengths)).repeat_interleave(
+            torch.tensor(lengths)
+        )
+        sequence_ids = sequence_ids.view(rows, capacity)
+
+        packed = {
+            "input_ids": features["input_ids"].new_full(
+                (rows * capacity,), self._pad_token_id
+            ),
+            "position_ids": torch.zeros(rows * capacity, dtype=torch.int64),
+        }
+        packed["input_ids"][packed_index] = features["input_ids"][attention_mask]
+        packed["position_ids"][packed_index] = token_positions[attention_mask]
+        packed["position_ids"] += self._position_offset
+        if "token_type_ids" in features:
+            packed["token_type_ids"] = torch.zeros(rows * capacity, dtype=torch.int64)
+            packed["token_type_ids"][packed_index] = features["token_type_ids"][
+                attention_mask
+            ]
+        packed = {name: tensor.view(rows, capacity) for name, tensor in packed.items()}
+        packed["attention_mask"] = (
+            sequence_ids[:, :, None] == sequence_ids[:, None, :]
+        ) & (sequence_ids[:, None, :] >= 0)
+        packed["packed_index"] = packed_index
+        return packed
+
+    def __call__(self, features: Dict[str, Tensor]) -> Dict[str, Tensor]:
+        """Compute the token embeddings, like the forward of the eager backbone.
+
+        Args:
+            features (Dict[str, Tensor]): Padded tokenized features.
+
+        Returns:
+            Dict[str, Tensor]: The features with the token embeddings.
+        """
+        packed = self.pack(features)
+        auto_model = self.backbone.auto_model
+        embeddings = auto_model.embeddings(
+            input_ids=packed["input_ids"],
+            position_ids=packed["position_ids"],
+            token_type_ids=packed.get("token_type_ids"),
+        )
+        # Additive mask broadcast over the attention heads
+        mask = torch.zeros(packed["attention_mask"].shape, dtype=embeddings.dtype)
+        mask.masked_fill_(~packed["attention_mask"], torch.finfo(embeddings.dtype).min)
+        hidden_states = auto_model.encoder(
+            embeddings, attention_mask=mask[:, None], return_dict=False
+        )[0]
+
+        attention_mask = features["attention_mask"].bool()
+        token_embeddings = hidden_states.new_zeros(
+            attention_mask.shape + hidden_states.shape[-1:]
+        )
+        token_embeddings[attention_mask] = hidden_states.flatten(0, 1)[
+            packed["packed_index"]
+        ]
+        features["token_embeddings"] = token_embeddings
+        return features
+
+
+def pack_backbone(backbone: nn.Module) -> Optional[PackedBackbone]:
+    """Get a packed version of a backbone, if supported.
+
+    Args:
+        backbone (nn.Module): The backbone.
+
+    Returns:
+        Optional[PackedBackbone]: The packed backbone, or None if the backbone is
+            not a supported BERT-family transformer.
+    """
+    auto_model = getattr(backbone, "auto_model", None)
+    if (
+        not isinstance(backbone, models.Transformer)
+        or auto_model is None
+        or auto_model.config.model_type not in _POSITION_OFFSETS
+        or auto_model.config.output_hidden_states
+        or getattr(auto_model.config, "position_embedding_type", "absolute")
+        != "absolute"
+    ):
+        logger.warning(
+            "Sequence packing is not supported by the %s backbone, it runs padded.",
+            type(getattr(backbone, "auto_model", backbone)).__name__,
+        )
+        return None
+    return PackedBackbone(backbone)
@@ -19,3 +19,50 @@ class EmbeddingDtype(Enum):
     FLOAT32 = "float32"
     FLOAT16 = "float16"
     BINARY = "binary"
+
+
+class IndexMode(Enum):
+    """
+    Enum representing the search modes supported by the in-memory vector index.
+
+    Attributes:
+        FLAT (str): Exhaustive brute-force search over every stored vector.
+        IVF (str): Inverted-file search that only scans the closest partitions.
+    """
+
+    FLAT = "flat"
+    IVF = "ivf"
+
+
+class OutputMode(Enum):
+    """
+    Enum representing the embedding outputs that can be requested from an engine.
+
+    Attributes:
+        DENSE (str): One pooled sentence embedding per input.
+        MULTI_VECTOR (str): One embedding per input token (ColBERT-style).
+        SPARSE (str): SPLADE-style vocabulary weights as (indices, values) pairs.
+    """
+
+    DENSE = "dense"
+    MULTI_VECTOR = "multi_vector"
+    SPARSE = "sparse"
+
+
+class EngineState(Enum):
+    """
+    Enum representing the load state of an engine model.
+
+    Attributes:
+        UNLOADED (str): The model is not in memory.
+        LOADING (str): The model is being loaded and warmed up.
+        READY (str): The model is loaded and serving requests.
+        UNLOADING (str): The model is finishing its queued requests before being unloaded.
+        FAILED (str): The last attempt to load the model failed.
+    """
+
+    UNLOADED = "unloaded"
+    LOADING = "loading"
+    READY = "ready"
+    UNLOADING = "unloading"
+    FAILED = "failed"
@@ -0,0 +1,101 @@
+"""Masked language modeling heads of sparse models"""
+
+import threading
+import weakref
+from typing import Optional
+
+from torch import nn
+from transformers import AutoModelForMaskedLM
+
+from textembed.log import logger
+
+# Heads of the backbones, None for the ones without a trained head
+_MLM_HEADS: "weakref.WeakKeyDictionary[nn.Module, Optional[nn.Module]]" = (
+    weakref.WeakKeyDictionary()
+)
+_LOCK = threading.Lock()
+
+
+def _load_mlm_head(backbone: nn.Module, **model_kwargs) -> Optional[nn.Module]:
+    """Load the trained masked language modeling head of the checkpoint of a backbone.
+
+    Only checkpoints saved with a `*ForMaskedLM` architecture, such as SPLADE
+    models, are considered, and only when the weights of their head are all
+    in the checkpoint. A head tied to the input embeddings is tied to the ones
+    of the backbone, so that the vocabulary projection is not held twice.
+    """
+    auto_model = getattr(backbone, "auto_model", None)
+    if auto_model is None:
+        return None
+    config = auto_model.config
+    if not any(
+        architecture.endswith("ForMaskedLM")
+        for architecture in getattr(config, "architectures", None) or []
+    ):
+        return None
+    try:
+        mlm_model, loading_info = AutoModelForMaskedLM.from_pretrained(
+            auto_model.name_or_path, output_loading_info=True, **model_kwargs
+        )
+    except (OSError, ValueError) as e:
+        logger.warning("Failed to load the MLM head of %s: %s", config.name_or_path, e)
+        return None
+    heads = {
+        name: module
+        for name, module in mlm_model.named_children()
+        if name != mlm_model.base_model_prefix
+    }
+    # Heads spread over several modules, as for DistilBERT, are not supported
+    if len(heads) != 1:
+        return None
+    name, head = next(iter(heads.items()))
+    if any(key.startswith(f"{name}.") for key in loading_info["missing_keys"]):
+        logger.warning(
+            "The checkpoint of %s has no trained MLM head.", config.name_or_path
+        )
+        return None
+
+    head.eval()
+    decoder = mlm_model.get_output_embeddings()
+    word_embeddings = auto_model.get_input_embeddings()
+    if (
+        getattr(config, "tie_word_embeddings", False)
+        and decoder is not None
+        and decoder.weight.shape == word_embeddings.weight.shape
+    ):
+        decoder.weight = word_embeddings.weight
+    return head
+
+
+def load_mlm_head(backbone: nn.Module, **model_kwargs) -> Optional[nn.Module]:
+    """Get the masked language modeling head of a backbone, loaded once per backbone.
+
+    Loading the head reads the checkpoint again, so it blocks and is left to
+    the first request for sparse outputs.
+
+    Args:
+        backbone (nn.Module): The transformer backbone.
+        **model_kwargs: Keyword arguments of `from_pretrained`, the ones the
+            backbone was loaded with.
+
+    Returns:
+        Optional[nn.Module]: The head projecting token embeddings onto the vocabulary,
+            None if the checkpoint has no trained head.
+    """
+    with _LOCK:
+        if backbone not in _MLM_HEADS:
+            _MLM_HEADS[backbone] = _load_mlm_head(backbone, **model_kwargs)
+        return _MLM_HEADS[backbone]
+
+
+def mlm_head(backbone: nn.Module) -> Optional[nn.Module]:
+    """Get the masked language modeling head of a backbone if it is loaded.
+
+    Args:
+        backbone (nn.Module): The transformer backbone.
+
+    Returns:
+        Optional[nn.Module]: The head, None if it is not loaded or the checkpoint
+            has no trained head.
+    """
+    return _MLM_HEADS.get(backbone)
@@ -0,0 +1,164 @@
+"""Pre-tokenized inputs and prompts"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence
+
+# torch is imported by the functions, the API imports the types without it
+if TYPE_CHECKING:
+    from torch import Tensor
+
+
+class InvalidTokenIdsError(ValueError):
+    """Raised when token ids are empty, out of the vocabulary or too long for a model."""
+
+
+class PromptNotFoundError(KeyError):
+    """Raised when a prompt name is not configured for a model."""
+
+
+@dataclass
+class TokenIds:
+    """A text already tokenized by the client.
+
+    Attributes:
+        input_ids (Tensor): Token ids of shape (tokens,), special tokens included.
+        prompt_length (int): Number of leading tokens belonging to a prompt, with the
+            leading special tokens.
+    """
+
+    input_ids: Tensor
+    prompt_length: int = 0
+
+
+@dataclass
+class PromptedText:
+    """A text to be prefixed with the token ids of a prompt once tokenized.
+
+    Attributes:
+        text (str): The text.
+        prompt_ids (Tensor): Token ids of the prompt, without special tokens.
+    """
+
+    text: str
+    prompt_ids: Tensor
+
+
+def to_token_ids(
+    inputs: Sequence[Sequence[int]],
+    vocab_size: int,
+    max_seq_length: int,
+    reserved: int = 0,
+) -> List[TokenIds]:
+    """Validate token id inputs and convert them to tensors.
+
+    Args:
+        inputs (Sequence[Sequence[int]]): Token ids of every input.
+        vocab_size (int): Number of tokens of the vocabulary of the model.
+        max_seq_length (int): Maximum number of tokens of an input.
+        reserved (int): Number of tokens of `max_seq_length` taken by a prompt.
+
+    Raises:
+        InvalidTokenIdsError: If an input is empty, longer than `max_seq_length`
+            or has ids out of the vocabulary.
+
+    Returns:
+        List[TokenIds]: The inputs.
+    """
+    import torch
+
+    token_ids = []
+    for index, ids in enumerate(inputs):
+        if not ids:
+            raise InvalidTokenIdsError(f"Input {index} has no token ids.")
+        if len(ids) > max_seq_length - reserved:
+            raise InvalidTokenIdsError(
+                f"Input {index} has {len(ids)} tokens, more than the "
+                f"{max_seq_length - reserved} tokens the model accepts"
+                + (f" after a prompt of {reserved} tokens." if reserved else ".")
+            )
+        if min(ids) < 0 or max(ids) >= vocab_size:
+            raise InvalidTokenIdsError(
+                f"Input {index} has token ids out of the vocabulary of "
+                f"{vocab_size} tokens."
+            )
+        token_ids.append(TokenIds(torch.tensor(ids, dtype=torch.int64)))
+    return token_ids
+
+
+def splice_prompt(
+    input_ids: Tensor,
+    prompt_ids: Tensor,
+    leading: int,
+    trailing: int,
+    max_length: int,
+) -> Tensor:
+    """Insert the token ids of a prompt after the leading special tokens of an input.
+
+    The input is truncated, its trailing special tokens kept, so the result
+    fits in `max_length` tokens.
+
+    Args:
+        input_ids (Tensor): Token ids of the input, special tokens included.
+        prompt_ids (Tensor): Token ids of the prompt, without special tokens.
+        leading (int): Number of special tokens before the text.
+        trailing (int): Number of special tokens after the text.
+        max_length (int): Maximum number of tokens of the result.
+
+    Returns:
+        Tensor: The token ids of the prompted input.
+    """
+    import torch
+
+    end = input_ids.shape[0] - trailing
+    room = max(max_length - leading - trailing - prompt_ids.shape[0], 0)
+    return torch.cat(
+        [
+            input_ids[:leading],
+            prompt_ids,
+            input_ids[leading:end][:room],
+            input_ids[end:],
+        ]
+    )
+
+
+def pad_token_ids(
+    rows: Sequence[Tensor],
+    pad_token_id: int,
+    padding_side: str = "right",
+    with_token_type_ids: bool = False,
+    prompt_lengths: Optional[Sequence[int]] = None,
+) -> Dict[str, Tensor]:
+    """Pad token id rows into the features returned by a tokenizer.
+
+    Args:
+        rows (Sequence[Tensor]): Token ids of every input.
+        pad_token_id (int): Token id of the padding.
+        padding_side (str): Side of the padding, `right` or `left`.
+        with_token_type_ids (bool): Whether to add all-zero `token_type_ids`.
+        prompt_lengths (Optional[Sequence[int]]): Number of leading prompt tokens of
+            every input, marked in a `prompt_mask` when given.
+
+    Returns:
+        Dict[str, Tensor]: The `input_ids`, `attention_mask` and optionally
+            `token_type_ids` and `prompt_mask` of shape (inputs, longest input).
+    """
+    import torch
+
+    length = max(row.shape[0] for row in rows)
+    input_ids = torch.full((len(rows), length), pad_token_id, dtype=torch.int64)
+    attention_mask = torch.zeros((len(rows), length), dtype=torch.int64)
+    prompt_mask = torch.zeros((len(rows), length), dtype=torch.bool)
+    for index, row in enumerate(rows):
+        start = length - row.shape[0] if padding_side == "left" else 0
+        input_ids[index, start : start + row.shape[0]] = row
+        attention_mask[index, start : start + row.shape[0]] = 1
+        if prompt_lengths is not None:
+            prompt_mask[index, start : start + prompt_lengths[index]] = True
+    features = {"input_ids": input_ids, "attention_mask": attention_mask}
+    if with_token_type_ids:
+        features["token_type_ids"] = torch.zeros_like(input_ids)
+    if prompt_lengths is not None:
+        features["prompt_mask"] = prompt_mask
+    return features
@@ -0,0 +1,5 @@
+"""Init index"""
+
+from textembed.index.vector_index import VectorIndex
+
+__all__ = ["VectorIndex"]
@@ -0,0 +1,448 @@
+"""In-memory vector index"""
+
+import json
+import os
+import shutil
+import threading
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from textembed.executor.primitives import EmbeddingDtype, IndexMode
+
+# Number of set bits for every possible byte value, used for Hamming distances.
+_POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+# Number of stored rows scored at once, bounds the temporary score matrix.
+_SEARCH_CHUNK_ROWS = 65536
+
+# Minimum number of training vectors per IVF partition before training kicks in.
+_IVF_MIN_POINTS_PER_LIST = 39
+
+# Suffixes of the directories a snapshot is written to and of the one it replaces.
+_TMP_SUFFIX = ".tmp"
+_OLD_SUFFIX = ".old"
+
+
+class VectorIndex:
+    """Contiguous, preallocated in-memory vector index.
+
+    Vectors are stored row-wise in a single numpy array whose layout follows the
+    engine `EmbeddingDtype`: float32 and float16 vectors are scored by inner
+    product with BLAS, binary vectors are bit-packed and scored by Hamming
+    distance. In IVF mode the vectors are partitioned with k-means once enough
+    of them are stored, and a search only scans the `nprobe` closest partitions.
+
+    Attributes:
+        embedding_dtype (str): Data type of the stored embeddings.
+        mode (str): Search mode, one of `IndexMode` values.
+        nlist (int): Number of IVF partitions.
+        nprobe (int): Number of IVF partitions scanned per query.
+        dim (Optional[int]): Embedding dimension, known after the first add.
+        ids (List[str]): External identifiers of the stored vectors.
+    """
+
+    def __init__(
+        self,
+        embedding_dtype: str = EmbeddingDtype.FLOAT32.value,
+        mode: str = IndexMode.FLAT.value,
+        capacity: int = 1024,
+        nlist: int = 64,
+        nprobe: int = 8,
+    ) -> None:
+        """Initialize an empty index.
+
+        Args:
+            embedding_dtype (str): Data type of the stored embeddings.
+            mode (str): Search mode, either `flat` or `ivf`.
+            capacity (int): Number of rows preallocated on the first add.
+            nlist (int): Number of IVF partitions.
+            nprobe (int): Number of IVF partitions scanned per query.
+        """
+        if embedding_dtype not in [dtype.value for dtype in EmbeddingDtype]:
+            raise ValueError(f"Unsupported embedding dtype: '{embedding_dtype}'.")
+        if mode not in [index_mode.value for index_mode in IndexMode]:
+            raise ValueError(f"Unsupported index mode: '{mode}'.")
+        self.embedding_dtype = embedding_dtype
+        self.mode = mode
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.dim: Optional[int] = None
+        self.ids: List[str] = []
+        self._initial_capacity = max(capacity, 1)
+        self._vectors: Optional[np.ndarray] = None
+        self._assignments: Optional[np.ndarray] = None
+        self._centroids: Optional[np.ndarray] = None
+        self._count = 0
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return self._count
+
+    @property
+    def is_binary(self) -> bool:
+        """Whether vectors are stored bit-packed and scored by Hamming distance."""
+        return self.embedding_dtype == EmbeddingDtype.BINARY.value
+
+    @property
+    def is_trained(self) -> bool:
+        """Whether the IVF partitions have been computed."""
+        return self._centroids is not None
+
+    def _storage_dtype(self) -> np.dtype:
+        if self.is_binary:
+            return np.dtype(np.uint8)
+        return np.dtype(self.embedding_dtype)
+
+    def _row_width(self) -> int:
+        assert self.dim is not None
+        return (self.dim + 7) // 8 if self.is_binary else self.dim
+
+    def _encode(self, embeddings: np.ndarray) -> np.ndarray:
+        """Convert engine embeddings to the storage layout."""
+        if self.is_binary:
+            return np.packbits(embeddings > 0, axis=1)
+        return np.ascontiguousarray(embeddings, dtype=self._storage_dtype())
+
+    def _decode(self, rows: np.ndarray) -> np.ndarray:
+        """Convert stored rows to float32 vectors for IVF partitioning."""
+        if self.is_binary:
+            bits = np.unpackbits(rows, axis=1, count=self.dim)
+            return bits.astype(np.float32) * 2.0 - 1.0
+        return rows.astype(np.float32)
+
+    def _reserve(self, required: int) -> None:
+        """Grow the preallocated storage so it can hold `required` rows.
+
+        Capacity doubles on every growth so appends stay amortized O(1). A
+        read-only memory-mapped snapshot is copied into memory on its first growth.
+        """
+        capacity = 0 if self._vectors is None else self._vectors.shape[0]
+        if self._vectors is not None and required <= capacity:
+            if self._vectors.flags.writeable:
+                return
+        new_capacity = max(self._initial_capacity, capacity)
+        while new_capacity < required:
+            new_capacity *= 2
+
+        vectors = np.empty((new_capacity, self._row_width()), self._storage_dtype())
+        assignments = np.full(new_capacity, -1, dtype=np.int32)
+        if self._vectors is not None and self._count:
+            vectors[: self._count] = self._vectors[: self._count]
+            assert self._assignments is not None
+            assignments[: self._count] = self._assignments[: self._count]
+        self._vectors = vectors
+        self._assignments = assignments
+
+    def add(self, embeddings: np.ndarray, ids: Optional[List[str]] = None) -> List[str]:
+        """Append embeddings to the index.
+
+        Args:
+            embeddings (np.ndarray): Embeddings of shape (n, dim) as produced by the engine.
+            ids (Optional[List[str]]): Identifiers of the embeddings. Defaults to their row numbers.
+
+        Raises:
+            ValueError: If the shape or the number of ids does not match.
+
+        Returns:
+            List[str]: Identifiers of the added embeddings.
+        """
+        if embeddings.ndim != 2:
+            raise ValueError("Embeddings must be a 2-dimensional array.")
+        if ids is not None and len(ids) != embeddings.shape[0]:
+            raise ValueError("The number of ids must match the number of inputs.")
+
+        with self._lock:
+            if self.dim is None:
+                self.dim = int(embeddings.shape[1])
+            elif embeddings.shape[1] != self.dim:
+                raise ValueError(
+                    f"Embedding dimension {embeddings.shape[1]} does not match "
+                    f"the index dimension {self.dim}."
+                )
+
+            start, end = self._count, self._count + embeddings.shape[0]
+            if ids is None:
+                ids = [str(row) for row in range(start, end)]
+            self._reserve(end)
+            assert self._vectors is not None and self._assignments is not None
+            self._vectors[start:end] = self._encode(embeddings)
+            self.ids.extend(ids)
+            self._count = end
+
+            if self.mode == IndexMode.IVF.value:
+                if self.is_trained:
+                    self._assignments[start:end] = self._assign(
+                        self._decode(self._vectors[start:end])
+                    )
+                elif self._count >= self.nlist * _IVF_MIN_POINTS_PER_LIST:
+                    self.train()
+            return ids
+
+    def train(self, iterations: int = 10, seed: int = 0) -> None:
+        """Partition the stored vectors with k-means for IVF search.
+
+        Args:
+            iterations (int): Number of Lloyd iterations.
+            seed (int): Seed used to sample the initial centroids.
+        """
+        with self._lock:
+            if not self._count:
+                raise ValueError("Cannot train an empty index.")
+            assert self._vectors is not None and self._assignments is not None
+            rng = np.random.default_rng(seed)
+            nlist = min(self.nlist, self._count)
+            sample_size = min(self._count, nlist * 256)
+            sample_rows = np.sort(rng.choice(self._count, sample_size, replace=False))
+            sample = self._decode(self._vectors[sample_rows])
+
+            centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+            for _ in range(iterations):
+                labels = self._nearest_centroids(sample, centroids, 1)[:, 0]
+                for list_id in range(nlist):
+                    members = sample[labels == list_id]
+                    if len(members):
+                        centroids[list_id] = members.mean(axis=0)
+
+            self._centroids = centroids
+            for start in range(0, self._count, _SEARCH_CHUNK_ROWS):
+                end = min(start + _SEARCH_CHUNK_ROWS, self._count)
+                self._assignments[start:end] = self._assign(
+                    self._decode(self._vectors[start:end])
+                )
+
+    @staticmethod
+    def _nearest_centroids(
+        vectors: np.ndarray, centroids: np.ndarray, count: int
+    ) -> np.ndarray:
+        """Return the `count` closest centroids (L2) of every vector."""
+        distances = (centroids**2).sum(axis=1) - 2.0 * (vectors @ centroids.T)
+        count = min(count, centroids.shape[0])
+        nearest = np.argpartition(distances, count - 1, axis=1)[:, :count]
+        return nearest
+
+    def _assign(self, vectors: np.ndarray) -> np.ndarray:
+        assert self._centroids is not None
+        return self._nearest_centroids(vectors, self._centroids, 1)[:, 0]
+
+    def _score(self, rows: np.ndarray, queries: np.ndarray) -> np.ndarray:
+        """Score stored rows against encoded queries, higher is better.
+
+        Returns:
+            np.ndarray: Scores of shape (len(queries), len(rows)).
+        """
+        if self.is_binary:
+            xor = np.bitwise_xor(queries[:, None, :], rows[None, :, :])
+            return -_POPCOUNT_TABLE[xor].sum(axis=2, dtype=np.int32)
+        if rows.dtype != np.float32:
+            rows = rows.astype(np.float32)
+        return queries @ rows.T
+
+    @staticmethod
+    def _merge_top_k(
+        best_scores: Optional[np.ndarray],
+        best_rows: Optional[np.ndarray],
+        scores: np.ndarray,
+        rows: np.ndarray,
+        top_k: int,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Merge a scored chunk into the running top-k of every query."""
+        if best_scores is not None and best_rows is not None:
+            scores = np.concatenate([best_scores, scores], axis=1)
+            rows = np.concatenate([best_rows, rows], axis=1)
+        if scores.shape[1] > top_k:
+            keep = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+            scores = np.take_along_axis(scores, keep, axis=1)
+            rows = np.take_along_axis(rows, keep, axis=1)
+        return scores, rows
+
+    def search(
+        self, queries: np.ndarray, top_k: int = 10
+    ) -> List[List[Tuple[str, float]]]:
+        """Find the nearest stored vectors of every query.
+
+        Args:
+            queries (np.ndarray): Query embeddings of shape (n, dim) as produced by the engine.
+            top_k (int): Number of results per query.
+
+        Returns:
+            List[List[Tuple[str, float]]]: For every query, the (id, score) pairs of its
+                closest vectors, best first. The score is the inner product for float
+                indexes and the Hamming distance for binary ones.
+        """
+        with self._lock:
+            if not self._count:
+                return [[] for _ in range(len(queries))]
+            assert self._vectors is not None and self._assignments is not None
+            if queries.shape[1] != self.dim:
+                raise ValueError(
+                    f"Query dimension {queries.shape[1]} does not match "
+                    f"the index dimension {self.dim}."
+                )
+            encoded = self._encode(queries)
+            if not self.is_binary:
+                encoded = encoded.astype(np.float32, copy=False)
+            top_k = min(top_k, self._count)
+
+            if self.mode == IndexMode.IVF.value and self.is_trained:
+                probes = self._nearest_centroids(
+                    self._decode(encoded), self._centroids, self.nprobe  # type: ignore
+                )
+                candidates_per_query = [
+                    np.flatnonzero(np.isin(self._assignments[: self._count], probe))
+                    for probe in probes
+                ]
+            else:
+                candidates_per_query = None
+
+            results = []
+            if candidates_per_query is None:
+                best_scores, best_rows = None, None
+                for start in range(0, self._count, _SEARCH_CHUNK_ROWS):
+                    end = min(start + _SEARCH_CHUNK_ROWS, self._count)
+                    scores = self._score(self._vectors[start:end], encoded)
+                    rows = np.broadcast_to(np.arange(start, end), scores.shape)
+                    best_scores, best_rows = self._merge_top_k(
+                        best_scores, best_rows, scores, rows, top_k
+                    )
+                assert best_scores is not None and best_rows is not None
+                for scores, rows in zip(best_scores, best_rows):
+                    results.append(self._format_hits(scores, rows))
+            else:
+                for query, candidates in zip(encoded, candidates_per_query):
+                    scores = self._score(self._vectors[candidates], query[None, :])[0]
+                    k = min(top_k, len(candidates))
+                    keep = np.argpartition(-scores, k - 1)[:k] if k else candidates[:0]
+                    results.append(self._format_hits(scores[keep], candidates[keep]))
+            return results
+
+    def _format_hits(
+        self, scores: np.ndarray, rows: np.ndarray
+    ) -> List[Tuple[str, float]]:
+        order = np.argsort(-scores, kind="stable")
+        if self.is_binary:
+            return [(self.ids[rows[i]], float(-scores[i])) for i in order]
+        return [(self.ids[rows[i]], float(scores[i])) for i in order]
+
+    def save(self, path: str) -> None:
+        """Write a snapshot of the index to a directory.
+
+        The snapshot is written to a sibling directory that is then renamed
+        into place, so a crash never leaves a snapshot with files of two
+        versions. The previous snapshot is moved aside just before the rename
+        and removed after it; an index memory-mapped from it stays readable.
+
+        Args:
+            path (str): Directory to write the snapshot into.
+        """
+        path = os.path.normpath(path)
+        tmp_dir, old_dir = path + _TMP_SUFFIX, path + _OLD_SUFFIX
+        with self._lock:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            os.makedirs(tmp_dir)
+            arrays = {}
+            if self._vectors is not None:
+                assert self._assignments is not None
+                arrays["vectors"] = self._vectors[: self._count]
+                arrays["assignments"] = self._assignments[: self._count]
+            if self._centroids is not None:
+                arrays["centroids"] = self._centroids
+            for name, array in arrays.items():
+                np.save(os.path.join(tmp_dir, f"{name}.npy"), array)
+
+            meta = {
+                "embedding_dtype": self.embedding_dtype,
+                "mode": self.mode,
+                "nlist": self.nlist,
+                "nprobe": self.nprobe,
+                "dim": self.dim,
+                "ids": self.ids,
+            }
+            with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+
+            if os.path.isdir(path):
+                shutil.rmtree(old_dir, ignore_errors=True)
+                os.replace(path, old_dir)
+            os.replace(tmp_dir, path)
+            shutil.rmtree(old_dir, ignore_errors=True)
+
+    @staticmethod
+    def snapshot_names(root: str) -> List[str]:
+        """List the names of the index snapshots written to a directory.
+
+        Snapshots being written are left out, and a snapshot whose replacement
+        was interrupted between its two renames is listed under its own name.
+
+        Args:
+            root (str): Directory the snapshots are written to.
+
+        Returns:
+            List[str]: The names of the snapshots, sorted.
+        """
+        names = set()
+        for name in os.listdir(root):
+            if name.endswith(_TMP_SUFFIX):
+                continue
+            names.add(name[: -len(_OLD_SUFFIX)] if name.endswith(_OLD_SUFFIX) else name)
+        return sorted(names)
+
+    @classmethod
+    def load(cls, path: str, embedding_dtype: Optional[str] = None) -> "VectorIndex":
+        """Load an index snapshot, memory-mapping the stored vectors.
+
+        The vectors stay on disk and are paged in on demand until the next add,
+        which copies them into a writable in-memory array.
+
+        Args:
+            path (str): Directory the snapshot was written to.
+            embedding_dtype (Optional[str]): Data type of the embeddings of the engine
+                adopting the index, not checked when None.
+
+        Raises:
+            ValueError: If the files of the snapshot are inconsistent, or the
+                embeddings are not of the `embedding_dtype` data type.
+
+        Returns:
+            VectorIndex: The loaded index.
+        """
+        path = os.path.normpath(path)
+        if not os.path.isdir(path) and os.path.isdir(path + _OLD_SUFFIX):
+            path += _OLD_SUFFIX
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if embedding_dtype is not None and meta["embedding_dtype"] != embedding_dtype:
+            raise ValueError(
+                f"The snapshot {path} stores {meta['embedding_dtype']} embeddings, "
+                f"not {embedding_dtype} ones."
+            )
+        index = cls(
+            embedding_dtype=meta["embedding_dtype"],
+            mode=meta["mode"],
+            nlist=meta["nlist"],
+            nprobe=meta["nprobe"],
+        )
+        index.dim = meta["dim"]
+        index.ids = meta["ids"]
+        vectors_path = os.path.join(path, "vectors.npy")
+        if os.path.exists(vectors_path):
+            index._vectors = np.load(vectors_path, mmap_mode="r")
+            index._assignments = np.load(
+                os.path.join(path, "assignments.npy"), mmap_mode="r"
+            )
+            index._count = index._vectors.shape[0]
+            if (
+                index._assignments.shape[0] != index._count
+                or index._vectors.shape[1:] != (index._row_width(),)
+                or index._vectors.dtype != index._storage_dtype()
+            ):
+                raise ValueError(f"The arrays of the snapshot {path} do not match.")
+        if len(index.ids) != index._count:
+            raise ValueError(
+                f"The snapshot {path} has {len(index.ids)} ids "
+                f"for {index._count} vectors."
+            )
+        centroids_path = os.path.join(path, "centroids.npy")
+        if os.path.exists(centroids_path):
+            index._centroids = np.load(centroids_path)
+        return index
@@ -1,9 +1,17 @@
 """Module used for logging"""
 
+import atexit
 import logging
+import os
+import queue
+import random
 import sys
+from datetime import datetime, timezone
 from enum import Enum
-from typing import Any
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, Optional
+
+import orjson
 
 # Clear any existing handlers to avoid duplicate log messages
 logging.getLogger().handlers.clear()
@@ -36,16 +44,191 @@ LOG_LEVELS: dict[str, int] = {
 # Define log format
 LOG_FORMAT = "%(asctime)s %(name)s %(levelname)s: %(message)s"
 
-# Configure root logger with default level, format, and handlers
-logging.basicConfig(
-    level=logging.INFO,
-    format=LOG_FORMAT,
-    handlers=log_handlers,
+# Attributes of every record, the other ones were passed as `extra`
+_RECORD_ATTRIBUTES = frozenset(vars(logging.makeLogRecord({}))) | {
+    "message",
+    "asctime",
+}
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as JSON lines, with the attributes passed as `extra`."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        """Format a record as a JSON object.
+
+        Args:
+            record (logging.LogRecord): The record.
+
+        Returns:
+            str: The JSON object.
+        """
+        data = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                data[key] = value
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        return orjson.dumps(data, default=str).decode()
+
+
+class _MergingQueueHandler(QueueHandler):
+    """Queue handler leaving the formatting of the records to the listener thread.
+
+    Only the arguments are merged into the message, so that the record holds
+    no reference to objects the caller may change. Unlike `QueueHandler`, the
+    record is not formatted and keeps its exception for the formatter.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+for handler in log_handlers:
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+# Records are queued by the logging threads and emitted by a listener thread,
+# which keeps the formatting and terminal rendering off the event loop
+_queue_handler = _MergingQueueHandler(queue.SimpleQueue())
+_listener = QueueListener(
+    _queue_handler.queue, *log_handlers, respect_handler_level=True
 )
 
+# Configure root logger with default level and the queue handler
+logging.basicConfig(level=logging.INFO, handlers=[_queue_handler])
+_listener.start()
+atexit.register(_listener.stop)
+
+
+def _restart_listener():
+    """Start a listener in a forked process, where the one of the parent is not running."""
+    global _listener
+    _queue_handler.queue = queue.SimpleQueue()
+    _listener = QueueListener(
+        _queue_handler.queue, *_listener.handlers, respect_handler_level=True
+    )
+    _listener.start()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_listener)
+
 # Get logger instance for "textembed" namespace
 logger = logging.getLogger("textembed")
 
+# Share of the requests of every route that are logged, by route path
+_request_sampling: Dict[str, float] = {}
+
+
+def parse_sampling(spec: str) -> Dict[str, float]:
+    """Parse comma-separated request log sampling rates, e.g. '/v1/embedding=0.01'.
+
+    Args:
+        spec (str): The sampling rates by route path.
+
+    Raises:
+        ValueError: If a rate is not a number between 0 and 1.
+
+    Returns:
+        Dict[str, float]: The sampling rates by route path.
+    """
+    sampling = {}
+    for item in spec.split(","):
+        route, separator, rate = item.strip().rpartition("=")
+        if not separator or not route:
+            raise ValueError(f"Invalid request log sampling rate: '{item.strip()}'.")
+        sampling[route.strip()] = float(rate)
+    return sampling
+
+
+def configure_logging(
+    level: str = "info",
+    log_format: str = "text",
+    sampling: Optional[Dict[str, float]] = None,
+):
+    """Configure the level, output format and request sampling of the logs.
+
+    Args:
+        level (str): Level of the `textembed` logger, one of `LOG_LEVELS`.
+        log_format (str): Output format, `text` or `json` lines on stderr.
+        sampling (Optional[Dict[str, float]]): Share of the requests of a route
+            that are logged, by route path. Every request is logged by default.
+
+    Raises:
+        ValueError: If the level, format or a sampling rate is invalid.
+    """
+    if log_format not in ("text", "json"):
+        raise ValueError(
+            f"Unsupported log format: '{log_format}'. Choose from 'text' or 'json'."
+        )
+    for route, rate in (sampling or {}).items():
+        if not 0.0 <= rate <= 1.0:
+            raise ValueError(
+                f"The request log sampling rate of {route} must be between 0 and 1."
+            )
+    set_log_level(level)
+    if log_format == "json":
+        json_handler = logging.StreamHandler(sys.stderr)
+        json_handler.setFormatter(JsonFormatter())
+        _listener.handlers = (json_handler,)
+    _request_sampling.clear()
+    _request_sampling.update(sampling or {})
+
+
+def set_log_level(level: str):
+    """Change the level of the `textembed` logger.
+
+    Args:
+        level (str): The level, one of `LOG_LEVELS`.
+
+    Raises:
+        ValueError: If the level is unknown.
+    """
+    if level not in LOG_LEVELS:
+        raise ValueError(
+            f"Unsupported log level: '{level}'. Choose from {list(LOG_LEVELS)}."
+        )
+    logger.setLevel(LOG_LEVELS[level])
+
+
+def get_log_level() -> str:
+    """Get the level of the `textembed` logger.
+
+    Returns:
+        str: The level, one of `LOG_LEVELS`.
+    """
+    effective = logger.getEffectiveLevel()
+    return next(
+        (name for name, value in LOG_LEVELS.items() if value == effective),
+        logging.getLevelName(effective).lower(),
+    )
+
+
+def log_request(route: str, msg: str, *args):
+    """Log an INFO message about a request, for a sample of the requests of its route.
+
+    Requests that are not sampled cost no more than a random number. The
+    route and its sampling rate are added to the record, as JSON fields in
+    the `json` format.
+
+    Args:
+        route (str): Path of the route of the request, e.g. `/v1/embedding`.
+        msg (str): The message.
+        *args: The arguments of the message.
+    """
+    rate = _request_sampling.get(route, 1.0)
+    if rate < 1.0 and random.random() >= rate:
+        return
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(msg, *args, extra={"route": route, "sample_rate": rate})
+
 
 # Define an Enum for uvicorn log levels
 class UvicornLogLevels(Enum):
@@ -0,0 +1,99 @@
+"""Prometheus metrics
+
+With several server processes, the metrics of every process are written to
+the `PROMETHEUS_MULTIPROC_DIR` directory and aggregated when exported. The
+gauges then report the sum, or for the resident size of the models, shared
+by the processes, the largest value of the live processes.
+"""
+
+from prometheus_client import Counter, Gauge, Histogram
+
+MODEL_LOADS = Counter(
+    "textembed_model_loads_total",
+    "Number of times a model was loaded.",
+    ["model"],
+)
+MODEL_EVICTIONS = Counter(
+    "textembed_model_evictions_total",
+    "Number of times a model was unloaded to stay within the memory budget.",
+    ["model"],
+)
+MODEL_RESIDENT_BYTES = Gauge(
+    "textembed_model_resident_bytes",
+    "Size of the parameters and buffers of a loaded model, in bytes.",
+    ["model"],
+    multiprocess_mode="livemax",
+)
+
+_LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+BATCH_QUEUE_WAIT_SECONDS = Histogram(
+    "textembed_batch_queue_wait_seconds",
+    "Time a request waited in the queue before its batch was processed.",
+    ["model"],
+    buckets=_LATENCY_BUCKETS,
+)
+BATCH_SIZE_TEXTS = Histogram(
+    "textembed_batch_size_texts",
+    "Number of texts of the model in a processed batch.",
+    ["model"],
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048),
+)
+BATCH_SIZE_TOKENS = Histogram(
+    "textembed_batch_size_tokens",
+    "Number of non-padding tokens of the model in a processed batch.",
+    ["model"],
+    buckets=tuple(2**exponent for exponent in range(4, 18)),
+)
+BATCH_PADDING_RATIO = Histogram(
+    "textembed_batch_padding_ratio",
+    "Fraction of the tokens of a processed batch that are padding.",
+    ["model"],
+    buckets=(0.05, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 0.95),
+)
+BATCH_STAGE_SECONDS = Histogram(
+    "textembed_batch_stage_seconds",
+    "Time spent in a stage of batch processing: tokenize, transfer, forward or "
+    "postprocess. Batches shared by several models time their heads as head.",
+    ["model", "stage"],
+    buckets=_LATENCY_BUCKETS,
+)
+QUEUE_DEPTH = Gauge(
+    "textembed_queue_depth",
+    "Number of requests waiting in the queue.",
+    ["model"],
+    multiprocess_mode="livesum",
+)
+BATCH_WORKERS = Gauge(
+    "textembed_batch_workers",
+    "Number of batch processing workers.",
+    ["model"],
+    multiprocess_mode="livesum",
+)
+BATCH_WORKER_BUSY_SECONDS = Counter(
+    "textembed_batch_worker_busy_seconds_total",
+    "Time the batch processing workers spent processing batches. "
+    "Divide its rate by textembed_batch_workers for the worker utilization.",
+    ["model"],
+)
+OUTPUT_BUFFERS = Counter(
+    "textembed_output_buffers_total",
+    "Number of output buffers taken by processed batches, by whether they were "
+    "reused from the pool or allocated.",
+    ["model", "outcome"],
+)
@@ -0,0 +1,194 @@
+"""On-demand profiling"""
+
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Dict, List, Optional, Tuple
+
+_NULL_CONTEXT = nullcontext()
+
+
+class SamplingProfiler:
+    """Samples the Python stacks of every thread from a background thread.
+
+    Nothing runs until `start` is called, so the profiler costs nothing while
+    inactive. The samples are exported in the speedscope file format, one
+    profile per thread.
+
+    Attributes:
+        interval (float): Seconds between two samples.
+    """
+
+    def __init__(self, interval: float = 0.005) -> None:
+        """Initialize the profiler.
+
+        Args:
+            interval (float): Seconds between two samples.
+        """
+        self.interval = interval
+        self._frames: Dict[Tuple[str, str, int], int] = {}
+        self._samples: Dict[int, List[List[int]]] = {}
+        self._weights: Dict[int, List[float]] = {}
+        self._thread_names: Dict[int, str] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._duration = 0.0
+
+    def _frame_index(self, frame) -> int:
+        code = frame.f_code
+        key = (code.co_name, code.co_filename, code.co_firstlineno)
+        index = self._frames.get(key)
+        if index is None:
+            index = self._frames[key] = len(self._frames)
+        return index
+
+    def _sample(self, elapsed: float):
+        own_ident = threading.get_ident()
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self._frame_index(frame))
+                frame = frame.f_back
+            stack.reverse()
+            self._samples.setdefault(ident, []).append(stack)
+            self._weights.setdefault(ident, []).append(elapsed)
+
+    def _run(self):
+        start = last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            self._sample(now - last)
+            last = now
+            if len(self._thread_names) != threading.active_count():
+                self._thread_names.update(
+                    (thread.ident, thread.name) for thread in threading.enumerate()
+                )
+        self._duration = time.perf_counter() - start
+
+    def start(self):
+        """Start sampling in a background thread."""
+        self._thread_names = {
+            thread.ident: thread.name for thread in threading.enumerate()
+        }
+        self._thread = threading.Thread(
+            target=self._run, name="textembed-profiler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> dict:
+        """Stop sampling.
+
+        Returns:
+            dict: The samples in the speedscope file format.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        frames = sorted(self._frames.items(), key=lambda item: item[1])
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": "textembed",
+            "exporter": "textembed",
+            "shared": {
+                "frames": [
+                    {"name": name, "file": file, "line": line}
+                    for (name, file, line), _ in frames
+                ]
+            },
+            "profiles": [
+                {
+                    "type": "sampled",
+                    "name": self._thread_names.get(ident, f"thread-{ident}"),
+                    "unit": "seconds",
+                    "startValue": 0,
+                    "endValue": self._duration,
+                    "samples": samples,
+                    "weights": self._weights[ident],
+                }
+                for ident, samples in self._samples.items()
+            ],
+        }
+
+
+class ForwardTracer:
+    """Traces the next forward passes of the models with `torch.profiler`.
+
+    Forward passes are wrapped in `trace()`, which returns a shared no-op
+    context until a capture is requested with `arm`. The trace covers the
+    armed number of forward passes and is exported in the Chrome trace format.
+    """
+
+    def __init__(self) -> None:
+        """Initialize an inactive tracer."""
+        self._remaining = 0
+        self._profiler = None
+        self._trace: Optional[dict] = None
+
+    def trace(self):
+        """Context manager wrapping a forward pass."""
+        if not self._remaining:
+            return _NULL_CONTEXT
+        return self._record()
+
+    @contextmanager
+    def _record(self):
+        import torch
+
+        if self._profiler is None:
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if torch.cuda.is_available():
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            self._profiler = torch.profiler.profile(
+                activities=activities, record_shapes=True
+            )
+            self._profiler.start()
+        try:
+            with torch.profiler.record_function("textembed.forward"):
+                yield
+        finally:
+            self._remaining -= 1
+            if not self._remaining:
+                self._finish()
+
+    def _finish(self):
+        self._remaining = 0
+        if self._profiler is None:
+            return
+        self._profiler.stop()
+        fd, path = tempfile.mkstemp(suffix=".json")
+        os.close(fd)
+        try:
+            self._profiler.export_chrome_trace(path)
+            with open(path, encoding="utf-8") as f:
+                self._trace = json.load(f)
+        finally:
+            os.remove(path)
+            self._profiler = None
+
+    def arm(self, forward_passes: int):
+        """Trace the next forward passes.
+
+        Args:
+            forward_passes (int): Number of forward passes to trace.
+        """
+        self._trace = None
+        self._remaining = forward_passes
+
+    def collect(self) -> Optional[dict]:
+        """Stop tracing and return the trace of the forward passes done so far.
+
+        Returns:
+            Optional[dict]: The Chrome trace, or None if no forward pass ran.
+        """
+        self._finish()
+        trace, self._trace = self._trace, None
+        return trace
+
+
+FORWARD_TRACER = ForwardTracer()
@@ -1,16 +1,21 @@
 """To start the application using CLI."""
 
+import json
 import multiprocessing
+import os
+import shutil
+import tempfile
 import warnings
 from typing import Union
 
 import typer
-import uvicorn
 from typing_extensions import Annotated
 
-from textembed.api.errors import HandleExceptions
-from textembed.application.application import create_application
+from textembed.api.limits import RequestLimits
+from textembed.compression import CompressionConfig
 from textembed.engine.args import AsyncEngineArgs
+from textembed.log import configure_logging, parse_sampling
+from textembed.tracing import FileSpanExporter
 
 # Filter out all warnings
 warnings.filterwarnings("ignore")
@@ -31,6 +36,12 @@ def start_application(
             help="Comma-separated list of names under which the models will be served."
         ),
     ] = None,
+    pooling_modes: Annotated[
+        Union[str, None],
+        typer.Option(
+            help="Comma-separated list of pooling modes overriding the ones of the models, e.g. 'mean', 'cls'. Leave an entry empty to keep the model pooling."
+        ),
+    ] = None,
     trust_remote_code: Annotated[
         bool,
         typer.Option(help="Whether to trust remote code when loading the models."),
@@ -43,14 +54,42 @@ def start_application(
         int,
         typer.Option(help="The port number on which the application will run."),
     ] = 8000,
+    binary_port: Annotated[
+        Union[int, None],
+        typer.Option(
+            help="The port of the binary embedding protocol, for service-to-service calls. Disabled by default."
+        ),
+    ] = None,
     workers: Annotated[
         int,
         typer.Option(help="The number of worker processes."),
     ] = None,  # type: ignore
+    server_processes: Annotated[
+        int,
+        typer.Option(
+            help="The number of server processes. The models are loaded once and shared by the processes. Cannot be combined with --index_mode, --trace_file or --admin_key."
+        ),
+    ] = 1,
+    max_concurrent_batches: Annotated[
+        Union[int, None],
+        typer.Option(
+            help="The maximum number of batches running at once across all models. Defaults to the number of workers."
+        ),
+    ] = None,
     batch_size: Annotated[
         int,
         typer.Option(help="The batch size for processing requests."),
     ] = 32,
+    max_batch_tokens: Annotated[
+        Union[int, None],
+        typer.Option(
+            help="The maximum estimated number of tokens of a text batch. Unlimited by default."
+        ),
+    ] = None,
+    image_batch_size: Annotated[
+        int,
+        typer.Option(help="The maximum number of images of an image batch."),
+    ] = 16,
     embedding_dtype: Annotated[
         str,
         typer.Option(
@@ -63,6 +102,168 @@ def start_application(
             help="Your API key for authentication. Make sure to keep it secure. Do not share it with others."
         ),
     ] = None,
+    admin_key: Annotated[
+        Union[str, None],
+        typer.Option(
+            help="Admin key enabling the debugging endpoints, such as /debug/profile. Disabled by default."
+        ),
+    ] = None,
+    tracing: Annotated[
+        bool,
+        typer.Option(
+            help="Whether to trace the embedding requests and summarize their spans in a Server-Timing header."
+        ),
+    ] = False,
+    trace_file: Annotated[
+        Union[str, None],
+        typer.Option(
+            help="File the request spans are appended to as JSON lines. Enables tracing."
+        ),
+    ] = None,
+    lazy_load: Annotated[
+        bool,
+        typer.Option(
+            help="Whether to load each model on its first request instead of at startup."
+        ),
+    ] = False,
+    idle_ttl: Annotated[
+        Union[float, None],
+        typer.Option(
+            help="Seconds without requests after which a model is unloaded. Models stay loaded by default."
+        ),
+    ] = None,
+    memory_budget_mb: Annotated[
+        Union[int, None],
+        typer.Option(
+            help="Maximum memory of the loaded models in MiB. Models are then loaded on demand and the least recently used ones are unloaded."
+        ),
+    ] = None,
+    sparse_top_k: Annotated[
+        int,
+        typer.Option(
+            help="Maximum number of non-zero weights kept per sparse embedding. Keeps all of them when 0."
+        ),
+    ] = 256,
+    max_image_bytes: Annotated[
+        int,
+        typer.Option(help="Maximum size of an input image file, in bytes."),
+    ] = 20
+    * 1024
+    * 1024,
+    max_image_pixels: Annotated[
+        int,
+        typer.Option(help="Maximum number of pixels of an input image."),
+    ] = 64
+    * 1024
+    * 1024,
+    max_request_inputs: Annotated[
+        int,
+        typer.Option(
+            help="Maximum number of inputs of an embedding request. Unlimited when 0."
+        ),
+    ] = 16384,
+    max_request_bytes: Annotated[
+        int,
+        typer.Option(
+            help="Maximum size of an embedding request body, in bytes. Unlimited when 0."
+        ),
+    ] = 64
+    * 1024
+    * 1024,
+    max_input_chars: Annotated[
+        int,
+        typer.Option(
+            help="Maximum number of characters of a text input of an embedding request. Unlimited when 0."
+        ),
+    ] = 65536,
+    compression: Annotated[
+        Union[str, None],
+        typer.Option(
+            help="Comma-separated encodings the embedding responses are compressed with, negotiated with the Accept-Encoding header of the requests: 'gzip', 'zstd' (zstandard package) or 'br' (brotli package), each with an optional level, e.g. 'zstd:3,gzip:6'. Disabled by default."
+        ),
+    ] = None,
+    compression_min_bytes: Annotated[
+        int,
+        typer.Option(help="Minimum size of a compressed response body, in bytes."),
+    ] = 1024,
+    compile_mode: Annotated[
+        Union[str, None],
+        typer.Option(
+            help="Run the transformers through graphs compiled per input shape bucket. Choose from 'compile' (torch.compile) or 'trace' (TorchScript). Disabled by default."
+        ),
+    ] = None,
+    compile_batch_buckets: Annotated[
+        Union[str, None],
+        typer.Option(
+            help="Comma-separated batch sizes the inputs are padded to in compiled mode. Defaults to powers of two up to the batch size."
+        ),
+    ] = None,
+    compile_seq_buckets: Annotated[
+        Union[str, None],
+        typer.Option(
+            help="Comma-separated sequence lengths the inputs are padded to in compiled mode. Defaults to powers of two from 16 up to the model maximum."
+        ),
+    ] = None,
+    sequence_packing: Annotated[
+        bool,
+        typer.Option(
+            help="Whether to pack the texts of a batch into rows without padding, for BERT and RoBERTa family models."
+        ),
+    ] = False,
+    prompts: Annotated[
+        Union[str, None],
+        typer.Option(
+            help='JSON object of the named prompts of every served model, e.g. \'{"e5": {"query": "query: ", "passage": "passage: "}}\'. Requests select one with their prompt_name.'
+        ),
+    ] = None,
+    autotune: Annotated[
+        bool,
+        typer.Option(
+            help="Whether to choose the batch size and token limit of every model from startup measurements against --autotune_slo_ms."
+        ),
+    ] = False,
+    autotune_slo_ms: Annotated[
+        float,
+        typer.Option(
+            help="Maximum duration of a batch targeted by --autotune, in milliseconds."
+        ),
+    ] = 100.0,
+    autotune_profile: Annotated[
+        Union[str, None],
+        typer.Option(
+            help="File the autotuning measurements are saved to and reused from. Defaults to ~/.cache/textembed/autotune.json."
+        ),
+    ] = None,
+    log_level: Annotated[
+        str,
+        typer.Option(
+            help="Level of the server logs. Choose from 'critical', 'error', 'warning', 'info', 'debug' or 'trace'. Can be changed at runtime with PUT /debug/log_level."
+        ),
+    ] = "info",
+    log_format: Annotated[
+        str,
+        typer.Option(
+            help="Format of the server logs on stderr. Choose from 'text' or 'json' (one object per line)."
+        ),
+    ] = "text",
+    log_sampling: Annotated[
+        Union[str, None],
+        typer.Option(
+            help="Comma-separated shares of the requests logged per route path, e.g. '/v1/embedding=0.01,/v1/index/{name}/search=0.1'. Every request is logged by default."
+        ),
+    ] = None,
+    index_mode: Annotated[
+        Union[str, None],
+        typer.Option(
+            help="Enable the in-memory vector indexes. Choose from 'flat' or 'ivf'. Disabled by default."
+        ),
+    ] = None,
+    index_dir: Annotated[
+        Union[str, None],
+        typer.Option(
+            help="Directory where the vector index snapshots are loaded from and saved to."
+        ),
+    ] = None,
 ):
     """
     Starts the application with the specified configuration.
@@ -70,15 +271,54 @@ def start_application(
     Args:
         models (str): Comma-separated list of Huggingface models to be used.
         served_model_names (str): Comma-separated list of names under which the models will be served.
+        pooling_modes (str): Comma-separated list of pooling modes overriding the ones of the models.
         trust_remote_code (bool): Whether to trust remote code when loading the models.
         host (str): The host address on which the application will run.
         port (int): The port number on which the application will run.
+        binary_port (Union[int, None]): The port of the binary embedding protocol.
         workers (int): The number of worker processes.
+        server_processes (int): The number of server processes sharing the loaded models.
+        max_concurrent_batches (Union[int, None]): The maximum number of batches running at once across all models.
         batch_size (int): The batch size for processing requests.
+        max_batch_tokens (Union[int, None]): The maximum estimated number of tokens of a text batch.
+        image_batch_size (int): The maximum number of images of an image batch.
         embedding_dtype (str): The data type for the embeddings. Choose from 'binary', 'float16', or 'float32'.
         api_key Union[str, None]: Your API key for authentication. Make sure to keep it secure. Do not share it with others.
+        admin_key (Union[str, None]): Admin key enabling the debugging endpoints.
+        tracing (bool): Whether to trace the embedding requests.
+        trace_file (Union[str, None]): File the request spans are appended to as JSON lines.
+        lazy_load (bool): Whether to load each model on its first request instead of at startup.
+        idle_ttl (Union[float, None]): Seconds without requests after which a model is unloaded.
+        memory_budget_mb (Union[int, None]): Maximum memory of the loaded models in MiB.
+        sparse_top_k (int): Maximum number of non-zero weights kept per sparse embedding.
+        max_image_bytes (int): Maximum size of an input image file, in bytes.
+        max_image_pixels (int): Maximum number of pixels of an input image.
+        max_request_inputs (int): Maximum number of inputs of an embedding request, unlimited when 0.
+        max_request_bytes (int): Maximum size of an embedding request body in bytes, unlimited when 0.
+        max_input_chars (int): Maximum number of characters of a text input, unlimited when 0.
+        compression (Union[str, None]): Comma-separated encodings the embedding responses are compressed with.
+        compression_min_bytes (int): Minimum size of a compressed response body, in bytes.
+        compile_mode (Union[str, None]): Compile the transformers with 'compile' (torch.compile) or 'trace' (TorchScript).
+        compile_batch_buckets (Union[str, None]): Comma-separated batch sizes the inputs are padded to in compiled mode.
+        compile_seq_buckets (Union[str, None]): Comma-separated sequence lengths the inputs are padded to in compiled mode.
+        sequence_packing (bool): Whether to pack the texts of a batch into rows without padding.
+        prompts (Union[str, None]): JSON object of the named prompts of every served model.
+        autotune (bool): Whether to choose the batch limits of every model from startup measurements.
+        autotune_slo_ms (float): Maximum duration of a batch targeted by autotuning, in milliseconds.
+        autotune_profile (Union[str, None]): File the autotuning measurements are saved to and reused from.
+        log_level (str): Level of the server logs.
+        log_format (str): Format of the server logs, 'text' or 'json'.
+        log_sampling (Union[str, None]): Comma-separated shares of the requests logged per route path.
+        index_mode (Union[str, None]): Search mode of the in-memory vector indexes, 'flat' or 'ivf'.
+        index_dir (Union[str, None]): Directory where the vector index snapshots are loaded from and saved to.
     """
 
+    configure_logging(
+        level=log_level,
+        log_format=log_format,
+        sampling=parse_sampling(log_sampling) if log_sampling else None,
+    )
+
     # Split the models and served model names
     models_list = models.split(",")
     if served_model_names is None:
@@ -91,31 +331,146 @@ def start_application(
             "The number of models must match the number of served model names."
         )
 
+    if pooling_modes is None:
+        pooling_modes_list = [""] * len(models_list)
+    else:
+        pooling_modes_list = pooling_modes.split(",")
+    if len(models_list) != len(pooling_modes_list):
+        raise ValueError("The number of models must match the number of pooling modes.")
+
+    batch_buckets = (
+        tuple(int(bucket) for bucket in compile_batch_buckets.split(","))
+        if compile_batch_buckets
+        else None
+    )
+    seq_buckets = (
+        tuple(int(bucket) for bucket in compile_seq_buckets.split(","))
+        if compile_seq_buckets
+        else None
+    )
+
+    prompts_map = json.loads(prompts) if prompts else {}
+    if not isinstance(prompts_map, dict) or not all(
+        isinstance(model_prompts, dict)
+        and all(isinstance(prompt, str) for prompt in model_prompts.values())
+        for model_prompts in prompts_map.values()
+    ):
+        raise ValueError(
+            "Prompts must map served model names to objects of named prompts."
+        )
+    unknown_models = set(prompts_map) - {
+        name.strip() for name in served_model_names_list
+    }
+    if unknown_models:
+        raise ValueError(
+            f"Prompts are configured for models that are not served: {sorted(unknown_models)}."
+        )
+
+    if server_processes < 1:
+        raise ValueError("The number of server processes must be at least 1.")
+    if server_processes > 1:
+        # Every process would hold its own indexes, debugging state and trace
+        # buffer, which the other processes do not see
+        per_process_options = {
+            "--index_mode": index_mode,
+            "--trace_file": trace_file,
+            "--admin_key": admin_key,
+        }
+        conflicting = [name for name, value in per_process_options.items() if value]
+        if conflicting:
+            raise ValueError(
+                f"{', '.join(conflicting)} cannot be used with more than one server process."
+            )
+
     # Create a list of AsyncEngineArgs instances
     engine_args_list = []
     for idx, model in enumerate(models_list):
         engine_args = AsyncEngineArgs(
             model=model.strip(),
             served_model_name=served_model_names_list[idx].strip(),
+            pooling_mode=pooling_modes_list[idx].strip() or None,
             trust_remote_code=trust_remote_code,
             workers=workers if workers is not None else multiprocessing.cpu_count(),
             batch_size=batch_size,
+            max_batch_tokens=max_batch_tokens,
+            image_batch_size=image_batch_size,
             embedding_dtype=embedding_dtype,
+            lazy_load=lazy_load,
+            idle_ttl=idle_ttl,
+            sparse_top_k=sparse_top_k,
+            max_image_bytes=max_image_bytes,
+            max_image_pixels=max_image_pixels,
+            compile_mode=compile_mode,
+            compile_batch_buckets=batch_buckets,
+            compile_seq_buckets=seq_buckets,
+            sequence_packing=sequence_packing,
+            prompts=prompts_map.get(served_model_names_list[idx].strip()),
+            autotune=autotune,
+            autotune_slo_ms=autotune_slo_ms,
+            autotune_profile=autotune_profile,
+            index_mode=index_mode,
+            index_dir=index_dir,
         )
         engine_args_list.append(engine_args)
 
+    request_limits = RequestLimits(
+        max_inputs=max_request_inputs or None,
+        max_bytes=max_request_bytes or None,
+        max_input_chars=max_input_chars or None,
+    )
+    compression_config = (
+        CompressionConfig.from_spec(compression, min_bytes=compression_min_bytes)
+        if compression
+        else None
+    )
+
+    # The web framework is only imported once the configuration is checked,
+    # and the model libraries once the engines start. The processes write their
+    # metrics to a shared directory, set before the metrics are defined.
+    metrics_dir = None
+    if server_processes > 1 and "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        metrics_dir = tempfile.mkdtemp(prefix="textembed-metrics-")
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = metrics_dir
+    import uvicorn
+
+    from textembed.api.errors import HandleExceptions
+    from textembed.application.application import create_application
+    from textembed.application.processes import serve_processes
+    from textembed.engine.async_engine import preload_model
+
     # Create the application
     app = create_application(
         engine_args_list=engine_args_list,
         doc_extra={"host": host, "port": port},
         api_key=api_key,
+        admin_key=admin_key,
+        tracing=tracing,
+        span_exporter=FileSpanExporter(trace_file) if trace_file else None,
+        memory_budget=memory_budget_mb * 1024 * 1024 if memory_budget_mb else None,
+        max_concurrent_batches=max_concurrent_batches,
+        binary_port=binary_port,
+        reuse_port=server_processes > 1,
+        request_limits=request_limits,
+        compression=compression_config,
     )
 
     # Handle Errors
     HandleExceptions(app=app)
 
     # Run the application
-    uvicorn.run(app, host=host, port=port, log_level="error")
+    if server_processes > 1:
+        # Load the models once, the forked processes share them copy-on-write
+        if memory_budget_mb is None:
+            for engine_args in engine_args_list:
+                if not engine_args.lazy_load:
+                    preload_model(engine_args)
+        try:
+            serve_processes(app, host=host, port=port, processes=server_processes)
+        finally:
+            if metrics_dir is not None:
+                shutil.rmtree(metrics_dir, ignore_errors=True)
+    else:
+        uvicorn.run(app, host=host, port=port, log_level="error")
 
 
 if __name__ == "__main__":
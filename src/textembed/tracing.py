@@ -0,0 +1,286 @@
+"""Request tracing"""
+
+import json
+import queue
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+from uuid import uuid4
+
+from textembed.log import logger
+
+# Stages of the batch being processed by the current task, when it is traced
+BATCH_STAGES: ContextVar[Optional[List[Tuple[str, float, float]]]] = ContextVar(
+    "BATCH_STAGES", default=None
+)
+
+
+def new_id() -> str:
+    """Generate a random 64 bit span, trace or batch identifier."""
+    return uuid4().hex[:16]
+
+
+@dataclass
+class Span:
+    """A timed operation of a request.
+
+    Attributes:
+        name (str): Name of the operation.
+        trace_id (str): Identifier of the request trace.
+        span_id (str): Identifier of the span.
+        parent_id (Optional[str]): Identifier of the parent span.
+        start (float): Start time, in `time.perf_counter` seconds.
+        end (Optional[float]): End time, None while the span is open.
+        attributes (Dict[str, Any]): Additional details, such as the batch id.
+    """
+
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str]
+    start: float
+    end: Optional[float] = None
+    attributes: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def duration(self) -> float:
+        """Duration of the span in seconds, 0 while it is open."""
+        return 0.0 if self.end is None else self.end - self.start
+
+    def finish(self, end: Optional[float] = None):
+        """Close the span.
+
+        Args:
+            end (Optional[float]): End time. Defaults to now.
+        """
+        self.end = time.perf_counter() if end is None else end
+
+
+class Trace:
+    """The spans of a single request.
+
+    Attributes:
+        trace_id (str): Identifier of the trace.
+        root (Span): Span covering the whole request.
+        spans (List[Span]): Every span of the request, the root first.
+    """
+
+    def __init__(self, name: str, **attributes) -> None:
+        """Start a trace and its root span.
+
+        Args:
+            name (str): Name of the root span.
+            **attributes: Attributes of the root span.
+        """
+        self.trace_id = new_id()
+        # Wall clock of the root span start, to convert span times for exporters
+        self._epoch = time.time()
+        self.root = Span(
+            name=name,
+            trace_id=self.trace_id,
+            span_id=new_id(),
+            parent_id=None,
+            start=time.perf_counter(),
+            attributes=attributes,
+        )
+        self.spans: List[Span] = [self.root]
+
+    def add_span(
+        self,
+        name: str,
+        start: float,
+        end: Optional[float] = None,
+        parent: Optional[Span] = None,
+        **attributes,
+    ) -> Span:
+        """Record a span.
+
+        Args:
+            name (str): Name of the operation.
+            start (float): Start time, in `time.perf_counter` seconds.
+            end (Optional[float]): End time. The span stays open when None.
+            parent (Optional[Span]): Parent span. Defaults to the root span.
+            **attributes: Additional details of the span.
+
+        Returns:
+            Span: The recorded span.
+        """
+        span = Span(
+            name=name,
+            trace_id=self.trace_id,
+            span_id=new_id(),
+            parent_id=(parent or self.root).span_id,
+            start=start,
+            end=end,
+            attributes=attributes,
+        )
+        self.spans.append(span)
+        return span
+
+    def start_span(self, name: str, **attributes) -> Span:
+        """Open a span starting now. Open spans are closed with the trace."""
+        return self.add_span(name, time.perf_counter(), **attributes)
+
+    def finish(self):
+        """Close the root span and every span left open."""
+        end = time.perf_counter()
+        for span in self.spans:
+            if span.end is None:
+                span.finish(end)
+
+    def to_dicts(self) -> List[dict]:
+        """The spans with wall clock start and end times in unix nanoseconds."""
+        offset = self._epoch - self.root.start
+        spans = []
+        for span in self.spans:
+            data = asdict(span)
+            data["start"] = int((offset + span.start) * 1e9)
+            data["end"] = None if span.end is None else int((offset + span.end) * 1e9)
+            spans.append(data)
+        return spans
+
+    def server_timing(self) -> str:
+        """Summarize the spans as a `Server-Timing` header value.
+
+        Durations of spans sharing a name are added up, the root span is
+        reported as `total`.
+        """
+        durations: Dict[str, float] = {}
+        for span in self.spans[1:]:
+            durations[span.name] = durations.get(span.name, 0.0) + span.duration
+        durations["total"] = self.root.duration
+        return ", ".join(
+            f"{name};dur={duration * 1000:.3f}" for name, duration in durations.items()
+        )
+
+
+def record_stage(stage: str, start: float, end: float):
+    """Record a batch processing stage for the requests of a traced batch.
+
+    Args:
+        stage (str): Name of the stage, e.g. `tokenize` or `forward`.
+        start (float): Start time, in `time.perf_counter` seconds.
+        end (float): End time, in `time.perf_counter` seconds.
+    """
+    stages = BATCH_STAGES.get()
+    if stages is not None:
+        stages.append((stage, start, end))
+
+
+class SpanExporter(ABC):
+    """Base class of the span exporters."""
+
+    @abstractmethod
+    def export(self, trace: Trace):
+        """Export the spans of a finished request.
+
+        Args:
+            trace (Trace): The finished trace.
+        """
+
+    def shutdown(self):
+        """Flush and release the resources of the exporter."""
+
+
+class FileSpanExporter(SpanExporter):
+    """Appends the spans to a local file, one JSON object per line.
+
+    The traces are queued and written by a background thread, like the log
+    records, so that serializing and writing them stays off the event loop.
+    The file is flushed once the queued traces are written.
+
+    Attributes:
+        path (str): The file the spans are written to.
+    """
+
+    def __init__(self, path: str) -> None:
+        """Open the span file for appending and start the writer thread.
+
+        Args:
+            path (str): The file the spans are written to.
+        """
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8")
+        self._queue: "queue.SimpleQueue[Optional[Trace]]" = queue.SimpleQueue()
+        self._thread = threading.Thread(
+            target=self._write, name="textembed-spans", daemon=True
+        )
+        self._thread.start()
+
+    def export(self, trace: Trace):
+        self._queue.put(trace)
+
+    def _write(self):
+        """Write the queued traces until `shutdown`."""
+        while True:
+            trace = self._queue.get()
+            while trace is not None:
+                self._file.write(
+                    "".join(json.dumps(span) + "\n" for span in trace.to_dicts())
+                )
+                try:
+                    trace = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            self._file.flush()
+            if trace is None:
+                return
+
+    def shutdown(self):
+        self._queue.put(None)
+        self._thread.join()
+        self._file.close()
+
+
+class TracingMiddleware:
+    """ASGI middleware tracing the requests of the embedding apis.
+
+    A `Trace` is stored in the request state for the handlers to add their
+    spans. Spans still open when the response starts, such as serialization,
+    are closed then. The response carries a `Server-Timing` header summarizing
+    the spans, and the finished trace is handed to the exporter, if any.
+    """
+
+    def __init__(
+        self, app, exporter: Optional[SpanExporter] = None, prefix: str = "/v1/"
+    ) -> None:
+        """Wrap an ASGI application.
+
+        Args:
+            app: The ASGI application.
+            exporter (Optional[SpanExporter]): Exporter of the finished traces.
+            prefix (str): Path prefix of the traced requests.
+        """
+        self.app = app
+        self.exporter = exporter
+        self.prefix = prefix
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.prefix):
+            await self.app(scope, receive, send)
+            return
+
+        trace = Trace("request", method=scope["method"], path=scope["path"])
+        scope.setdefault("state", {})["trace"] = trace
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                trace.finish()
+                trace.root.attributes["status_code"] = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", trace.server_timing().encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            trace.finish()
+            if self.exporter is not None:
+                try:
+                    self.exporter.export(trace)
+                except Exception as e:
+                    logger.error("Failed to export trace %s: %s", trace.trace_id, e)
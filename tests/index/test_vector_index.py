@@ -0,0 +1,142 @@
+"""Tests of the in-memory vector index"""
+
+import json
+import os
+
+import numpy as np
+import pytest
+
+from textembed.index import VectorIndex
+
+
+def _normalized(rows: int, dim: int = 32, seed: int = 0) -> np.ndarray:
+    vectors = np.random.default_rng(seed).standard_normal((rows, dim))
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+@pytest.mark.parametrize("embedding_dtype", ["float32", "float16"])
+def test_flat_search_matches_brute_force(embedding_dtype):
+    vectors = _normalized(500)
+    index = VectorIndex(embedding_dtype=embedding_dtype, capacity=16)
+    index.add(vectors[:200])
+    index.add(vectors[200:], ids=[f"doc-{row}" for row in range(200, 500)])
+
+    queries = _normalized(5, seed=1)
+    results = index.search(queries, top_k=10)
+
+    # Queries and vectors are both rounded to the storage dtype
+    stored = vectors.astype(embedding_dtype).astype(np.float32)
+    rounded = queries.astype(embedding_dtype).astype(np.float32)
+    expected = np.argsort(-(rounded @ stored.T), axis=1, kind="stable")[:, :10]
+    ids = [str(row) for row in range(200)] + [f"doc-{row}" for row in range(200, 500)]
+    for hits, rows in zip(results, expected):
+        assert [hit_id for hit_id, _ in hits] == [ids[row] for row in rows]
+        scores = [score for _, score in hits]
+        assert scores == sorted(scores, reverse=True)
+
+
+def test_binary_search_ranks_by_hamming_distance():
+    vectors = _normalized(100)
+    index = VectorIndex(embedding_dtype="binary")
+    index.add(vectors)
+
+    hits = index.search(vectors[:3], top_k=5)
+    for row, query_hits in enumerate(hits):
+        assert query_hits[0] == (str(row), 0.0)
+        distances = [distance for _, distance in query_hits]
+        assert distances == sorted(distances)
+
+
+def test_ivf_search_finds_stored_vectors():
+    vectors = _normalized(2000)
+    index = VectorIndex(mode="ivf", nlist=8, nprobe=8)
+    index.add(vectors)
+
+    assert index.is_trained
+    hits = index.search(vectors[:20], top_k=1)
+    assert [query_hits[0][0] for query_hits in hits] == [str(row) for row in range(20)]
+
+
+def test_search_rejects_other_dimension():
+    index = VectorIndex()
+    index.add(_normalized(10))
+    with pytest.raises(ValueError):
+        index.search(_normalized(1, dim=16), top_k=1)
+
+
+@pytest.mark.parametrize(
+    "embedding_dtype,mode",
+    [("float32", "flat"), ("float16", "flat"), ("binary", "flat"), ("float32", "ivf")],
+)
+def test_snapshot_round_trip(tmp_path, embedding_dtype, mode):
+    vectors = _normalized(1000)
+    index = VectorIndex(embedding_dtype=embedding_dtype, mode=mode, nlist=4)
+    index.add(vectors, ids=[f"doc-{row}" for row in range(1000)])
+    path = str(tmp_path / "docs")
+    index.save(path)
+
+    loaded = VectorIndex.load(path, embedding_dtype=embedding_dtype)
+
+    assert len(loaded) == len(index)
+    assert loaded.ids == index.ids
+    assert loaded.is_trained == index.is_trained
+    queries = _normalized(3, seed=1)
+    assert loaded.search(queries, top_k=5) == index.search(queries, top_k=5)
+
+    # Adding to a memory-mapped snapshot copies it into memory
+    loaded.add(_normalized(2, seed=2), ids=["new-0", "new-1"])
+    assert len(loaded) == 1002
+    assert loaded.search(_normalized(2, seed=2), top_k=1)[0][0][0] == "new-0"
+
+
+def test_snapshot_replaces_the_previous_one(tmp_path):
+    path = str(tmp_path / "docs")
+    index = VectorIndex()
+    index.add(_normalized(10))
+    index.save(path)
+    loaded = VectorIndex.load(path)
+
+    index.add(_normalized(5, seed=1))
+    index.save(path)
+
+    assert sorted(os.listdir(tmp_path)) == ["docs"]
+    assert len(VectorIndex.load(path)) == 15
+    # The index memory-mapped from the replaced snapshot stays readable
+    assert len(loaded.search(_normalized(1), top_k=3)[0]) == 3
+
+
+def test_interrupted_snapshot_falls_back_to_the_previous_one(tmp_path):
+    path = str(tmp_path / "docs")
+    index = VectorIndex()
+    index.add(_normalized(10))
+    index.save(path)
+    # A crash between moving the previous snapshot aside and renaming the new one
+    os.replace(path, path + ".old")
+    os.makedirs(path + ".tmp")
+
+    assert VectorIndex.snapshot_names(str(tmp_path)) == ["docs"]
+    assert len(VectorIndex.load(path)) == 10
+
+
+def test_load_rejects_inconsistent_snapshots(tmp_path):
+    path = str(tmp_path / "docs")
+    index = VectorIndex()
+    index.add(_normalized(10))
+    index.save(path)
+
+    with pytest.raises(ValueError):
+        VectorIndex.load(path, embedding_dtype="binary")
+
+    meta_path = os.path.join(path, "meta.json")
+    with open(meta_path, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    meta["ids"] = meta["ids"][:5]
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    with pytest.raises(ValueError):
+        VectorIndex.load(path)
+
+
+def test_load_rejects_directories_without_snapshot(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        VectorIndex.load(str(tmp_path))